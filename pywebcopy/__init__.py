@@ -72,7 +72,8 @@ def save_page(url,
               debug=False,
               open_in_browser=True,
               delay=None,
-              threaded=None,):
+              threaded=None,
+              scheduler=None):
     """Easiest way to save any single webpage with images, css and js.
 
     example::
@@ -87,6 +88,7 @@ def save_page(url,
             open_in_browser=True,
             delay=None,
             threaded=False,
+            scheduler=None,
         )
 
     :param url: url of the web page to work with
@@ -101,9 +103,11 @@ def save_page(url,
     :type open_in_browser: bool
     :param delay: amount of delay between two concurrent requests to a same server.
     :param threaded: whether to use threading or not (it can break some site).
+    :param scheduler: (optional) name of the scheduler i.e. sync, threading, gevent or asyncio.
     """
     from .configs import get_config
-    config = get_config(url, project_folder, project_name, bypass_robots, debug, delay, threaded)
+    config = get_config(url, project_folder, project_name, bypass_robots, debug, delay, threaded,
+                        scheduler=scheduler)
     page = config.create_page()
     page.get(url)
     if threaded:
@@ -123,7 +127,11 @@ def save_website(url,
                  debug=False,
                  open_in_browser=False,
                  delay=None,
-                 threaded=None):
+                 threaded=None,
+                 scheduler=None,
+                 resume=False,
+                 processes=None,
+                 update=False):
     """Crawls the entire website for html, images, css and js.
 
     example::
@@ -138,6 +146,10 @@ def save_website(url,
             open_in_browser=True,
             delay=None,
             threaded=False,
+            scheduler=None,
+            resume=False,
+            processes=None,
+            update=False,
         )
 
     :param url: url of the web page to work with
@@ -152,11 +164,25 @@ def save_website(url,
     :type open_in_browser: bool
     :param delay: amount of delay between two concurrent requests to a same server.
     :param threaded: whether to use threading or not (it can break some site).
+    :param scheduler: (optional) name of the scheduler i.e. sync, threading, gevent or asyncio.
+    :param resume: whether to checkpoint the crawl and continue it from where an
+        earlier interrupted run of the same project has stopped.
+    :param processes: (optional) number of the processes which crawl the site
+        together, each of them crawls a shard of the pages.
+    :param update: whether to refresh an earlier crawl of the same project by
+        downloading only the files which have changed since.
     """
     from .configs import get_config
-    config = get_config(url, project_folder, project_name, bypass_robots, debug, delay, threaded)
+    config = get_config(url, project_folder, project_name, bypass_robots, debug, delay, threaded,
+                        scheduler=scheduler, resume=resume, processes=processes,
+                        overwrite='update' if update else False)
+    if processes and processes > 1:
+        from .core import crawl_in_processes
+        return crawl_in_processes(config)
     crawler = config.create_crawler()
-    crawler.get(url)
+    if not (resume and crawler.scheduler.index.is_done(
+            crawler.scheduler.canonical(crawler.context.url))):
+        crawler.get(url)
     if threaded:
         warnings.warn(
             "Opening in browser is not supported when threading is enabled!")
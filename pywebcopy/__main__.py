@@ -10,6 +10,7 @@ from pywebcopy.__version__ import __version__
 from pywebcopy.__version__ import __description__
 from pywebcopy import save_webpage
 from pywebcopy import save_website
+from pywebcopy.schedulers import scheduler_names
 
 
 parser = optparse.OptionParser(
@@ -36,11 +37,18 @@ parser.add_option('--location', type='string', help='Location where files are to
 #: Optional params
 parser.add_option('-n', '--name', default=None, type='string', help='Project name of this run.')
 parser.add_option('-d', '--delay', type='float', help="Delay between consecutive requests to the server.")
+parser.add_option('--processes', type='int', help='Number of the processes to crawl the site with (--site only).')
+parser.add_option('--scheduler', type='choice', choices=list(scheduler_names),
+                  help='Scheduler used for downloading, one of: %s.' % ', '.join(scheduler_names))
 
 #: Optional flags
 parser.add_option('--bypass_robots', default=True, action='store_true', help='Bypass the robots.txt restrictions.')
 parser.add_option('--threaded', default=False, action='store_true', help='Use threads for faster downloading.')
 parser.add_option('-q', '--quite', default=False, action='store_true', help='Suppress the logging from this library.')
+parser.add_option('--resume', default=False, action='store_true',
+                  help='Continue an interrupted crawl of the same project (--site only).')
+parser.add_option('--update', default=False, action='store_true',
+                  help='Download only the files changed since the last crawl of the project (--site only).')
 parser.add_option('--pop', default=False, action='store_true',
                   help='open the html page in default browser window after finishing the task.')
 
@@ -64,6 +72,7 @@ if args.page:
         debug=not args.quite,
         delay=args.delay,
         threaded=args.threaded,
+        scheduler=args.scheduler,
     )
 elif args.site:
     save_website(
@@ -74,6 +83,10 @@ elif args.site:
         debug=not args.quite,
         delay=args.delay,
         threaded=args.threaded,
+        scheduler=args.scheduler,
+        resume=args.resume,
+        processes=args.processes,
+        update=args.update,
     )
 elif args.tests:
     os.system('%s -m unittest discover -s pywebcopy/tests' % sys.executable)
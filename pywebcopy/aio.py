@@ -0,0 +1,188 @@
+# Copyright 2020; Raja Tomar
+# See license for more details
+"""
+Asyncio networking used by the :class:`pywebcopy.schedulers.AsyncioScheduler`.
+
+This module is Python 3 only and should never be imported directly
+on older interpreters, the scheduler module guards the import.
+"""
+import asyncio
+import functools
+import logging
+import tempfile
+import threading
+
+import requests
+
+from .session import UrlDisallowed
+from .session import make_response
+
+logger = logging.getLogger(__name__)
+
+
+class EventLoopThread(threading.Thread):
+    """Runs an asyncio event loop forever in a background daemon thread
+    so that coroutines can be submitted from synchronous code."""
+
+    def __init__(self, name=None):
+        super(EventLoopThread, self).__init__(name=name or self.__class__.__name__)
+        self.daemon = True
+        self.loop = asyncio.new_event_loop()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """Schedules the coroutine on the loop from any thread.
+
+        :rtype: concurrent.futures.Future
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self, timeout=None):
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.is_alive() and self is not threading.current_thread():
+            self.join(timeout)
+        if not self.loop.is_running():
+            self.loop.close()
+
+
+class AsyncClient(object):
+    """Pooled `aiohttp` client which returns `requests.Response` objects
+    so that the resources can process them like any other response.
+
+    Headers, cookies and robots.txt rules are taken from the
+    `pywebcopy.session.Session` object of each resource. The bodies are
+    spooled to a temporary file once they grow beyond `spool_size` bytes.
+    """
+
+    def __init__(self, limit=100, limit_per_host=0, timeout=None, spool_size=1 << 20):
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError(
+                "aiohttp module is not installed. "
+                "Install it using pip: $ pip install aiohttp"
+            )
+        self.aiohttp = aiohttp
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.spool_size = spool_size
+        self.client = None
+
+    def get_client(self):
+        """Returns the shared client session, creates it on the first call
+        which must happen inside of the running loop."""
+        if self.client is None:
+            aiohttp = self.aiohttp
+            self.client = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.limit, limit_per_host=self.limit_per_host),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                auto_decompress=True,
+            )
+        return self.client
+
+    async def request(self, session, method, url, **kwargs):
+        """Sends the request through the pooled client.
+
+        :param session: `pywebcopy.session.Session` which provides
+            the headers, cookies and access rules.
+        :param method: http verb for transport.
+        :param url: url of the resource.
+        :rtype: requests.Response
+        """
+        loop = asyncio.get_event_loop()
+        if getattr(session, 'adapters_required', False):
+            # The cache and the archives are only reachable through the session.
+            return await loop.run_in_executor(None, functools.partial(
+                self._send_blocking, session, method, url, **kwargs))
+        prep = session.prepare_request(requests.Request(method, url, **kwargs))
+        # Robots.txt rules could need a blocking download on the first call.
+        allowed = await loop.run_in_executor(None, session.is_allowed, prep)
+        if not allowed:
+            err = "Access to [%r] disallowed by the Session rules." % prep.url
+            logger.error(err)
+            raise UrlDisallowed(err)
+
+        wait = session.reserve(prep.url)
+        if wait > 0:
+            logger.debug("Waiting on request for [%r] seconds!" % wait)
+            await asyncio.sleep(wait)
+
+        logger.info('[%s] [%s]' % (prep.method, prep.url))
+        # Body is decompressed by aiohttp itself.
+        headers = dict(prep.headers)
+        try:
+            async with self.get_client().request(
+                    prep.method, prep.url, headers=headers, data=prep.body,
+                    allow_redirects=True) as resp:
+                body = await self._read(session, resp, self.spool())
+        except (self.aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            raise requests.ConnectionError(e, request=prep)
+
+        history = [
+            make_response(
+                prep, r.status, self._headers(r), b'', url=str(r.url), reason=r.reason)
+            for r in resp.history
+        ]
+        return make_response(
+            prep, resp.status, self._headers(resp), body,
+            url=str(resp.url), reason=resp.reason, history=history)
+
+    def _send_blocking(self, session, method, url, **kwargs):
+        """Sends the request through the adapters of the session and reads
+        the body, so that the loop never reads from a socket."""
+        response = session.request(method, url, stream=True, **kwargs)
+        body = self.spool()
+        try:
+            for chunk in response.iter_content(64 * 1024):
+                body.write(chunk)
+        except BaseException:
+            body.close()
+            raise
+        finally:
+            response.close()
+        body.seek(0)
+        ans = make_response(
+            response.request, response.status_code, self._headers(response), body,
+            url=response.url, reason=response.reason, history=response.history)
+        if hasattr(response, 'from_cache'):
+            ans.from_cache = response.from_cache
+        return ans
+
+    def spool(self):
+        """Returns the temporary file which a body is read into."""
+        return tempfile.SpooledTemporaryFile(self.spool_size)
+
+    @staticmethod
+    async def _read(session, resp, spool, chunk_size=64 * 1024):
+        """Reads the body into the spool while consulting the bandwidth
+        budget of the session and returns the spool rewound."""
+        limiter = session.limiter
+        try:
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                spool.write(chunk)
+                if limiter.bytes is not None:
+                    wait = limiter.reserve_bytes(len(chunk))
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+        except BaseException:
+            spool.close()
+            raise
+        spool.seek(0)
+        return spool
+
+    @staticmethod
+    def _headers(resp):
+        return [(k, v) for k, v in resp.headers.items()
+                if k.lower() not in ('content-encoding', 'content-length',
+                                     'transfer-encoding')]
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
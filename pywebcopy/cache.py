@@ -0,0 +1,359 @@
+# Copyright 2020; Raja Tomar
+# See license for more details
+"""
+On-disk http response cache used by the :class:`pywebcopy.session.Session`.
+
+Bodies are stored once per content in files named after their sha256 hash
+and the metadata of the responses is kept in a SQLite database next to
+them. The least recently used responses are evicted once the bodies take
+more than the allowed size.
+"""
+import calendar
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from email.utils import parsedate
+from hashlib import sha256
+
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger(__name__)
+
+#: Statuses which could be cached without explicit freshness information.
+cacheable_statuses = frozenset([200, 203, 300, 301, 308, 404, 410])
+
+#: Headers which describe the transfer of the body rather than the body,
+#: the bodies are stored decoded hence these are dropped.
+transfer_headers = frozenset(['content-encoding', 'content-length', 'transfer-encoding'])
+
+
+def parse_cache_control(value):
+    """Returns the directives of a `Cache-Control` header as a dict,
+    directives without a value are mapped to True.
+
+    :rtype: dict
+    """
+    ans = {}
+    for part in (value or '').split(','):
+        name, sep, arg = part.strip().partition('=')
+        if name:
+            ans[name.lower()] = arg.strip().strip('"') if sep else True
+    return ans
+
+
+def parse_http_date(value):
+    """Returns the seconds since the epoch of an http date or None."""
+    parsed = parsedate(value) if value else None
+    if parsed is None:
+        return None
+    return calendar.timegm(parsed)
+
+
+def _seconds(value):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def freshness_lifetime(headers, now=None):
+    """Returns the seconds for which a response stays fresh in a private
+    cache, as per the `max-age`, `Expires` or the heuristic of the
+    `Last-Modified` header, in this order.
+
+    :param headers: response headers mapping.
+    :param now: (optional) time at which the response was received.
+    """
+    cc = parse_cache_control(headers.get('Cache-Control'))
+    if 'no-cache' in cc:
+        return 0
+    if 'max-age' in cc:
+        return _seconds(cc['max-age']) or 0
+    now = now if now is not None else time.time()
+    date = parse_http_date(headers.get('Date')) or now
+    if 'Expires' in headers:
+        expires = parse_http_date(headers['Expires'])
+        return max(0, expires - date) if expires is not None else 0
+    modified = parse_http_date(headers.get('Last-Modified'))
+    if modified is not None and modified < date:
+        return (date - modified) // 10
+    return 0
+
+
+class CacheEntry(object):
+    """Stored response as found in the :class:`HTTPCache`."""
+
+    __slots__ = ('key', 'status', 'reason', 'headers', 'vary', 'digest',
+                 'size', 'stored', 'path')
+
+    def __init__(self, key, status, reason, headers, vary, digest, size, stored, path):
+        self.key = key
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.vary = vary
+        self.digest = digest
+        self.size = size
+        self.stored = stored
+        self.path = path
+
+    def __repr__(self):
+        return '<%s(key=%s, status=%s)>' % (self.__class__.__name__, self.key, self.status)
+
+    def age(self, now=None):
+        now = now if now is not None else time.time()
+        return (_seconds(self.headers.get('Age')) or 0) + max(0, now - self.stored)
+
+    def is_fresh(self, request_headers=None, now=None):
+        """Whether the response could be served without asking the server."""
+        cc = parse_cache_control((request_headers or {}).get('Cache-Control'))
+        if 'no-cache' in cc or 'no-cache' in (request_headers or {}).get('Pragma', ''):
+            return False
+        age = self.age(now)
+        if 'max-age' in cc and age > (_seconds(cc['max-age']) or 0):
+            return False
+        return freshness_lifetime(self.headers, self.stored) > age
+
+    def validators(self):
+        """Returns the headers which revalidate the stale response."""
+        ans = {}
+        if self.headers.get('ETag'):
+            ans['If-None-Match'] = self.headers['ETag']
+        if self.headers.get('Last-Modified'):
+            ans['If-Modified-Since'] = self.headers['Last-Modified']
+        return ans
+
+
+class HTTPCache(object):
+    """Size capped http response cache stored in a folder.
+
+    :param path: folder which stores the cache.
+    :param max_size: max bytes taken by the stored bodies.
+    :param timeout: seconds to wait for the other processes sharing it.
+    """
+
+    def __init__(self, path, max_size=1 << 30, timeout=60):
+        self.path = path
+        self.max_size = max_size
+        self.folder = os.path.join(path, 'bodies')
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(
+            os.path.join(path, 'index.sqlite'), timeout=timeout, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, status INTEGER, '
+            'reason TEXT, headers TEXT, vary TEXT, digest TEXT, size INTEGER, '
+            'stored REAL, accessed REAL)')
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self.conn.commit()
+        self.total = self.conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM '
+            '(SELECT DISTINCT digest, size FROM responses)').fetchone()[0]
+        self.logger = logger.getChild(self.__class__.__name__)
+
+    def __repr__(self):
+        return '<%s(path=%s)>' % (self.__class__.__name__, self.path)
+
+    @staticmethod
+    def cache_key(request):
+        return request.url
+
+    def body_path(self, digest):
+        return os.path.join(self.folder, digest[:2], digest[2:])
+
+    def lookup(self, request):
+        """Returns the stored response of the request or None.
+
+        :rtype: CacheEntry
+        """
+        key = self.cache_key(request)
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT status, reason, headers, vary, digest, size, stored '
+                'FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        status, reason, headers, vary, digest, size, stored = row
+        vary = json.loads(vary or '{}')
+        for name, value in vary.items():
+            if request.headers.get(name) != value:
+                return None
+        entry = CacheEntry(
+            key, status, reason, CaseInsensitiveDict(json.loads(headers)),
+            vary, digest, size, stored, self.body_path(digest))
+        if not os.path.exists(entry.path):
+            self.delete(key)
+            return None
+        return entry
+
+    def fresh_entry(self, request):
+        """Returns the stored response of the request if it is still fresh.
+
+        :rtype: CacheEntry
+        """
+        if request.method != 'GET':
+            return None
+        entry = self.lookup(request)
+        if entry is not None and entry.is_fresh(request.headers):
+            return entry
+        return None
+
+    def touch(self, entry):
+        with self.lock:
+            self.conn.execute(
+                'UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), entry.key))
+            self.conn.commit()
+
+    @staticmethod
+    def is_storable(request, response):
+        """Whether the response to the request could be stored at all."""
+        if request.method != 'GET' or response.status_code not in cacheable_statuses:
+            return False
+        if 'no-store' in parse_cache_control(request.headers.get('Cache-Control')):
+            return False
+        cc = parse_cache_control(response.headers.get('Cache-Control'))
+        if 'no-store' in cc or response.headers.get('Vary', '').strip() == '*':
+            return False
+        if 'Authorization' in request.headers and 'public' not in cc:
+            return False
+        return True
+
+    def store(self, request, response, chunk_size=64 * 1024):
+        """Writes the body of the response to the cache and returns the
+        entry which replaces it, the body is read in full.
+
+        :rtype: CacheEntry
+        """
+        length = _seconds(response.headers.get('Content-Length'))
+        if length is not None and length > self.max_size:
+            return None
+        digest = sha256()
+        size = 0
+        fd, temp = tempfile.mkstemp(dir=self.folder)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(chunk_size):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            digest = digest.hexdigest()
+            path = self.body_path(digest)
+            if os.path.exists(path):
+                os.remove(temp)
+            else:
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                os.rename(temp, path)
+        except Exception:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        response.close()
+
+        headers = CaseInsensitiveDict(
+            (k, v) for k, v in response.headers.items() if k.lower() not in transfer_headers)
+        headers['Content-Length'] = str(size)
+        vary = dict(
+            (name.strip(), request.headers.get(name.strip()))
+            for name in response.headers.get('Vary', '').split(',') if name.strip())
+        entry = CacheEntry(
+            self.cache_key(request), response.status_code, response.reason,
+            headers, vary, digest, size, time.time(), path)
+        self.save(entry)
+        return entry
+
+    def save(self, entry):
+        """Adds or replaces the entry and evicts the least recently used
+        responses beyond the size cap."""
+        now = time.time()
+        with self.lock:
+            # The body just written could be the very one being replaced.
+            self._forget(entry.key, keep=entry.digest)
+            if not self._is_referenced(entry.digest):
+                self.total += entry.size
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses (key, status, reason, headers, vary, '
+                'digest, size, stored, accessed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (entry.key, entry.status, entry.reason, json.dumps(list(entry.headers.items())),
+                 json.dumps(entry.vary), entry.digest, entry.size, entry.stored, now))
+            self.conn.commit()
+            # A body of unknown length could be larger than the cache itself,
+            # it is kept until the next one is stored.
+            self.evict(keep=entry.key)
+
+    def refresh(self, entry, headers):
+        """Updates a stored response with the headers of a `304` response."""
+        for k, v in headers.items():
+            if k.lower() not in transfer_headers:
+                entry.headers[k] = v
+        entry.stored = time.time()
+        with self.lock:
+            self.conn.execute(
+                'UPDATE responses SET headers = ?, stored = ?, accessed = ? WHERE key = ?',
+                (json.dumps(list(entry.headers.items())), entry.stored, entry.stored, entry.key))
+            self.conn.commit()
+        return entry
+
+    def _is_referenced(self, digest):
+        return self.conn.execute(
+            'SELECT 1 FROM responses WHERE digest = ? LIMIT 1', (digest,)).fetchone() is not None
+
+    def _forget(self, key, keep=None):
+        """Deletes the row of the key and its body unless the body is
+        still referenced, or is the body of the `keep` digest."""
+        row = self.conn.execute(
+            'SELECT digest, size FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return
+        self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+        digest, size = row
+        if not self._is_referenced(digest):
+            self.total -= size
+            if digest == keep:
+                return
+            try:
+                os.remove(self.body_path(digest))
+            except OSError:
+                pass
+
+    def delete(self, key):
+        with self.lock:
+            self._forget(key)
+            self.conn.commit()
+
+    def evict(self, keep=None):
+        """Removes the least recently used responses until the bodies
+        fit in the :attr:`max_size`.
+
+        :param keep: (optional) key of a response which is not removed.
+        """
+        with self.lock:
+            while self.total > self.max_size:
+                rows = self.conn.execute(
+                    'SELECT key FROM responses WHERE key IS NOT ? '
+                    'ORDER BY accessed LIMIT 64', (keep,)).fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    self._forget(row[0])
+                    if self.total <= self.max_size:
+                        break
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            for row in self.conn.execute('SELECT key FROM responses').fetchall():
+                self._forget(row[0])
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
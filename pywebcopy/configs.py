@@ -6,6 +6,7 @@ import sys
 import tempfile
 from functools import partial
 
+from requests.adapters import DEFAULT_POOLSIZE
 from requests.structures import CaseInsensitiveDict
 from six import text_type
 from six import string_types
@@ -15,6 +16,7 @@ from .__version__ import __version__
 from .urls import HIERARCHY
 from .urls import get_host
 from .urls import secure_filename
+from .urls import tracking_params
 from .session import default_headers
 
 __all__ = [
@@ -74,6 +76,9 @@ safe_http_headers = {
         "Gecko/20100101 Firefox/70.0 PyWebCopyBot/%s" % __version__
 }
 
+#: Connections kept open to a same server by the thread per resource scheduler.
+unbounded_pool_size = 32
+
 #: Base configuration with preconfigured values.
 default_config = {
     'debug': False,
@@ -81,16 +86,102 @@ default_config = {
     'project_name': None,
     'project_folder': None,
     'threaded': None,
+    #: Name of the scheduler to use i.e. sync, threading, gevent or asyncio,
+    #: the `threaded` key decides between first two when it is not set.
+    'scheduler': None,
     'thread_join_timeout': None,
+    #: Size of the worker pool used when threading is enabled,
+    #: a thread per resource is used when it is not set.
+    'workers': None,
+    #: Max resources waiting for a free worker before the caller blocks.
+    'queue_size': None,
+    #: Max requests in-flight to a same server, the threading scheduler then
+    #: uses the worker pool which also spaces the requests by the `delay`
+    #: and the crawl delay of the robots.txt.
+    'host_concurrency': None,
+    #: Grows and shrinks the requests in-flight to every server as per its
+    #: latency and errors, the threading scheduler then uses the worker pool.
+    'adaptive': False,
+    #: Connections kept open to a same server, it follows the number of the
+    #: requests which the scheduler sends at once when it is not set.
+    'pool_size': None,
+    #: Number of the processes which parse and rewrite the pages while the
+    #: scheduler keeps fetching, the pages are parsed in the fetching threads
+    #: if it is not set. It is only available on python 3.
+    'parse_processes': None,
+    #: Layout of the saved files i.e. HIERARCHY, LINEAR or SHARDED, the
+    #: sharded tree spreads the files over hashed folders for huge mirrors.
     'tree_type': HIERARCHY,
-
-    # TODO: Allow a `last-modified-time` overwrite mode
+    #: Storage of the url to file path index i.e. memory, compact, sqlite or
+    #: bloom, the compact index takes a fraction of the memory of the default
+    #: one, the sqlite index is stored in the project folder and survives
+    #: restarts, the bloom index only keeps the recent paths and a filter of seen urls.
+    'index_type': None,
+    #: Max share of the new urls which the bloom index takes for seen ones.
+    'bloom_error_rate': 0.001,
+    #: Max number of links between the first page and a crawled page,
+    #: pages which are farther are linked to their online location.
+    'max_depth': None,
+    #: Indexes the urls in their canonical form so that the equivalent urls
+    #: are fetched once, the hosts and schemes are lowercased, default ports,
+    #: fragments, dot-segments and the `strip_query_params` are removed.
+    'canonicalize': False,
+    #: Query parameters removed from the canonical urls, names ending in a `*`
+    #: are prefixes, the well known tracking parameters are removed by default.
+    'strip_query_params': tracking_params,
+    #: Whether the parameters of the canonical urls are sorted by their names.
+    'sort_query': False,
+    #: Checkpoints the crawl state in the project folder and continues
+    #: an interrupted crawl of the same project instead of starting over,
+    #: implies the sqlite index.
+    'resume': False,
+    #: Number of the processes which crawl the site together, each of them
+    #: crawls the pages of a shard and they share the sqlite index.
+    'processes': None,
+    #: Part of the urls which is hashed into the shards i.e. host or path.
+    'shard_by': 'path',
+    #: Shard crawled by this process, it is set by the sharded crawl itself.
+    'shard': None,
+
+    #: Whether the existing files are overwritten, in the `'update'` mode
+    #: the validators of the saved files are stored in the project folder
+    #: and the later crawls only download the files which have changed.
     'overwrite': False,
 
     'bypass_robots': False,
+    #: Seconds for which the robots.txt rules are stored in the project
+    #: folder and reused by the later crawls, they are not stored if unset.
+    'robots_cache_ttl': None,
+    #: Stores the responses in the project folder and serves them from
+    #: there while they are fresh as per their http caching headers.
     'http_cache': False,
+    #: Max bytes taken by the bodies of the http cache.
+    'http_cache_size': 1 << 30,
+    #: Archive file in which every request and response of the run is recorded.
+    'record': None,
+    #: Archive file recorded by an earlier run which answers all the requests
+    #: instead of the network, the crawls are then fully reproducible.
+    'replay': None,
+    #: Time taken by the replayed requests, i.e. 'recorded' or seconds.
+    'replay_latency': None,
+    #: Writes the requests and the responses to gzip compressed WARC files
+    #: in the `warc` folder of the project while the crawl runs.
+    'warc': False,
+    #: Bytes after which the next WARC file is started.
+    'warc_size': 1 << 30,
+    #: Whether the rewritten files are saved in the project folder, it could
+    #: be turned off when the WARC files are all that is needed.
+    'mirror': True,
+    #: Where the files are saved i.e. filesystem, zip, tar, sqlite or memory,
+    #: the containers keep all the files of the project in a single file
+    #: instead of a folder tree, only the sqlite one works with the processes.
+    'storage': None,
     'http_headers': default_headers(**safe_http_headers),
     'delay': None,
+    #: Max requests per second across all the servers.
+    'rate_limit': None,
+    #: Max bytes per second downloaded across all the servers.
+    'bandwidth_limit': None,
 
     # TODO: Disabled for now until I figure it out.
     # 'allowed_file_types': safe_file_types,
@@ -196,7 +287,10 @@ class ConfigHandler(CaseInsensitiveDict):
                      bypass_robots=False,
                      debug=False,
                      delay=None,
-                     threaded=None):
+                     threaded=None,
+                     scheduler=None,
+                     resume=False,
+                     processes=None):
         """Sets up the complete config parts which requires a project_url to be present.
 
         Complete configuration is done here and subject to change according to application structure
@@ -207,6 +301,9 @@ class ConfigHandler(CaseInsensitiveDict):
         self.set_debug(debug)
         self.set_delay(delay)
         self.set_threaded(threaded)
+        self.set_scheduler(scheduler)
+        self.set_resume(resume)
+        self.set_processes(processes)
         self.set_project_url(project_url)
         self.setup_paths(project_folder, project_name)
 
@@ -217,12 +314,99 @@ class ConfigHandler(CaseInsensitiveDict):
         #: Log this new configuration to the log file for debug purposes
         logger.debug(str(dict(self)))
 
+    def metadata_path(self, *parts):
+        """Returns a path inside of the hidden metadata folder of the project
+        which stores the crawl state like the index."""
+        if not self.is_set():
+            raise ConfigError("Config is missing required attributes!")
+        folder = os.path.join(self.get('project_folder'), '.%s' % __title__)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        return os.path.join(folder, *parts)
+
+    def create_index(self):
+        if not self.is_set():
+            raise ConfigError("Config is missing required attributes!")
+        from .schedulers import Index
+        from .schedulers import BloomIndex
+        from .schedulers import CompactIndex
+        from .schedulers import SqliteIndex
+        from .schedulers import SharedIndex
+        index_type = self.get('index_type')
+        if (self.get('processes') or 1) > 1:
+            index_type = 'shared'
+        elif index_type is None and self.get('resume'):
+            index_type = 'sqlite'
+        if index_type in (None, 'memory'):
+            return Index()
+        if index_type == 'sqlite':
+            ans = SqliteIndex(self.metadata_path('index.sqlite'))
+            if not self.get('resume'):
+                # Only the resumed crawls continue from the earlier state.
+                ans.clear()
+            return ans
+        if index_type == 'compact':
+            return CompactIndex(self.get('project_folder'))
+        if index_type == 'bloom':
+            return BloomIndex(error_rate=self.get('bloom_error_rate') or 0.001)
+        if index_type == 'shared':
+            return SharedIndex(self.metadata_path('index.sqlite'))
+        raise ConfigError("Unknown index_type %r" % index_type)
+
+    def create_storage(self):
+        """Returns the storage backend selected by the `storage` key, the
+        container files are named after the project in its folder."""
+        if not self.is_set():
+            raise ConfigError("Config is missing required attributes!")
+        from .storage import file_storage
+        from .storage import storage_types
+        storage_type = self.get('storage') or 'filesystem'
+        if storage_type not in storage_types:
+            raise ConfigError(
+                "Unknown storage %r, expected one of %r" % (storage_type, sorted(storage_types)))
+        if storage_type == 'filesystem':
+            return file_storage
+        if (self.get('processes') or 1) > 1 and storage_type != 'sqlite':
+            raise ConfigError(
+                "The %r storage can't be shared by the processes, use sqlite instead."
+                % storage_type)
+        folder = self.get('project_folder')
+        cls, ext = storage_types[storage_type]
+        if ext is None:
+            return cls(folder)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        return cls(os.path.join(folder, self.get('project_name') + ext), folder)
+
     def create_context(self):
         if not self.is_set():
             raise ConfigError("Config is missing required attributes!")
         from .urls import Context
         return Context.from_config(self)
 
+    def connection_pool_size(self):
+        """Returns the number of the connections which the session keeps
+        open to a same server, it is the `pool_size` key if it is set or the
+        number of the requests which the selected scheduler sends at once."""
+        if self.get('pool_size'):
+            return self.get('pool_size')
+        name = self.get('scheduler')
+        if name is None:
+            name = 'threading' if self.get('threaded') else 'sync'
+        workers = self.get('workers')
+        if name == 'threading':
+            if workers or self.get('host_concurrency') or self.get('adaptive'):
+                width = workers or 8
+            else:
+                # A thread per resource, i.e. every file of a page at once.
+                width = unbounded_pool_size
+        elif name == 'gevent':
+            width = workers or 4
+        else:
+            # The asyncio scheduler fetches through its own client.
+            width = 1
+        return max(DEFAULT_POOLSIZE, width)
+
     def create_session(self):
         if not self.is_set():
             raise ConfigError("Config is missing required attributes!")
@@ -248,7 +432,11 @@ def get_config(project_url,
                bypass_robots=False,
                debug=False,
                delay=None,
-               threaded=None):
+               threaded=None,
+               scheduler=None,
+               resume=False,
+               processes=None,
+               overwrite=False):
     """Create a ConfigHandler instance and return it.
     If the project_folder is not supplied it will use the users Tempdir.
 
@@ -262,6 +450,11 @@ def get_config(project_url,
     :param debug: whether to print deep logs or not.
     :param delay: amount of delay between two concurrent requests to a same server.
     :param threaded: whether to use threading or not (it can break some site).
+    :param scheduler: (optional) name of the scheduler i.e. sync, threading, gevent or asyncio.
+    :param resume: whether to continue an interrupted crawl of the same project.
+    :param processes: (optional) number of the processes to crawl the site with.
+    :param overwrite: whether to overwrite the existing files, or 'update' to
+        download only the files which have changed since the last crawl.
     """
     if not isinstance(project_url, string_types):
         raise ConfigError("Expected string type, got %r" % project_url)
@@ -288,5 +481,9 @@ def get_config(project_url,
         debug=debug,
         delay=delay,
         threaded=threaded,
+        scheduler=scheduler,
+        resume=resume,
+        processes=processes,
+        overwrite=overwrite,
     )
     return ans
@@ -1,16 +1,15 @@
 # Copyright 2020; Raja Tomar
 # See license for more details
 import logging
+import multiprocessing
 import operator
 import os
+import time
 
 from .elements import WebElement
-from .schedulers import crawler_scheduler
-from .schedulers import default_scheduler
-from .schedulers import threading_crawler_scheduler
-from .schedulers import threading_default_scheduler
+from .schedulers import scheduler_from_config
 
-__all__ = ['WebPage', 'Crawler']
+__all__ = ['WebPage', 'Crawler', 'crawl_in_processes']
 
 logger = logging.getLogger(__name__)
 
@@ -28,18 +27,14 @@ class WebPage(WebElement):
         """It creates a `WebPage` object from a set config object.
         Under the hood it checks whether the config is set or not,
         then it creates a `session` using the `config.create_session()` method.
-        It then creates a `scheduler` based on whether the threading is enabled or not.
+        It then creates a `scheduler` based on the `scheduler` and `threaded` keys.
         It also defines a `context` object which stores the path metadata for this structure.
         """
         if config and not config.is_set():
             raise AttributeError("Configuration is not setup.")
 
         session = config.create_session()
-        if config.get('threaded'):
-            scheduler = threading_default_scheduler(
-                timeout=config.get_thread_join_timeout())
-        else:
-            scheduler = default_scheduler()
+        scheduler = scheduler_from_config(config, crawler=False)
         context = config.create_context()
         ans = cls(session, config, scheduler, context)
         # XXX: Check connection to the url here?
@@ -58,6 +53,12 @@ class WebPage(WebElement):
         compact form with checks and validation.
         """
         self.scheduler.handle_resource(self)
+        self.scheduler.join()
+        if hasattr(self.session, 'pool_usage'):
+            self.logger.info("Connection pool usage: %r" % (self.session.pool_usage(),))
+        if getattr(self.session, 'warc', None) is not None:
+            self.session.warc.flush()
+        self.storage.flush()
         if pop:
             self.open_in_browser()
         return self.filepath
@@ -88,7 +89,7 @@ class Crawler(WebPage):
         It creates a `Crawler` object from a set config object.
         Under the hood it checks whether the config is set or not,
         then it creates a `session` using the `config.create_session()` method.
-        It then creates a `scheduler` based on whether the threading is enabled or not.
+        It then creates a `scheduler` based on the `scheduler` and `threaded` keys.
         The scheduler is different from the `WebPage` objects scheduler due to its
         ability to process the anchor tags links to different pages.
         It also defines a `context` object which stores the path metadata for this structure.
@@ -97,12 +98,71 @@ class Crawler(WebPage):
             raise AttributeError("Configuration is not setup.")
 
         session = config.create_session()
-        if config.get('threaded'):
-            scheduler = threading_crawler_scheduler(
-                timeout=config.get_thread_join_timeout())
-        else:
-            scheduler = crawler_scheduler()
+        scheduler = scheduler_from_config(config, crawler=True)
         context = config.create_context()
         ans = cls(session, config, scheduler, context)
         # XXX: Check connection to the url here?
         return ans
+
+
+def crawl_shard(config, shard):
+    """Crawls a shard of the site in a process of a sharded crawl.
+
+    :param config: items of the project configuration.
+    :param shard: number of the shard owned by this process.
+    """
+    from .configs import ConfigHandler
+    config = ConfigHandler(config)
+    config.set_shard(shard)
+    crawler = config.create_crawler()
+    try:
+        crawler.save_complete()
+    finally:
+        crawler.scheduler.index.close()
+
+
+def crawl_in_processes(config, timeout=None):
+    """Crawls the site using as many processes as set in the `processes`
+    key of the config, each of them crawls the pages of its own shard.
+
+    The processes share the sqlite index of the project hence no url is
+    fetched twice and all of them write in the same project folder.
+    A failed process stops the crawl, which can be resumed later.
+
+    :param config: project configuration handler.
+    :param timeout: (optional) max seconds to wait for the crawl.
+    """
+    if config and not config.is_set():
+        raise AttributeError("Configuration is not setup.")
+    processes = config.get('processes') or 1
+    index = config.create_index()
+    index.prepare(processes, resume=config.get('resume'))
+    index.close()
+
+    workers = [
+        multiprocessing.Process(
+            target=crawl_shard, args=(dict(config), shard),
+            name='%s-%d' % (__name__, shard))
+        for shard in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    end = None if timeout is None else time.time() + timeout
+    try:
+        while True:
+            failed = [worker for worker in workers if worker.exitcode]
+            if failed:
+                raise RuntimeError(
+                    "Crawl process %s failed with exit code %r"
+                    % (failed[0].name, failed[0].exitcode))
+            if not any(worker.is_alive() for worker in workers):
+                break
+            if end is not None and time.time() > end:
+                raise RuntimeError("Crawl processes did not finish in time.")
+            time.sleep(0.5)
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                logger.error("Terminating crawl process %s" % worker.name)
+                worker.terminate()
+            worker.join()
@@ -23,11 +23,13 @@ from six.moves.urllib.request import pathname2url
 from .__version__ import __version__
 from .helpers import RewindableResponse
 from .helpers import cached_property
+from .parsers import extract_links
 from .parsers import iterparse
+from .parsers import rewrite_links
 from .parsers import unquote_match
+from .storage import file_storage
 from .urls import get_content_type_from_headers
 from .urls import relate
-from .urls import retrieve_resource
 
 logger = logging.getLogger(__name__)
 
@@ -37,10 +39,32 @@ class ResponseWrapper(object):
     config = None
     context = None
     response = None
+    #: Url under which the scheduler has indexed this resource,
+    #: the url of the context could change after redirects.
+    index_key = None
+    #: Path predicted by the scheduler before the resource was fetched
+    #: which is kept even if the server reports a different content-type,
+    #: as the files referring to this resource could be using it already.
+    pinned_path = None
+    #: Html path pinned for a page whose url doesn't tell its type, a
+    #: download linked like a page is saved at the path of its real
+    #: content-type and this path redirects to it.
+    guessed_path = None
+    #: Stored validators of the earlier download which were sent along
+    #: with the request, see :meth:`conditional_headers`.
+    validated = None
+    #: Links found in this resource as (tag, url) pairs, they are collected
+    #: only if the scheduler stores them for the later crawls.
+    links = None
 
     def __del__(self):
         self.close()
 
+    @property
+    def storage(self):
+        """Storage backend of the files as set in the context."""
+        return getattr(self.context, 'storage', None) or file_storage
+
     def close(self):
         """Releases the underlying urllib connection and
         then deletes the response"""
@@ -131,7 +155,10 @@ class ResponseWrapper(object):
         self.__dict__.pop('url', None)
         self.__dict__.pop('filepath', None)
         self.__dict__.pop('filename', None)
-        if hasattr(response, 'ok') and response.ok:
+        if self.validated is not None and getattr(response, 'status_code', None) == 304:
+            # The file saved earlier is still fresh.
+            self.pinned_path = self.validated['path']
+        elif hasattr(response, 'ok') and response.ok:
             self.__dict__.pop('content_type', None)
             self.__dict__.pop('encoding', None)
             self.context = self.context.with_values(
@@ -154,9 +181,28 @@ class ResponseWrapper(object):
             warnings.warn(UserWarning(
                 "Stream attribute is True by default for reasons."
             ))
+        if method == 'GET':
+            headers = self.conditional_headers()
+            if headers:
+                params['headers'] = dict(params.get('headers') or {}, **headers)
         self.set_response(
             self.session.request(method, url, stream=True, **params))
 
+    def conditional_headers(self):
+        """Returns the headers which ask the server to skip the body if the
+        file saved by an earlier crawl of this resource hasn't changed.
+
+        :rtype: dict
+        """
+        validators = getattr(self.scheduler, 'validators', None)
+        if validators is None:
+            return {}
+        record = validators.get(self.index_key or self.context.url)
+        headers = validators.conditional_headers(record, self.storage)
+        if headers:
+            self.validated = record
+        return headers
+
     def get(self, url, **params):
         """Initiates an `get` request for the given url.
         It uses the `.set_response()` method underneath to
@@ -243,6 +289,8 @@ class GenericResource(ResponseWrapper):
         self.scheduler = scheduler
         self.context = context
         self.response = None
+        if getattr(scheduler, 'validators', None) is not None:
+            self.links = []
         if response:
             self.set_response(response)
         self.logger = logger.getChild(self.__class__.__name__)
@@ -254,6 +302,8 @@ class GenericResource(ResponseWrapper):
     def filepath(self):
         """Returns if available a valid filepath
          where this file should be written."""
+        if self.pinned_path is not None:
+            return self.pinned_path
         if self.context is None:
             raise AttributeError("Context attribute is not set.")
         if self.response is not None:
@@ -274,8 +324,36 @@ class GenericResource(ResponseWrapper):
                 "You need to fetch the resource using get method!"
             )
         # XXX: Validate resource here?
+        if self.response.status_code == 304 and self.validated is not None:
+            return self._retrieve_not_modified()
         return self._retrieve()
 
+    def _retrieve_not_modified(self):
+        """Keeps the file saved by an earlier crawl and follows its links again."""
+        self.logger.info(
+            "[%s] is not modified since the file [%s] was saved."
+            % (self.url, self.filepath))
+        for tag, url in self.validated['links']:
+            if self.scheduler.validate_url(url):
+                self.schedule_child(tag, url)
+        return self.filepath
+
+    def schedule_child(self, tag, url):
+        """Hands over the resource linked in the `tag` to the scheduler,
+        resources linked without a tag are handled like this one."""
+        if self.links is not None:
+            self.links.append((tag, url))
+        sub_context = self.context.create_new_from_url(url)
+        if tag is None:
+            ans = self.__class__(
+                self.session, self.config, self.scheduler, sub_context)
+        else:
+            ans = self.scheduler.get_handler(
+                tag,
+                self.session, self.config, self.scheduler, sub_context)
+        self.scheduler.handle_resource(ans)
+        return ans
+
     def _retrieve(self):
         #: Not ok response received from the server
         if not 100 <= self.response.status_code <= 400:
@@ -298,11 +376,21 @@ class GenericResource(ResponseWrapper):
             else:
                 content = self.response.raw
 
-        retrieve_resource(
-            content, self.filepath, self.context.url, self.config.get('overwrite'))
+        self.write(content, self.config.get('overwrite'))
         del content
         return self.filepath
 
+    def write(self, content, overwrite=False):
+        """Writes the content to the file of this resource, unless the
+        `mirror` key of the config is off and the files aren't saved at all.
+
+        :param content: file like object with read method.
+        :param overwrite: (optional) whether to overwrite an existing file.
+        """
+        if self.config is not None and not self.config.get('mirror', True):
+            return self.filepath
+        return self.storage.write(content, self.filepath, self.context.url, overwrite)
+
     def resolve(self, parent_path=None):
         """Returns a relative url at which this resource should be accessed
         by the parent file.
@@ -335,28 +423,62 @@ class HTMLResource(GenericResource):
         for processing. Then the final path of the element is updated
         in the `pywebcopy.parsers.iterparse` object.
 
+        Every element is handed over before any path is resolved, so that
+        the downloads of the concurrent schedulers overlap with the parsing
+        and the paths which are only known after a download are waited
+        for at the very end.
+
         :param parsing_buffer: `iterparse` object.
         """
         location = self.filepath
+        children = []
 
         for elem, attr, url, pos in parsing_buffer:
             if not self.scheduler.validate_url(url):
                 continue
+            children.append((elem, attr, url, pos, self.schedule_child(elem.tag, url)))
 
-            sub_context = self.context.create_new_from_url(url)
-            ans = self.scheduler.get_handler(
-                elem.tag,
-                self.session, self.config, self.scheduler, sub_context)
-            self.scheduler.handle_resource(ans)
-            resolved = ans.resolve(location)
+        # Links are replaced in the order they were found in
+        # as the parser yields them ready for in-place changes.
+        deadline = self.scheduler.wait_deadline()
+        for elem, attr, url, pos, ans in children:
+            resolved = self.scheduler.resolve_child(ans, location, deadline)
             elem.replace_url(url, resolved, attr, pos)
 
         return parsing_buffer
 
+    def _retrieve_in_pool(self, executor):
+        """Parses and rewrites the page in the process pool executor.
+
+        Only the bytes of the page and the lists of the urls cross the
+        process boundary, the children are still scheduled in this thread.
+        """
+        source, encoding = self.get_source(buffered=False)
+        location = self.filepath
+        children = []
+        for tag, url in executor.submit(extract_links, source, encoding).result():
+            if self.scheduler.validate_url(url):
+                children.append(self.schedule_child(tag, url))
+            else:
+                children.append(None)
+        deadline = self.scheduler.wait_deadline()
+        urls = [self.scheduler.resolve_child(ans, location, deadline) if ans is not None else None
+                for ans in children]
+        del children
+        content = executor.submit(
+            rewrite_links, source, encoding, urls, self._get_watermark()).result()
+
+        self.write(BytesIO(content), overwrite=True)
+
+        self.logger.debug('Retrieved content from the url: [%s]' % self.url)
+        return self.filepath
+
     def _retrieve(self):
         if not self.viewing_html():
             self.logger.info(
                 "Resource of type [%s] is not HTML." % self.content_type)
+            if self.guessed_path is not None and self.response.ok:
+                return self._retrieve_moved()
             return super(HTMLResource, self)._retrieve()
 
         if not self.response.ok:
@@ -364,19 +486,40 @@ class HTMLResource(GenericResource):
                 "Resource at [%s] is NOT ok and will be NOT processed." % self.url)
             return super(HTMLResource, self)._retrieve()
 
+        executor = getattr(self.scheduler, 'process_pool', None)
+        if executor is not None:
+            return self._retrieve_in_pool(executor)
+
         context = self.extract_children(self.parse())
 
         # WaterMarking :)
         context.root.insert(0, HtmlComment(self._get_watermark()))
 
-        retrieve_resource(
-            BytesIO(tostring(context.root, include_meta_content_type=True)),
-            self.filepath, self.context.url, overwrite=True)
+        self.write(
+            BytesIO(tostring(context.root, include_meta_content_type=True)), overwrite=True)
 
         self.logger.debug('Retrieved content from the url: [%s]' % self.url)
         del context
         return self.filepath
 
+    def _retrieve_moved(self):
+        """Saves the file at the path of its content-type and a redirect
+        to it at the html path which the referring files are using."""
+        self.pinned_path = None
+        self.__dict__.pop('filepath', None)
+        ans = super(HTMLResource, self)._retrieve()
+        if ans == self.guessed_path:
+            return ans
+        self.logger.info(
+            "[%s] is not a page, it is moved from [%s] to [%s]"
+            % (self.url, self.guessed_path, ans))
+        if self.config is None or self.config.get('mirror', True):
+            redirect = '<html><head><meta http-equiv="refresh" content="0; url=%s"></head></html>'
+            self.storage.write(
+                BytesIO((redirect % pathname2url(relate(ans, self.guessed_path))).encode('utf-8')),
+                self.guessed_path, self.context.url, overwrite=True)
+        return ans
+
     def _get_watermark(self):
         # comment text should be in Unicode
         return dedent("""
@@ -554,7 +697,7 @@ class CSSResource(GenericResource):
         """Returns the `.get_source(buffered=False)`."""
         return self.get_source(buffered=False)
 
-    def repl(self, match, encoding=None, fmt=None):
+    def repl(self, match, encoding=None, fmt=None, deadline=None):
         """
         Schedules the linked files for downloading then resolves their references.
         """
@@ -566,15 +709,10 @@ class CSSResource(GenericResource):
         if not self.scheduler.validate_url(url):
             return url.encode(encoding)
 
-        sub_context = self.context.create_new_from_url(url)
-        self.logger.debug('Creating context for url: %s as %s' % (url, sub_context))
-        ans = self.__class__(
-            self.session, self.config, self.scheduler, sub_context
-        )
-        # self.children.add(ans)
         self.logger.debug("Submitting resource: [%s] to the scheduler." % url)
-        self.scheduler.handle_resource(ans)
-        re_enc = (fmt % ans.resolve(self.filepath)).encode(encoding)
+        ans = self.schedule_child(None, url)
+        re_enc = (fmt % self.scheduler.resolve_child(
+            ans, self.filepath, deadline)).encode(encoding)
         self.logger.debug("Re-encoded the resource: [%s] as [%r]" % (url, re_enc))
         return re_enc
 
@@ -585,14 +723,15 @@ class CSSResource(GenericResource):
         within the css file or style tag using the `url()` construct.
         """
         source, encoding = parsing_buffer
+        deadline = self.scheduler.wait_deadline()
         source = re.sub(
             (r'url\((' + '["][^"]*["]|' + "['][^']*[']|" + r'[^)]*)\)').encode(encoding),
-            partial(self.repl, encoding=encoding, fmt="url('%s')"),
+            partial(self.repl, encoding=encoding, fmt="url('%s')", deadline=deadline),
             source, flags=re.IGNORECASE
         )
         source = re.sub(
             r'@import "(.*?)"'.encode(encoding),
-            partial(self.repl, encoding=encoding, fmt='"%s"'),
+            partial(self.repl, encoding=encoding, fmt='"%s"', deadline=deadline),
             source, flags=re.IGNORECASE
         )
         return BytesIO(source)
@@ -611,10 +750,7 @@ class CSSResource(GenericResource):
 
         self.logger.debug(
             "Resource at [%s] is ok and will be processed." % self.url)
-        retrieve_resource(
-            self.extract_children(self.parse()),
-            self.filepath, self.url, self.config.get('overwrite')
-        )
+        self.write(self.extract_children(self.parse()), self.config.get('overwrite'))
         self.logger.debug("Finished processing resource [%s]" % self.url)
         return self.filepath
 
@@ -624,7 +760,7 @@ class JSResource(GenericResource):
         """Returns the `.get_source(buffered=False)`."""
         return self.get_source(buffered=False)
 
-    def repl(self, match, encoding=None, fmt=None):
+    def repl(self, match, encoding=None, fmt=None, deadline=None):
         """
         Schedules the linked files for downloading then resolves their references.
         """
@@ -636,15 +772,10 @@ class JSResource(GenericResource):
         if not self.scheduler.validate_url(url):
             return url.encode(encoding)
 
-        sub_context = self.context.create_new_from_url(url)
-        self.logger.debug('Creating context for url: %s as %s' % (url, sub_context))
-        ans = self.__class__(
-            self.session, self.config, self.scheduler, sub_context
-        )
-        # self.children.add(ans)
         self.logger.debug("Submitting resource: [%s] to the scheduler." % url)
-        self.scheduler.handle_resource(ans)
-        re_enc = (fmt % ans.resolve(self.filepath)).encode(encoding)
+        ans = self.schedule_child(None, url)
+        re_enc = (fmt % self.scheduler.resolve_child(
+            ans, self.filepath, deadline)).encode(encoding)
         self.logger.debug("Re-encoded the resource: [%s] as [%r]" % (url, re_enc))
         return re_enc
 
@@ -665,7 +796,8 @@ class JSResource(GenericResource):
             (r'url\((' + '["][^"]*["]|' + "['][^']*[']|" + r'[^)]*)\)'
              ).encode(encoding),
             partial(
-                self.repl, encoding=encoding, fmt='url("%s")'
+                self.repl, encoding=encoding, fmt='url("%s")',
+                deadline=self.scheduler.wait_deadline()
             ), source, flags=re.IGNORECASE
         )
         return BytesIO(source)
@@ -681,10 +813,7 @@ class JSResource(GenericResource):
             return super(JSResource, self)._retrieve()
 
         self.logger.debug("Resource at [%s] is ok and will be processed." % self.url)
-        retrieve_resource(
-            self.extract_children(self.parse()),
-            self.filepath, self.url, self.config.get('overwrite')
-        )
+        self.write(self.extract_children(self.parse()), self.config.get('overwrite'))
         self.logger.debug("Finished processing resource [%s]" % self.url)
         return self.filepath
 
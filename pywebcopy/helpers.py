@@ -1,11 +1,19 @@
 # Copyright 2020; Raja Tomar
 # See license for more details
+import hashlib
+import math
+import struct
 import time
 import functools
 import threading
+import warnings
+from array import array
+from collections import namedtuple
 
 from requests.compat import OrderedDict
 from six import BytesIO
+from six import PY3
+from six import text_type
 from six.moves.collections_abc import MutableMapping
 
 
@@ -57,9 +65,15 @@ class ConcurrentDelay(object):
     for example if time between two calls for delay are 10 seconds apart
     but the timeout is set for 1 second then the second call will not block
     but a successive third call will be blocked for 1 second before completing.
+
+    .. deprecated::
+        Use the :class:`TokenBucket` or the :class:`RateLimiter` instead.
     """
 
     def __init__(self, timeout=1 / 10):
+        warnings.warn(
+            "ConcurrentDelay is deprecated, use the TokenBucket or the RateLimiter instead.",
+            DeprecationWarning, stacklevel=2)
         self.timeout = None
         self.set_timeout(timeout)
         self.start_time = time.time()
@@ -87,31 +101,412 @@ class ConcurrentDelay(object):
             self.start_time = current_time
 
 
+#: Clock which never goes backwards where it is available.
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket which refills at `rate` tokens per second
+    up to the `capacity`.
+
+    Tokens are reserved instead of waited for, a reservation always succeeds
+    and returns the seconds the caller has to wait before using the tokens.
+    The bucket goes in debt for reservations beyond the available tokens so
+    concurrent callers get consecutive slots exactly `n / rate` apart, which
+    makes it usable from the threads as well as from an event loop.
+    """
+
+    def __init__(self, rate, capacity=1):
+        if not rate > 0:
+            raise ValueError("Rate must be greater than 0, got %r" % rate)
+        self.rate = float(rate)
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(monotonic())
+            self.rate = float(rate)
+
+    def reserve(self, n=1, delay=0):
+        """Takes `n` tokens and returns the seconds to wait before using them.
+
+        :param delay: (optional) seconds after which the tokens are used,
+            the returned wait is never shorter than it.
+        """
+        with self._lock:
+            self._refill(monotonic())
+            # Tokens refilled beyond the capacity until then would be lost,
+            # these pay for the later use before the available ones.
+            spare = max(0, self.tokens + delay * self.rate - self.capacity)
+            self.tokens -= max(0, n - spare)
+            if self.tokens >= 0:
+                return delay
+            return max(delay, -self.tokens / self.rate)
+
+    def wait_time(self, n=1, delay=0):
+        """Returns the seconds until `n` tokens are available without taking them."""
+        with self._lock:
+            self._refill(monotonic())
+            if self.tokens >= n:
+                return delay
+            return max(delay, (n - self.tokens) / self.rate)
+
+    def acquire(self, n=1):
+        """Blocks until the `n` tokens could be used."""
+        wait = self.reserve(n)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class RateLimiter(object):
+    """
+    Combines a global and a per host requests budget with a bytes per second
+    budget, every budget is a :class:`TokenBucket`.
+
+    :param rate: max requests per second across all the hosts.
+    :param bandwidth: max bytes per second across all the hosts.
+    """
+
+    def __init__(self, rate=None, bandwidth=None):
+        self.rate = rate
+        self.bandwidth = bandwidth
+        self.requests = TokenBucket(rate) if rate else None
+        # A second worth of bytes could be read in one go.
+        self.bytes = TokenBucket(bandwidth, bandwidth) if bandwidth else None
+        self.hosts = {}
+        self._lock = threading.Lock()
+
+    def host_bucket(self, host, interval):
+        """Returns the bucket of the host which allows a request every `interval` seconds."""
+        with self._lock:
+            bucket = self.hosts.get(host)
+            if bucket is None:
+                bucket = self.hosts[host] = TokenBucket(1.0 / interval)
+        if bucket.rate != 1.0 / interval:
+            bucket.set_rate(1.0 / interval)
+        return bucket
+
+    def reserve(self, host, interval=None):
+        """Reserves a request to the host and returns the seconds to wait before sending it.
+
+        :param host: network location of the request.
+        :param interval: (optional) min seconds between two requests to the host.
+        """
+        wait = 0
+        if interval:
+            wait = self.host_bucket(host, interval).reserve()
+        if self.requests is not None:
+            # The global slot is taken for when the host allows the request,
+            # a request waiting on its host doesn't hold back the other hosts.
+            wait = self.requests.reserve(delay=wait)
+        return wait
+
+    def wait_time(self, host, interval=None):
+        """Returns the seconds until a request to the host is allowed."""
+        wait = 0
+        if interval:
+            wait = self.host_bucket(host, interval).wait_time()
+        if self.requests is not None:
+            wait = self.requests.wait_time(delay=wait)
+        return wait
+
+    def acquire(self, host, interval=None):
+        """Blocks until a request to the host is allowed."""
+        wait = self.reserve(host, interval)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def reserve_bytes(self, n):
+        """Reserves `n` bytes of the bandwidth and returns the seconds to wait."""
+        if self.bytes is None or not n:
+            return 0
+        return self.bytes.reserve(n)
+
+    def throttle(self, n):
+        """Blocks until the `n` bytes which are already read fit in the bandwidth."""
+        wait = self.reserve_bytes(n)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class BytesTable(object):
+    """
+    Append only set of byte strings which numbers them in the order they
+    are added. The strings are kept back to back in a single buffer and
+    looked up using an open addressing table of integers, hence there is
+    no python object per string.
+
+    It is not thread-safe, the callers should synchronise the additions.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offsets = array('L', [0])
+        self.slots = array('l', [-1]) * 8
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, n):
+        return bytes(self.buffer[self.offsets[n]:self.offsets[n + 1]])
+
+    def _probe(self, key):
+        """Returns the slot of the key and its number, or -1 if it isn't added."""
+        slots, offsets, buffer = self.slots, self.offsets, self.buffer
+        mask = len(slots) - 1
+        i = hash(key) & mask
+        while True:
+            n = slots[i]
+            if n < 0 or buffer[offsets[n]:offsets[n + 1]] == key:
+                return i, n
+            i = (i + 1) & mask
+
+    def find(self, key):
+        """Returns the number of the key, or -1 if it isn't added."""
+        return self._probe(key)[1]
+
+    def add(self, key):
+        """Adds the key if it isn't added yet and returns its number."""
+        i, n = self._probe(key)
+        if n >= 0:
+            return n
+        n = len(self)
+        self.buffer += key
+        self.offsets.append(len(self.buffer))
+        self.slots[i] = n
+        if len(self) * 3 >= len(self.slots) * 2:
+            self._grow()
+        return n
+
+    def _grow(self):
+        self.slots = array('l', [-1]) * (len(self.slots) * 2)
+        slots, mask = self.slots, len(self.slots) - 1
+        for n in range(len(self)):
+            i = hash(self[n]) & mask
+            while slots[i] >= 0:
+                i = (i + 1) & mask
+            slots[i] = n
+
+    @property
+    def nbytes(self):
+        return (len(self.buffer) + self.offsets.itemsize * len(self.offsets)
+                + self.slots.itemsize * len(self.slots))
+
+
+class BloomFilter(object):
+    """
+    Fixed size set of keys which answers the membership queries with
+    `error_rate` false positives and no false negatives, using about
+    `-ln(error_rate) / ln(2)^2` bits per key instead of storing the keys.
+
+    It is not thread-safe, the callers should synchronise the additions.
+
+    :param capacity: number of the keys upto which the error rate holds.
+    :param error_rate: probability that a key which was never added is found.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        if not 0 < error_rate < 1:
+            raise ValueError("Error rate must be between 0 and 1, got %r" % error_rate)
+        if not capacity > 0:
+            raise ValueError("Capacity must be greater than 0, got %r" % capacity)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, int(round(self.num_bits * math.log(2) / capacity)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _indexes(self, key):
+        if isinstance(key, text_type):
+            key = key.encode('utf-8')
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(key).digest())
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def __contains__(self, key):
+        bits = self.bits
+        for i in self._indexes(key):
+            if not bits[i >> 3] & (1 << (i & 7)):
+                return False
+        return True
+
+    def add(self, key):
+        """Adds the key and returns whether it was not found before."""
+        bits = self.bits
+        added = False
+        for i in self._indexes(key):
+            mask = 1 << (i & 7)
+            if not bits[i >> 3] & mask:
+                bits[i >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return len(self.bits)
+
+
+class ScalableBloomFilter(object):
+    """
+    Bloom filter which grows as the keys are added while the overall
+    false positive rate stays below `error_rate`.
+
+    A new :class:`BloomFilter` which is `growth` times larger is added
+    once the last one is full, and the error rate of every new filter is
+    `tightening` times the previous one so that their sum converges.
+
+    :param capacity: number of the keys of the first filter.
+    :param error_rate: max probability that a key which was never added is found.
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.001, growth=2, tightening=0.5):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.filters = []
+
+    def __contains__(self, key):
+        for f in reversed(self.filters):
+            if key in f:
+                return True
+        return False
+
+    def add(self, key):
+        """Adds the key and returns whether it was not found before."""
+        if key in self:
+            return False
+        if not self.filters or len(self.filters[-1]) >= self.filters[-1].capacity:
+            n = len(self.filters)
+            self.filters.append(BloomFilter(
+                self.capacity * self.growth ** n,
+                self.error_rate * (1 - self.tightening) * self.tightening ** n))
+        return self.filters[-1].add(key)
+
+    def __len__(self):
+        return sum(len(f) for f in self.filters)
+
+    @property
+    def nbytes(self):
+        return sum(f.nbytes for f in self.filters)
+
+
+_missing = object()
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+
+
+class LRUCache(object):
+    """
+    Thread-safe mapping of at most `maxsize` items which evicts the least
+    recently used item, and the items older than `timeout` seconds if set.
+    """
+
+    def __init__(self, maxsize=255, timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.hits = self.misses = self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _missing)
+            if item is not _missing and self.timeout is not None \
+                    and monotonic() - item[1] > self.timeout:
+                del self._data[key]
+                self.evictions += 1
+                item = _missing
+            if item is _missing:
+                self.misses += 1
+                return default
+            self._touch(key)
+            self.hits += 1
+            return item[0]
+
+    def _touch(self, key):
+        """Moves the key at the end of the eviction order."""
+        if PY3:
+            self._data.move_to_end(key)
+        else:
+            self._data[key] = self._data.pop(key)
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, monotonic())
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+
+def _make_key(args, kwargs, _mark=(object(),)):
+    """Hashable key of the arguments, their types are included so that
+    the equal values of different types e.g. 1 and 1.0 are told apart."""
+    key = args + tuple(map(type, args))
+    if kwargs:
+        items = sorted(kwargs.items())
+        key += _mark + tuple(items) + tuple(type(v) for k, v in items)
+    return key
+
+
 def lru_cache(maxsize=255, timeout=None):
     """lru_cache(maxsize = 255, timeout = None) --> returns a decorator which
     returns an instance (a descriptor).
 
         Purpose         - This decorator factory will wrap a function / instance method
                             and will supply a caching mechanism to the function.
-                            For every given input params it will store the result in a queue
-                            of maxsize size, and will return a cached ret_val
-                            if the same parameters are passed.
+                            For every given input params it will store the result in a
+                            thread-safe :class:`LRUCache` of maxsize size, and will return
+                            a cached ret_val if the same parameters are passed.
 
-        Params          - maxsize - int, the cache size limit, anything added above that will delete
-                            the first values entered (FIFO).
+        Params          - maxsize - int, the cache size limit, the least recently used
+                            value is deleted when anything is added above that.
                             This size is per instance, thus 1000 instances with maxsize of 255,
                             will contain at max 255K elements.
-                        - timeout - int / float / None, every n seconds the cache is deleted,
-                            regardless of usage. If None - cache will never be refreshed.
+                        - timeout - int / float / None, a value is computed again once it
+                            is older than n seconds. If None - values never expire.
 
-        Notes           - If an instance method is wrapped, each instance will have it's own cache
-                            and it's own timeout.
-                        - The wrapped function will have a cache_clear variable inserted
-                            into it and may be called to clear it's specific cache.
+        Notes           - If an instance method is wrapped, each instance will have it's own cache.
+                        - The wrapped function will have a cache_clear and a cache_info
+                            variables inserted into it, the latter returns the hits, misses,
+                            evictions and size of its specific cache.
                         - The wrapped function will maintain the original function's
                             docstring and name (wraps)
                         - The type of the wrapped function will no longer be that of a function
                             but either an instance of _LRU_Cache_class or a functools.partial type.
+                        - Calls with unhashable arguments are not cached.
 
         On Error        - No error handling is done, in case an exception is raised - it will permeate up.
     """
@@ -123,22 +518,34 @@ def lru_cache(maxsize=255, timeout=None):
             self._max_size = max_size
             self._timeout = timeout
 
-            # This will store the cache for this function, format -
-            # {caller1 : [OrderedDict1, last_refresh_time1], caller2 : [OrderedDict2, last_refresh_time2]}.
-            #   In case of an instance method - the caller is the instance, in case called
-            #   from a regular function - the caller is None.
+            # This will store the cache of every caller, in case of an instance
+            # method - the caller is the instance, in case called from a regular
+            # function - the caller is None.
             self._caches_dict = {}
+            self._lock = threading.Lock()
+
+        def _cache(self, caller):
+            cache = self._caches_dict.get(caller)
+            if cache is None:
+                with self._lock:
+                    cache = self._caches_dict.setdefault(
+                        caller, LRUCache(self._max_size, self._timeout))
+            return cache
 
         def cache_clear(self, caller=None):
             # Remove the cache for the caller, only if exists:
-            if caller in self._caches_dict:
-                del self._caches_dict[caller]
-                self._caches_dict[caller] = [OrderedDict(), time.time()]
+            cache = self._caches_dict.get(caller)
+            if cache is not None:
+                cache.clear()
+
+        def cache_info(self, caller=None):
+            return self._cache(caller).info()
 
         def __get__(self, obj, obj_type):
             """ Called for instance methods """
             return_func = functools.partial(self._cache_wrapper, obj)
             return_func.cache_clear = functools.partial(self.cache_clear, obj)
+            return_func.cache_info = functools.partial(self.cache_info, obj)
             # Return the wrapped function and wraps it to maintain the docstring and
             # the name of the original function:
             return functools.wraps(self._input_func)(return_func)
@@ -147,49 +554,35 @@ def lru_cache(maxsize=255, timeout=None):
             """ Called for regular functions """
             return self._cache_wrapper(None, *args, **kwargs)
 
-        # Set the cache_clear function in the __call__ operator:
+        # Set the cache_clear and cache_info functions in the __call__ operator:
         __call__.cache_clear = cache_clear
+        __call__.cache_info = cache_info
+
+        def _call(self, caller, *args, **kwargs):
+            if caller is not None:
+                return self._input_func(caller, *args, **kwargs)
+            return self._input_func(*args, **kwargs)
 
         def _cache_wrapper(self, caller, *args, **kwargs):
-            # Create a unique key including the types (in order to differentiate between 1 and '1'):
-            kwargs_key = "".join(map(lambda x: str(x) + str(type(kwargs[x])) + str(kwargs[x]), sorted(kwargs)))
-            key = "".join(map(lambda x: str(type(x)) + str(x), args)) + kwargs_key
-
-            # Check if caller exists, if not create one:
-            if caller not in self._caches_dict:
-                self._caches_dict[caller] = [OrderedDict(), time.time()]
-            else:
-                # Validate in case the refresh time has passed:
-                if self._timeout is not None:
-                    if time.time() - self._caches_dict[caller][1] > self._timeout:
-                        self.cache_clear(caller)
-
-            # Check if the key exists, if so - return it:
-            cur_caller_cache_dict = self._caches_dict[caller][0]
-            if key in cur_caller_cache_dict:
-                return cur_caller_cache_dict[key]
-
-            # Validate we didn't exceed the max_size:
-            if len(cur_caller_cache_dict) >= self._max_size:
-                # Delete the first item in the dict:
-                cur_caller_cache_dict.popitem(False)
-
-            # Call the function and store the data in the cache (call it with
-            # the caller in case it's an instance function - Ternary condition):
-            cur_caller_cache_dict[key] = self._input_func(
-                caller, *args, **kwargs) if caller is not None else self._input_func(
-                *args, **kwargs
-            )
-            return cur_caller_cache_dict[key]
+            key = _make_key(args, kwargs)
+            cache = self._cache(caller)
+            try:
+                value = cache.get(key, _missing)
+            except TypeError:
+                # Unhashable arguments can't be cached.
+                return self._call(caller, *args, **kwargs)
+            if value is _missing:
+                # The function is called outside of the lock hence concurrent
+                # misses of a same key could compute the value more than once.
+                value = self._call(caller, *args, **kwargs)
+                cache.set(key, value)
+            return value
 
     # Return the decorator wrapping the class (also wraps the instance to
     # maintain the docstring and the name of the original function):
     return lambda input_func: functools.wraps(input_func)(_LRU_Cache_class(input_func, maxsize, timeout))
 
 
-_missing = object()
-
-
 class cached_property(property):
     """A decorator that converts a function into a lazy property.  The
     function wrapped is called the first time to retrieve the result
@@ -8,18 +8,21 @@ import re
 import requests
 from lxml import etree
 from lxml.html import _nons
+from lxml.html import HtmlComment
 from lxml.html import fromstring
 from lxml.html import tostring
 from lxml.html import XHTML_NAMESPACE
 from lxml.html.clean import Cleaner
 from lxml.html.defs import link_attrs
+from six import BytesIO
 from six import next
 from six import integer_types
 from six import string_types
 from six.moves.urllib.parse import urljoin
 from six.moves.collections_abc import Iterator
 
-__all__ = ['iterparse', 'MultiParser', 'Element', 'unquote_match', 'links']
+__all__ = ['iterparse', 'MultiParser', 'Element', 'unquote_match', 'links',
+           'extract_links', 'rewrite_links']
 
 logger = logging.getLogger(__name__)
 
@@ -160,6 +163,41 @@ def iterparse(source, encoding=None, events=None,
     return it
 
 
+def extract_links(source, encoding=None):
+    """Returns the `(tag, url)` of every link in the html document.
+
+    It only exchanges the plain values hence it could be run in
+    another process i.e. by a `concurrent.futures.ProcessPoolExecutor`.
+
+    :param source: bytes of the html document.
+    :param encoding: encoding of the document.
+    """
+    return [(elem.tag, url) for elem, attr, url, pos in iterparse(
+        BytesIO(source), encoding, include_meta_charset_tag=True)]
+
+
+def rewrite_links(source, encoding, urls, comment=None):
+    """Parses the html document again and replaces its links, in the
+    order of :func:`extract_links`, with the given urls.
+
+    :param source: bytes of the html document.
+    :param encoding: encoding of the document.
+    :param urls: new url of every link or None to leave it as is.
+    :param comment: (optional) text of a comment inserted at the top.
+    :return: bytes of the rewritten document.
+    """
+    it = iterparse(BytesIO(source), encoding, include_meta_charset_tag=True)
+    for (elem, attr, url, pos), new in zip(it, urls):
+        if new is not None:
+            elem.replace_url(url, new, attr, pos)
+    # Root is only set once the parser is exhausted.
+    for _ in it:
+        pass
+    if comment is not None:
+        it.root.insert(0, HtmlComment(comment))
+    return tostring(it.root, include_meta_content_type=True)
+
+
 def links(el):
     tag = _nons(el.tag)
     attribs = el.attrib
@@ -0,0 +1,119 @@
+# Copyright 2020; Raja Tomar
+# See license for more details
+"""
+Archive of the http exchanges of a run which the later runs replay without
+any networking, used by the :class:`pywebcopy.session.Session`.
+
+Every request which reaches the transport, i.e. every hop of a redirect,
+is stored with the headers, status and decoded body of its response and
+the seconds it took, or the error it raised.
+"""
+import json
+import logging
+import sqlite3
+import threading
+from collections import deque
+
+from requests import ConnectionError
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveMiss(ConnectionError):
+    """Request which was not recorded in the replayed archive."""
+
+
+class Exchange(object):
+    """Recorded request and its response as found in the :class:`Archive`."""
+
+    __slots__ = ('method', 'url', 'status', 'reason', 'headers', 'body', 'elapsed', 'error')
+
+    def __init__(self, method, url, status, reason, headers, body, elapsed, error):
+        self.method = method
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.elapsed = elapsed
+        self.error = error
+
+    def __repr__(self):
+        return '<%s(%s %s, status=%s)>' % (
+            self.__class__.__name__, self.method, self.url, self.status)
+
+
+class Archive(object):
+    """Http exchanges stored in a SQLite database file.
+
+    An archive opened for recording starts empty, one opened for replaying
+    answers the requests in the order they were recorded in and keeps
+    repeating the last answer of a request once they run out.
+
+    :param path: location of the archive file.
+    :param replaying: whether the archive is replayed instead of recorded.
+    :param timeout: seconds to wait for the other processes sharing it.
+    """
+
+    def __init__(self, path, replaying=False, timeout=60):
+        self.path = path
+        self.replaying = replaying
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS exchanges (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'method TEXT, url TEXT, request_headers TEXT, status INTEGER, reason TEXT, '
+            'headers TEXT, body BLOB, elapsed REAL, error TEXT)')
+        self.queues = {}
+        if replaying:
+            for pk, method, url in self.conn.execute(
+                    'SELECT id, method, url FROM exchanges ORDER BY id'):
+                self.queues.setdefault((method, url), deque()).append(pk)
+        else:
+            self.conn.execute('DELETE FROM exchanges')
+        self.conn.commit()
+
+    def __repr__(self):
+        return '<%s(path=%s, replaying=%r)>' % (
+            self.__class__.__name__, self.path, self.replaying)
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM exchanges').fetchone()[0]
+
+    def add(self, request, status=None, reason=None, headers=(), body=b'',
+            elapsed=0.0, error=None):
+        """Records a request along with its response or its error."""
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO exchanges (method, url, request_headers, status, reason, '
+                'headers, body, elapsed, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (request.method, request.url, json.dumps(list(request.headers.items())),
+                 status, reason, json.dumps(list(headers)), sqlite3.Binary(body),
+                 elapsed, error))
+            self.conn.commit()
+
+    def next(self, request):
+        """Returns the next recorded exchange of the request.
+
+        :rtype: Exchange
+        :raises ArchiveMiss: if the request was never recorded.
+        """
+        with self.lock:
+            ids = self.queues.get((request.method, request.url))
+            if not ids:
+                raise ArchiveMiss(
+                    "No recorded response for [%s %s] in the archive %s"
+                    % (request.method, request.url, self.path), request=request)
+            pk = ids.popleft() if len(ids) > 1 else ids[0]
+            row = self.conn.execute(
+                'SELECT status, reason, headers, body, elapsed, error '
+                'FROM exchanges WHERE id = ?', (pk,)).fetchone()
+        status, reason, headers, body, elapsed, error = row
+        return Exchange(request.method, request.url, status, reason,
+                        json.loads(headers or '[]'), bytes(body or b''), elapsed, error)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
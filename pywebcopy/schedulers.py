@@ -1,12 +1,24 @@
 # Copyright 2020; Raja Tomar
 # See license for more details
+import json
 import logging
+import os
+import sqlite3
 import threading
+import time
 import weakref
+import zlib
+from array import array
+from collections import Counter
+from collections import deque
+from hashlib import md5
 
 from requests import ConnectionError
+from requests.compat import OrderedDict
 from six import PY3
 from six import string_types
+from six import text_type
+from six.moves import queue
 from six.moves.urllib.parse import urlparse
 
 from .elements import VoidResource
@@ -16,7 +28,12 @@ from .elements import AbsoluteUrlResource
 from .elements import GenericResource
 from .elements import HTMLResource
 from .elements import UrlRemover
+from .helpers import BytesTable
 from .helpers import RecentOrderedDict
+from .helpers import ScalableBloomFilter
+from .storage import file_storage
+from .urls import Canonicalizer
+from .urls import guess_content_type
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +46,8 @@ class Index(RecentOrderedDict):
     def __init__(self, *args, **kwargs):
         super(Index, self).__init__(*args, **kwargs)
         self.lock = threading.Lock()
+        #: Events of the claimed urls which are still being processed.
+        self.inflight = {}
 
     def add_entry(self, k, v):
         with self.lock:
@@ -37,9 +56,44 @@ class Index(RecentOrderedDict):
     def get_entry(self, k, default=None):
         return self.get(k, default=default)
 
+    def claim(self, k, v):
+        """Atomically adds the entry if the key isn't indexed yet.
+
+        Exactly one of the concurrent callers claims a key, it should
+        process the resource and :meth:`release` the key afterwards.
+
+        :return: None if the key was claimed by this call otherwise
+            the path which is already indexed for the key.
+        """
+        with self.lock:
+            indexed = self.get(k)
+            if indexed is not None:
+                return indexed
+            self.__setitem__(k, v)
+            self.inflight[k] = threading.Event()
+        return None
+
+    def release(self, k):
+        """Wakes up the callers waiting for the claimed key."""
+        with self.lock:
+            event = self.inflight.pop(k, None)
+        if event is not None:
+            event.set()
+
+    def wait_entry(self, k, timeout=None, default=None):
+        """Returns the entry once the claimed key is released,
+        the entry is returned right away if it isn't in-flight."""
+        event = self.inflight.get(k)
+        if event is not None:
+            event.wait(timeout)
+        return self.get_entry(k, default=default)
+
     def add_resource(self, resource):
         location = resource.filepath
         self.add_entry(resource.context.url, location)
+        if resource.index_key is not None:
+            # The claimed key is still mapped to the path predicted before the download.
+            self.add_entry(resource.index_key, location)
         if hasattr(resource.response, 'url'):
             self.add_entry(resource.response.url, location)
             if resource.response.history:
@@ -48,13 +102,649 @@ class Index(RecentOrderedDict):
 
     index_resource = add_resource
 
+    @staticmethod
+    def resource_key(resource):
+        return resource.index_key or resource.context.url
+
+    def mark_pending(self, resource):
+        """Records that the resource has been scheduled for processing."""
+
+    def mark_done(self, resource):
+        """Records that the resource has been processed completely."""
+        self.release(self.resource_key(resource))
+
+    def is_done(self, url):
+        return False
+
+    def restore(self):
+        """Returns the `(url, handler name, depth)` of every resource which
+        an earlier run scheduled but never finished, and forgets their
+        entries so that they can be scheduled again."""
+        return []
+
+    def flush(self):
+        """Writes the pending entries to the storage, if any."""
+
+    def close(self):
+        self.flush()
+
+
+class CompactIndex(Index):
+    """Files index which keeps the entries in a compact encoding.
+
+    The folder part of every url, i.e. the scheme, host and the path upto
+    the last slash, is interned and the url is stored as the number of its
+    folder followed by the rest of the url. The paths are stored relative
+    to the `base_path` in the same way, and the original url, the final url
+    and the redirects of a resource share a single path. Urls and paths are
+    kept in :class:`BytesTable` buffers so there isn't a python object per
+    entry, and the entries are not reordered on lookups like in :class:`Index`.
+
+    :param base_path: folder of the project, taken from the first
+        indexed resource if it is not set.
+    """
+    def __init__(self, base_path=None):
+        super(CompactIndex, self).__init__()
+        self.base_path = base_path
+        self.folders = []
+        self.folder_ids = {}
+        self.urls = BytesTable()
+        self.paths = BytesTable()
+        #: Number of the path of every url, or -1 if it was deleted.
+        self.values = array('l')
+        self.count = 0
+
+    def _encode(self, value, cut, create=False):
+        """Returns the number of the folder `value[:cut]` followed by the
+        rest of the value, or None if the folder is unknown and it should
+        not be interned."""
+        folder = value[:cut]
+        folder_id = self.folder_ids.get(folder)
+        if folder_id is None:
+            if not create:
+                return None
+            folder_id = self.folder_ids[folder] = len(self.folders)
+            self.folders.append(folder)
+        return (text_type(folder_id) + u' ' + value[cut:]).encode('utf-8')
+
+    def _decode(self, key):
+        folder_id, rest = key.decode('utf-8').split(u' ', 1)
+        return self.folders[int(folder_id)] + rest
+
+    def _encode_url(self, url, create=False):
+        query = url.find('?')
+        return self._encode(
+            url, url.rfind('/', 0, len(url) if query < 0 else query) + 1, create)
+
+    def _encode_path(self, path):
+        base = self.base_path
+        if base and path.startswith(base) and path[len(base):len(base) + 1] in ('/', os.sep):
+            path = path[len(base) + 1:]
+        return self._encode(path, max(path.rfind('/'), path.rfind(os.sep)) + 1, True)
+
+    def _decode_path(self, value):
+        path = self._decode(value)
+        if self.base_path and not os.path.isabs(path):
+            return os.path.join(self.base_path, path)
+        return path
+
+    def _find(self, key):
+        encoded = self._encode_url(key) if isinstance(key, string_types) else None
+        n = -1 if encoded is None else self.urls.find(encoded)
+        if n < 0 or self.values[n] < 0:
+            raise KeyError(key)
+        return n
+
+    def __getitem__(self, key):
+        return self._decode_path(self.paths[self.values[self._find(key)]])
+
+    def __setitem__(self, key, value):
+        n = self.urls.add(self._encode_url(key, create=True))
+        path = self.paths.add(self._encode_path(value))
+        if n == len(self.values):
+            self.values.append(path)
+            self.count += 1
+        else:
+            if self.values[n] < 0:
+                self.count += 1
+            self.values[n] = path
+
+    def __delitem__(self, key):
+        self.values[self._find(key)] = -1
+        self.count -= 1
+
+    def __contains__(self, key):
+        try:
+            self._find(key)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        for n, path in enumerate(list(self.values)):
+            if path >= 0:
+                yield self._decode(self.urls[n])
+
+    def __len__(self):
+        return self.count
+
+    def keys(self):
+        return list(self.__iter__())
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def add_resource(self, resource):
+        if self.base_path is None:
+            self.base_path = resource.context.base_path
+        super(CompactIndex, self).add_resource(resource)
+
+    index_resource = add_resource
+
+    @property
+    def nbytes(self):
+        return (self.urls.nbytes + self.paths.nbytes
+                + self.values.itemsize * len(self.values))
+
+
+class BloomIndex(Index):
+    """Files index which remembers the seen urls in a scalable bloom filter
+    and the paths of only the `cache_size` most recently used urls.
+
+    It takes a couple of bytes per url instead of a full entry, which
+    suits the discovery crawls of huge sites. Urls seen earlier whose
+    entry is gone are linked at the path predicted by the referring file,
+    and a new url is taken for a seen one with the probability `error_rate`
+    in which case it is not fetched.
+
+    :param capacity: number of the urls of the first bloom filter.
+    :param error_rate: max probability that a new url is taken for a seen one.
+    :param cache_size: max entries held in the memory.
+    """
+    def __init__(self, capacity=100000, error_rate=0.001, cache_size=4096):
+        super(BloomIndex, self).__init__()
+        self.seen = ScalableBloomFilter(capacity, error_rate)
+        self.cache_size = cache_size
+
+    def __setitem__(self, key, value):
+        self.seen.add(key)
+        super(BloomIndex, self).__setitem__(key, value)
+        while len(self._data) > self.cache_size:
+            self._data.popitem(last=False)
+
+    def claim(self, k, v):
+        with self.lock:
+            indexed = self.get(k)
+            if indexed is not None:
+                return indexed
+            if k in self.seen:
+                return v
+            self.__setitem__(k, v)
+            self.inflight[k] = threading.Event()
+        return None
+
+
+class SqliteIndex(Index):
+    """Files index stored in a SQLite database on the disk.
+
+    Entries are written in batches using the write-ahead-log mode so
+    the index of a huge site never has to be held in the memory and it
+    survives the restarts of the process. Recently used entries are kept
+    in a small in-memory LRU so that the repeated lookups stay fast.
+
+    The status of every scheduled resource is stored alongside, and the
+    batch is checkpointed by a background thread at least every
+    `checkpoint_interval` seconds, even while nothing is written to the
+    index, so that a killed crawl can be resumed using :meth:`restore`.
+
+    :param path: location of the database file.
+    :param cache_size: max entries held in the in-memory LRU.
+    :param batch_size: entries collected before a write to the disk.
+    :param checkpoint_interval: max seconds between two writes to the disk.
+    """
+    def __init__(self, path, cache_size=4096, batch_size=512, checkpoint_interval=30):
+        super(SqliteIndex, self).__init__()
+        #: Mapping methods acquire it too, hence it needs to be re-entrant.
+        self.lock = threading.RLock()
+        self.path = path
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpointed = time.time()
+        self.pending = {}
+        self.statuses = {}
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries (url TEXT PRIMARY KEY, path TEXT)')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS status '
+            '(url TEXT PRIMARY KEY, handler TEXT, depth INTEGER, done INTEGER)')
+        self.conn.commit()
+        self.closed = threading.Event()
+        if checkpoint_interval:
+            thread = threading.Thread(
+                target=_checkpoint_periodically, args=(weakref.ref(self), self.closed))
+            thread.daemon = True
+            thread.start()
+
+    def __repr__(self):
+        return '<%s(path=%s)>' % (self.__class__.__name__, self.path)
+
+    def _cache(self, key, value):
+        super(SqliteIndex, self).__setitem__(key, value)
+        while len(self._data) > self.cache_size:
+            self._data.popitem(last=False)
+
+    def __getitem__(self, key):
+        with self.lock:
+            if key in self._data:
+                return super(SqliteIndex, self).__getitem__(key)
+            if key in self.pending:
+                value = self.pending[key]
+            else:
+                row = self.conn.execute(
+                    'SELECT path FROM entries WHERE url = ?', (key,)).fetchone()
+                if row is None:
+                    raise KeyError(key)
+                value = row[0]
+            self._cache(key, value)
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self._cache(key, value)
+            self.pending[key] = value
+            self._checkpoint()
+
+    def _checkpoint(self):
+        if len(self.pending) + len(self.statuses) >= self.batch_size \
+                or time.time() - self.checkpointed >= self.checkpoint_interval:
+            self.flush()
+
+    def __delitem__(self, key):
+        with self.lock:
+            self.flush()
+            self._data.pop(key, None)
+            cursor = self.conn.execute('DELETE FROM entries WHERE url = ?', (key,))
+            self.conn.commit()
+            if not cursor.rowcount:
+                raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self.__getitem__(key)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        with self.lock:
+            self.flush()
+            urls = [r[0] for r in self.conn.execute('SELECT url FROM entries')]
+        return iter(urls)
+
+    def __len__(self):
+        with self.lock:
+            self.flush()
+            return self.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def keys(self):
+        return list(self.__iter__())
+
+    def items(self):
+        with self.lock:
+            self.flush()
+            return list(self.conn.execute('SELECT url, path FROM entries'))
+
+    def _set_status(self, resource, done):
+        with self.lock:
+            self.statuses[self.resource_key(resource)] = (
+                resource.__class__.__name__, resource.context.depth, int(done))
+            self._checkpoint()
+
+    def mark_pending(self, resource):
+        self._set_status(resource, False)
+
+    def mark_done(self, resource):
+        self._set_status(resource, True)
+        super(SqliteIndex, self).mark_done(resource)
+
+    def is_done(self, url):
+        with self.lock:
+            if url in self.statuses:
+                return bool(self.statuses[url][2])
+            row = self.conn.execute(
+                'SELECT done FROM status WHERE url = ?', (url,)).fetchone()
+            return bool(row and row[0])
+
+    def clear(self):
+        """Forgets the entries and the statuses of an earlier crawl."""
+        with self.lock:
+            self.pending.clear()
+            self.statuses.clear()
+            self._data.clear()
+            self.conn.execute('DELETE FROM entries')
+            self.conn.execute('DELETE FROM status')
+            self.conn.commit()
+
+    def restore(self):
+        with self.lock:
+            self.flush()
+            rows = list(self.conn.execute(
+                'SELECT url, handler, depth FROM status WHERE done = 0 ORDER BY depth'))
+            self.conn.executemany(
+                'DELETE FROM entries WHERE url = ?', [(r[0],) for r in rows])
+            self.conn.commit()
+            for row in rows:
+                self._data.pop(row[0], None)
+            return rows
+
+    def flush(self):
+        with self.lock:
+            self.checkpointed = time.time()
+            if not self.pending and not self.statuses:
+                return
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO entries (url, path) VALUES (?, ?)',
+                self.pending.items())
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO status (url, handler, depth, done) '
+                'VALUES (?, ?, ?, ?)',
+                [(k,) + v for k, v in self.statuses.items()])
+            self.conn.commit()
+            self.pending.clear()
+            self.statuses.clear()
+
+    def close(self):
+        with self.lock:
+            self.closed.set()
+            self.flush()
+            self.conn.close()
+
+
+def _checkpoint_periodically(ref, closed):
+    """Checkpoints the index until it is closed or garbage collected."""
+    index = ref()
+    while index is not None:
+        interval = index.checkpoint_interval
+        del index
+        if closed.wait(interval):
+            return
+        index = ref()
+        if index is not None:
+            with index.lock:
+                if not closed.is_set():
+                    index._checkpoint()
+
+
+class SharedIndex(SqliteIndex):
+    """SQLite index which is shared by the processes of a sharded crawl.
+
+    Urls are claimed straight in the database hence exactly one of the
+    processes fetches a url. The pages are crawled by the process which
+    owns their shard, other processes put them in the shared `frontier`
+    table from where the owner pops them. Every process reports whether
+    it is idle in the `workers` table and the crawl is over once all of
+    them are idle and the frontier is empty.
+
+    :param path: location of the database file.
+    :param timeout: max seconds to wait for a lock held by another process.
+    """
+    def __init__(self, path, timeout=60, **kwargs):
+        super(SharedIndex, self).__init__(path, **kwargs)
+        self.conn.execute('PRAGMA busy_timeout=%d' % int(timeout * 1000))
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS frontier '
+            '(url TEXT PRIMARY KEY, handler TEXT, depth INTEGER, shard INTEGER)')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS workers (shard INTEGER PRIMARY KEY, idle INTEGER)')
+        self.conn.commit()
+
+    def prepare(self, shards, resume=False):
+        """Registers the busy shards before their processes are started,
+        the state of an earlier crawl is forgotten unless it is resumed."""
+        with self.lock:
+            self.flush()
+            if not resume:
+                for table in ('entries', 'status', 'frontier'):
+                    self.conn.execute('DELETE FROM %s' % table)
+                self._data.clear()
+            self.conn.execute('DELETE FROM workers')
+            self.conn.executemany(
+                'INSERT INTO workers (shard, idle) VALUES (?, 0)',
+                [(i,) for i in range(shards)])
+            self.conn.commit()
+
+    def claim(self, k, v):
+        with self.lock:
+            if k in self._data or k in self.pending:
+                return self[k]
+            cursor = self.conn.execute(
+                'INSERT OR IGNORE INTO entries (url, path) VALUES (?, ?)', (k, v))
+            self.conn.commit()
+            if not cursor.rowcount:
+                return self[k]
+            self._cache(k, v)
+            self.inflight[k] = threading.Event()
+        return None
+
+    def push(self, resource, shard):
+        """Puts the page in the frontier of the process owning the shard."""
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR IGNORE INTO frontier (url, handler, depth, shard) '
+                'VALUES (?, ?, ?, ?)',
+                (self.resource_key(resource), resource.__class__.__name__,
+                 resource.context.depth, shard))
+            self.conn.commit()
+
+    def pop(self, shard, limit=256):
+        """Takes upto `limit` pages from the frontier of the shard and
+        marks the shard as busy if there were any.
+
+        :return: list of the `(url, handler name, depth)` of the pages.
+        """
+        with self.lock:
+            self.flush()
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = list(self.conn.execute(
+                    'SELECT url, handler, depth FROM frontier WHERE shard = ? '
+                    'ORDER BY depth LIMIT ?', (shard, limit)))
+                if rows:
+                    self.conn.executemany(
+                        'DELETE FROM frontier WHERE url = ?', [(r[0],) for r in rows])
+                    self.conn.execute(
+                        'UPDATE workers SET idle = 0 WHERE shard = ?', (shard,))
+            finally:
+                self.conn.commit()
+            return rows
+
+    def set_idle(self, shard):
+        """Marks the shard as idle.
+
+        :return: whether every shard is idle and nothing is left to crawl.
+        """
+        with self.lock:
+            self.flush()
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.execute('UPDATE workers SET idle = 1 WHERE shard = ?', (shard,))
+                busy = self.conn.execute(
+                    'SELECT COUNT(*) FROM workers WHERE idle = 0').fetchone()[0]
+                queued = self.conn.execute('SELECT COUNT(*) FROM frontier').fetchone()[0]
+            finally:
+                self.conn.commit()
+            return not busy and not queued
+
+
+class ValidatorStore(object):
+    """Validators of the downloaded files stored in a SQLite database
+    next to the index, so that a later crawl of the same project asks the
+    server to send only the files which have changed since.
+
+    Every url gets the `ETag` and `Last-Modified` headers of its response,
+    the size and md5 hash of its saved file and the links found in it,
+    which are followed again if the server reports it as not modified.
+
+    :param path: location of the database file.
+    :param timeout: seconds to wait for the other processes sharing it.
+    :param batch_size: records collected before a write to the disk.
+    """
+    def __init__(self, path, timeout=60, batch_size=256):
+        self.lock = threading.RLock()
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = {}
+        self.conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS validators (url TEXT PRIMARY KEY, path TEXT, '
+            'etag TEXT, modified TEXT, size INTEGER, hash TEXT, links TEXT)')
+        self.conn.commit()
+
+    def __repr__(self):
+        return '<%s(path=%s)>' % (self.__class__.__name__, self.path)
+
+    def get(self, url):
+        """Returns the stored validators of the url as a dict or None."""
+        with self.lock:
+            if url in self.pending:
+                row = self.pending[url]
+            else:
+                row = self.conn.execute(
+                    'SELECT path, etag, modified, size, hash, links '
+                    'FROM validators WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        path, etag, modified, size, digest, links = row
+        return {
+            'path': path, 'etag': etag, 'modified': modified,
+            'size': size, 'hash': digest, 'links': json.loads(links or '[]'),
+        }
+
+    @staticmethod
+    def conditional_headers(record, storage=file_storage):
+        """Returns the request headers which ask the server to send the
+        resource only if it has changed since the record was taken.
+
+        No headers are returned if the saved file went missing or was
+        modified in the meantime.
+
+        :param record: stored validators of the resource.
+        :param storage: (optional) storage backend of the saved file.
+        """
+        if record is None or not (record['etag'] or record['modified']):
+            return {}
+        try:
+            if storage.size(record['path']) != record['size']:
+                return {}
+        except (OSError, IOError, TypeError):
+            return {}
+        headers = {}
+        if record['etag']:
+            headers['If-None-Match'] = record['etag']
+        if record['modified']:
+            headers['If-Modified-Since'] = record['modified']
+        return headers
+
+    def record(self, resource):
+        """Stores the validators of a resource which was saved to the disk."""
+        response = resource.response
+        if getattr(response, 'status_code', None) != 200:
+            return
+        path = resource.filepath
+        digest = md5()
+        size = 0
+        try:
+            with resource.storage.open(path) as f:
+                for chunk in iter(lambda: f.read(64 * 1024), b''):
+                    digest.update(chunk)
+                    size += len(chunk)
+        except (OSError, IOError):
+            return
+        row = (
+            path, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+            size, digest.hexdigest(), json.dumps(resource.links or []),
+        )
+        with self.lock:
+            self.pending[resource.index_key or resource.context.url] = row
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO validators '
+                '(url, path, etag, modified, size, hash, links) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(k,) + v for k, v in self.pending.items()])
+            self.conn.commit()
+            self.pending.clear()
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.conn.close()
+
 
 class SchedulerBase(object):
     """A Synchronised resource processor.
 
     File paths would be based on the content-type header returned by the server
     but this would be slow because of being synchronous but is very reliable.
+
+    Html pages are not processed as soon as they are found, instead they
+    are put in a frontier queue which is crawled breadth first, one level
+    of links at a time. Thus the memory usage depends on the size of the
+    frontier and not on the depth of the site, and a page is freed as
+    soon as it is written. Pages which are more than :attr:`max_depth`
+    links away from the first page are linked to their online location.
+
+    If :attr:`resume` is set then the crawl starts with the resources
+    which an interrupted run of the same project left unfinished in
+    a persistent index, and the finished ones are not fetched again.
+
+    If :attr:`shards` is more than one then the scheduler is one of the
+    processes of a sharded crawl. Pages are hashed on their host or path,
+    see :attr:`shard_by`, and only the pages of its own :attr:`shard` are
+    crawled by it, the others are handed over through a :class:`SharedIndex`.
+
+    Every url is claimed in the index before it is processed hence
+    concurrent references to the same url fetch it only once, the
+    suppressed fetches are counted in :attr:`stats` as `duplicates`.
+    Urls are claimed in their canonical form if a :attr:`canonicalizer`
+    is set, and the fetches of the equivalent urls which it suppressed
+    are counted as `canonical_duplicates` too.
+
+    Paths of the resources which are not fetched yet are predicted from
+    their url and pinned, if the url tells their content-type, so that the
+    referring files could be written before the server responds. Other
+    paths are awaited for upto :attr:`wait_timeout` seconds altogether for
+    all the children of a file by the concurrent schedulers, or pinned as
+    is if :attr:`pin_unknown_paths` is set.
     """
+    #: Max seconds to wait for the paths of the resources of unknown type
+    #: linked in a file, the paths as of now are used if it is not set.
+    wait_timeout = None
+    #: Whether to pin the paths of the resources of unknown type
+    #: which is required by the schedulers which can't wait for them.
+    pin_unknown_paths = False
+    #: Executor of the processes which parse and rewrite the pages,
+    #: pages are parsed in the thread processing them if it is not set.
+    process_pool = None
+    #: Number of the processes in the :attr:`process_pool` which every
+    #: crawl starts and shuts down, unless the pool is set already.
+    parse_processes = None
+    #: Seconds to wait between two polls of the shared frontier.
+    poll_interval = 0.5
+    #: Callable which returns the canonical form of an url, the urls are
+    #: indexed as they are if it is not set.
+    canonicalizer = None
+
     style_tags = frozenset(['link', 'style'])
     img_tags = frozenset(['img'])
     script_tags = frozenset(['script'])
@@ -69,6 +759,21 @@ class SchedulerBase(object):
         self.default = default
         self.index = Index()
         self.block_external_domains = True
+        self.frontier = deque()
+        self.max_depth = None
+        self.crawling = False
+        self.deferred = deque()
+        self.resume = False
+        self.shard = 0
+        self.shards = 1
+        self.shard_by = 'path'
+        #: Validators of the files saved by the earlier crawls which are
+        #: only downloaded again if they have changed, see :class:`ValidatorStore`.
+        self.validators = None
+        self.stats = Counter()
+        #: Canonical urls which were only seen in other forms.
+        self.aliased = set()
+        self._stats_lock = threading.Lock()
         self.logger = logger.getChild(self.__class__.__name__)
 
     def set_default(self, default):
@@ -92,9 +797,17 @@ class SchedulerBase(object):
         if key not in self.data:
             if self.default is None:
                 raise KeyError(key)
-            return self.default(*args, **params)
+            handler = self.default
         else:
-            return self.data[key](*args, **params)
+            handler = self.data[key]
+        ans = handler(*args, **params)
+        if self.max_depth is not None and isinstance(ans, HTMLResource) \
+                and ans.context.depth > self.max_depth:
+            self.logger.debug(
+                "Page [%s] is beyond the max depth of %d, linking it as is."
+                % (ans.context.url, self.max_depth))
+            return AbsoluteUrlResource(*args, **params)
+        return ans
 
     invalid_schemas = tuple([
         'data', 'javascript', 'mailto', 'tel',
@@ -146,30 +859,298 @@ class SchedulerBase(object):
                 return False
         return self.validate_url(resource.url)
 
+    def count(self, key, n=1):
+        """Increments the counter of the :attr:`stats`."""
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def canonical(self, url):
+        """Returns the key of the url in the index."""
+        if self.canonicalizer is None:
+            return url
+        return self.canonicalizer(url)
+
+    def first_seen(self, url, key, indexed):
+        """Returns whether the url of an indexed key is seen for the first
+        time, i.e. it would have been fetched if it wasn't canonicalized."""
+        if key == url:
+            with self._stats_lock:
+                if key not in self.aliased:
+                    return False
+                self.aliased.discard(key)
+                return True
+        if self.index.get_entry(url) is not None:
+            return False
+        self.index.add_entry(url, indexed)
+        return True
+
+    def shard_of(self, url):
+        """Returns the shard of the url as per its host or path."""
+        scheme, host, path, params, query, frag = urlparse(url)
+        key = host if self.shard_by == 'host' else path
+        return zlib.crc32(key.encode('utf-8')) % self.shards
+
     def handle_resource(self, resource):
-        indexed = self.index.get_entry(resource.url)
-        if indexed:
+        if (self.resume or self.shards > 1) and not self.crawling:
+            return self.crawl(resource)
+        url = resource.url
+        key = self.canonical(url)
+        if resource.response is None:
+            self.predict_path(resource)
+
+        # Claim the url in the index before doing any processing so that
+        # later or concurrent calls find this entry without fetching it again
+        # or going in infinite recursion.
+        indexed = self.index.claim(key, resource.filepath)
+        if indexed is not None:
             self.logger.debug(
                 "[Cache] Resource Key: [%s] is available in the cache with value: [%s]"
-                % (resource.url, indexed)
+                % (key, indexed)
             )
+            self.count('duplicates')
+            if self.first_seen(url, key, indexed):
+                self.count('canonical_duplicates')
             # modify the resources path resolution mechanism.
             return resource.__dict__.__setitem__('filepath', indexed)
-
-        # Update the index before doing any processing so that later calls
-        # to index find this entry without going in infinite recursion
-        # Response could have been already present on disk
-        self.index.add_entry(resource.context.url, resource.filepath)
+        resource.index_key = key
+        if key != url:
+            # The canonical url itself wasn't seen yet.
+            with self._stats_lock:
+                self.aliased.add(key)
+            self.index.add_entry(url, resource.filepath)
 
         if self.validate_resource(resource):
             self.logger.debug("Processing valid resource: %r" % resource)
-            return self._handle_resource(resource)
+            self.count('scheduled')
+            self.prefetch_rules(resource)
+            self.index.mark_pending(resource)
+            if isinstance(resource, HTMLResource):
+                return self.schedule_page(resource)
+            return self.schedule_asset(resource)
         self.logger.error("Discarding invalid resource: %r" % resource)
+        self.index.release(key)
         return resource.filepath
 
+    @staticmethod
+    def prefetch_rules(resource):
+        """Warms up the robots.txt rules of the server of the resource
+        while it waits for its turn."""
+        prefetch = getattr(resource.session, 'prefetch_rules', None)
+        if prefetch is not None:
+            prefetch(resource.url)
+
+    def predict_path(self, resource):
+        """Pins the path of the resource as predicted from its url.
+
+        The path matches the one derived from the server's content-type
+        if the server agrees with the extension of the url. Pages default
+        to html as they are always processed later, the ones which turn
+        out to be something else are moved, see :attr:`guessed_path`.
+        """
+        content_type = guess_content_type(resource.context.url)
+        guessed = content_type is None and isinstance(resource, HTMLResource)
+        if guessed:
+            content_type = 'text/html'
+        if content_type is None and not self.pin_unknown_paths:
+            return None
+        resource.context = resource.context.with_values(content_type=content_type)
+        resource.__dict__.pop('filepath', None)
+        resource.pinned_path = resource.filepath
+        if guessed:
+            resource.guessed_path = resource.pinned_path
+        return resource.pinned_path
+
+    def wait_deadline(self):
+        """Returns the time until which the paths of the children of
+        a file are awaited for, or None if they aren't awaited."""
+        if self.wait_timeout:
+            return time.time() + self.wait_timeout
+        return None
+
+    def resolve_child(self, resource, parent_path=None, deadline=None):
+        """Returns the url at which the parent file should refer to the resource.
+
+        Unpinned paths of the resources which are still being fetched
+        are awaited for if the :attr:`wait_timeout` is set, but not beyond
+        the `deadline` shared by the children of the parent file.
+        """
+        if self.wait_timeout and resource.pinned_path is None \
+                and resource.response is None and not isinstance(resource, VoidResource):
+            timeout = self.wait_timeout
+            if deadline is not None:
+                timeout = max(0, min(timeout, deadline - time.time()))
+            indexed = self.wait_path(resource.index_key or self.canonical(resource.url), timeout)
+            if indexed is not None:
+                resource.__dict__['filepath'] = indexed
+        return resource.resolve(parent_path)
+
+    def wait_path(self, url, timeout=None):
+        """Blocks until the final path of the url is indexed."""
+        if timeout is None:
+            timeout = self.wait_timeout
+        return self.index.wait_entry(url, timeout)
+
+    def schedule_asset(self, resource):
+        """Processes a non-page resource."""
+        return self._handle_resource(resource)
+
     def _handle_resource(self, resource):
         raise NotImplementedError()
 
+    def feedback(self, resource, latency, error=None):
+        """Called with the outcome of every request, the schedulers
+        which adapt to the servers override it.
+
+        :param resource: resource which was requested.
+        :param latency: seconds until the response arrived.
+        :param error: (optional) exception raised by the request.
+        """
+
+    def finish_resource(self, resource):
+        """Indexes the processed resource and marks it as done."""
+        self.index.add_resource(resource)
+        self.index.mark_done(resource)
+        if self.validators is not None:
+            if getattr(resource.response, 'status_code', None) == 304:
+                self.count('not_modified')
+            else:
+                self.validators.record(resource)
+
+    def schedule_page(self, resource):
+        """Puts the page in the frontier if a crawl is running
+        otherwise starts a new crawl from this page."""
+        if self.crawling and self.shards > 1:
+            shard = self.shard_of(resource.url)
+            if shard != self.shard:
+                self.logger.debug(
+                    "Handing over page to the shard %d: [%s]" % (shard, resource.url))
+                self.index.push(resource, shard)
+                return resource.filepath
+        if self.crawling:
+            self.logger.debug("Adding page to the frontier: [%s]" % resource.url)
+            self.frontier.append(resource)
+            return resource.filepath
+        return self.crawl(resource)
+
+    def crawl(self, resource):
+        """Processes the page and then the pages linked to it breadth first.
+
+        Every page of a level is handed over to the :meth:`_handle_resource`
+        and all of them are finished, including their files, before the
+        pages found on them are processed.
+
+        A shard keeps polling the shared frontier for the pages handed over
+        to it until every shard of the crawl is idle.
+        """
+        self.crawling = True
+        owned = self.process_pool is None and bool(self.parse_processes)
+        if owned:
+            self.process_pool = create_process_pool(self.parse_processes)
+        try:
+            resume, self.resume = self.resume, False
+            # Unfinished resources are shared by all the shards.
+            if resume and self.shard == 0:
+                self.restore(resource)
+            if resume or self.shards > 1:
+                # The first page goes through the index like any other
+                # page hence it is only processed if it wasn't finished.
+                self.handle_resource(resource)
+            else:
+                self.frontier.append(resource)
+            self.process_frontier()
+            while self.shards > 1:
+                rows = self.index.pop(self.shard)
+                for url, name, depth in rows:
+                    page = self.rebuild(resource, url, name, depth)
+                    if page is not None:
+                        page.index_key = url
+                        self.predict_path(page)
+                        self.frontier.append(page)
+                if rows:
+                    self.process_frontier()
+                elif self.index.set_idle(self.shard):
+                    break
+                else:
+                    time.sleep(self.poll_interval)
+        finally:
+            self.crawling = False
+            self.deferred.clear()
+            self.index.flush()
+            if self.validators is not None:
+                self.validators.flush()
+            if owned:
+                # No process of the pool outlives the crawl.
+                self.process_pool.shutdown()
+                self.process_pool = None
+            self.logger.info("Crawl stats: %r" % dict(self.stats))
+        return resource.filepath
+
+    @staticmethod
+    def prepare_dirs(resources):
+        """Creates the folders of the resources whose paths are pinned in one go."""
+        paths = {}
+        for r in resources:
+            if r.pinned_path and (r.config is None or r.config.get('mirror', True)):
+                paths.setdefault(r.storage, []).append(r.pinned_path)
+        return sum(storage.prepare(locations) for storage, locations in paths.items())
+
+    def process_frontier(self):
+        """Processes the pages in the frontier one level at a time."""
+        while self.frontier:
+            self.prepare_dirs(self.frontier)
+            # Pages found while processing this level are appended
+            # at the end and hence belong to the next level.
+            for _ in range(len(self.frontier)):
+                page = self.frontier.popleft()
+                self.logger.debug(
+                    "Processing page at depth %d: [%s]" % (page.context.depth, page.url))
+                self._handle_resource(page)
+                del page
+                self.process_deferred()
+            self.join()
+
+    def process_deferred(self):
+        """Processes the resources whose processing was put off."""
+        self.prepare_dirs(self.deferred)
+        while self.deferred:
+            self._handle_resource(self.deferred.popleft())
+
+    def restore(self, resource):
+        """Schedules again the resources left unfinished by an earlier run.
+
+        Their handlers are looked up by name among the registered handlers
+        and the session, config and context are borrowed from the resource.
+        """
+        restored = 0
+        for url, name, depth in self.index.restore():
+            restoree = self.rebuild(resource, url, name, depth)
+            if restoree is not None:
+                self.handle_resource(restoree)
+                restored += 1
+        self.logger.info("Resumed %d unfinished resources." % restored)
+        return restored
+
+    def rebuild(self, resource, url, name, depth):
+        """Creates a resource of the url using the handler named `name`
+        with the session, config and context of the given resource."""
+        handlers = dict((h.__name__, h) for h in list(self.data.values()) + [self.default] if h)
+        handlers.setdefault(resource.__class__.__name__, resource.__class__)
+        handler = handlers.get(name)
+        if handler is None:
+            self.logger.debug(
+                "No handler named %s to rebuild resource: [%s]" % (name, url))
+            return None
+        context = resource.context.with_values(url=url, content_type=None, depth=depth)
+        return handler(resource.session, resource.config, self, context)
+
+    def join(self, timeout=None):
+        """Blocks until all the scheduled resources are processed.
+
+        Synchronous schedulers process everything in place hence
+        there is nothing to wait for.
+        """
+        return True
+
 
 class Collector(SchedulerBase):
     """A simple resource collector to use when debugging
@@ -183,31 +1164,71 @@ class Collector(SchedulerBase):
 
 
 class Scheduler(SchedulerBase):
+    """Processes the resources one by one in the calling thread.
+
+    Files with pinned paths found on a page are put off until the page is
+    written, hence parsing a page never waits for their downloads.
+    """
+    #: Whether the pinned files are processed after the page.
+    defer_assets = True
+
+    def schedule_asset(self, resource):
+        if self.defer_assets and self.crawling and resource.pinned_path is not None:
+            self.deferred.append(resource)
+            return resource.filepath
+        return self._handle_resource(resource)
+
     def _handle_resource(self, resource):
+        start = time.time()
         try:
             self.logger.debug('Scheduler trying to get resource at: [%s]' % resource.url)
             resource.get(resource.context.url)
             # NOTE :meth:`get` can change the :attr:`filepath` of the resource
             self.index.add_resource(resource)
-        except ConnectionError:
+        except ConnectionError as e:
             self.logger.error(
                 "Scheduler ConnectionError Failed to retrieve resource from [%s]"
                 % resource.url)
+            self.feedback(resource, time.time() - start, e)
             # self.index.add_entry(resource.url, resource.filepath)
         except Exception as e:
             self.logger.exception(e)
             # self.index.add_entry(resource.url, resource.filepath)
         else:
+            self.feedback(resource, time.time() - start)
             self.logger.debug('Scheduler running handler for: [%s]' % resource.url)
             resource.retrieve()
-        self.index.add_resource(resource)
+        self.finish_resource(resource)
 
 
 class ThreadingScheduler(Scheduler):
+    defer_assets = False
+    wait_timeout = 30
+
     def __init__(self, *args, **kwargs):
         super(ThreadingScheduler, self).__init__(*args, **kwargs)
         self.threads = weakref.WeakSet()
         self.timeout = None
+        self._lock = threading.Lock()
+
+    def join(self, timeout=None):
+        """Waits for the running threads and the threads they start."""
+        if timeout is None:
+            timeout = self.timeout
+        end = None if timeout is None else time.time() + timeout
+        while True:
+            with self._lock:
+                threads = [t for t in self.threads
+                           if t.is_alive() and t is not threading.current_thread()]
+            if not threads:
+                return True
+            for thread in threads:
+                if end is None:
+                    thread.join()
+                elif end - time.time() <= 0:
+                    return False
+                else:
+                    thread.join(end - time.time())
 
     def __del__(self):
         self.close()
@@ -232,13 +1253,399 @@ class ThreadingScheduler(Scheduler):
             except Exception as e:
                 self.logger.debug('Exception encountered in retrieval: [%s]',  e)
             finally:
+                self.finish_resource(r)
                 return r.context.url, r.filepath
         thread = threading.Thread(target=run, args=(resource,))
-        thread.start()
-        self.threads.add(thread)
+        with self._lock:
+            thread.start()
+            self.threads.add(thread)
+
+
+class AdaptiveConcurrency(object):
+    """Additive-increase/multiplicative-decrease limits of the
+    requests in-flight to every host.
+
+    The limit of a host grows by one for every window of successful responses
+    i.e. by `1 / limit` for each of them, and it is multiplied by `backoff`
+    on connection errors, 429 and 503 responses, or when the latency of
+    a response gets `latency_factor` times the average latency of the host.
+
+    :param initial: limit of the hosts which haven't responded yet.
+    :param minimum: lowest limit of a host.
+    :param maximum: (optional) highest limit of a host.
+    :param backoff: factor applied to the limit of a congested host.
+    :param latency_factor: latency over the average which is a congestion.
+    :param smoothing: weight of a new latency in the moving average.
+    """
+    congestion_statuses = frozenset([429, 503])
+
+    def __init__(self, initial=2, minimum=1, maximum=None,
+                 backoff=0.5, latency_factor=3.0, smoothing=0.2):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.latency_factor = latency_factor
+        self.smoothing = smoothing
+        self.limits = {}
+        self.latencies = {}
+        self._lock = threading.Lock()
+
+    def limit(self, host):
+        return int(self.limits.get(host, self.initial))
+
+    def feedback(self, host, latency, status=None, error=None):
+        """Updates the limit of the host with the outcome of a request.
+
+        :param host: network location of the request.
+        :param latency: seconds until the response arrived.
+        :param status: (optional) status code of the response.
+        :param error: (optional) exception raised by the request.
+        :return: True if the host is congested.
+        """
+        with self._lock:
+            limit = self.limits.get(host, float(self.initial))
+            average = self.latencies.get(host)
+            congested = error is not None or status in self.congestion_statuses or (
+                average is not None and latency > average * self.latency_factor)
+            if congested:
+                limit = max(self.minimum, limit * self.backoff)
+            else:
+                limit += 1.0 / limit
+                if self.maximum:
+                    limit = min(self.maximum, limit)
+            if error is None:
+                self.latencies[host] = latency if average is None \
+                    else average + self.smoothing * (latency - average)
+            self.limits[host] = limit
+        return congested
+
+
+class HostQueue(queue.Queue):
+    """Queue of resources which hands them out per the politeness
+    limits of their hosts instead of the order they were put in.
+
+    A resource is only returned if its host has less than `concurrency`
+    resources in-flight and the delay of the host since the last resource
+    handed out for it has passed, any other ready host is served meanwhile.
+    Hosts are served in a round robin order. The consumer must call
+    :meth:`release` once it has processed a resource. Resources which are
+    processed without being queued take a slot of their host using
+    :meth:`acquire` instead.
+
+    :param maxsize: max resources held in the queue across all the hosts.
+    :param concurrency: max resources in-flight per host, unlimited if None.
+    :param delay: callable which returns the seconds to wait after the resource
+        before the next resource of the same host is handed out.
+    :param adaptive: (optional) :class:`AdaptiveConcurrency` which decides
+        the max resources in-flight of every host instead of `concurrency`.
+    """
+    def __init__(self, maxsize=0, concurrency=None, delay=None, adaptive=None):
+        self.concurrency = concurrency
+        self.delay = delay
+        self.adaptive = adaptive
+        # Queue is an old style class on python 2.
+        queue.Queue.__init__(self, maxsize)
+        #: Notified when a slot of a host is released.
+        self.released = threading.Condition(self.mutex)
+
+    def _init(self, maxsize):
+        self.hosts = OrderedDict()
+        self.ready_at = {}
+        self.inflight = Counter()
+        # Hosts of the handed out resources as their url could change.
+        self.leases = {}
+        self.size = 0
+
+    def _qsize(self):
+        return self.size
+
+    @staticmethod
+    def host_of(resource):
+        # Sentinels i.e. None are always ready under an empty host.
+        if resource is None:
+            return ''
+        return urlparse(resource.context.url).netloc
+
+    def _put(self, item):
+        host = self.host_of(item)
+        if host not in self.hosts:
+            self.hosts[host] = deque()
+        self.hosts[host].append(item)
+        self.size += 1
+
+    def _ready(self, now):
+        """Returns a ready host and None or None and the seconds
+        until a host becomes ready (None if it depends on a release)."""
+        wait = None
+        for host in self.hosts:
+            if not host:
+                return host, None
+            remaining = self._remaining(host, now)
+            if remaining is None:
+                continue
+            if remaining <= 0:
+                return host, None
+            wait = remaining if wait is None else min(wait, remaining)
+        return None, wait
+
+    def _remaining(self, host, now):
+        """Returns the seconds until the host is ready or None if
+        all of its slots are in-flight."""
+        limit = self.concurrency
+        if self.adaptive is not None:
+            limit = self.adaptive.limit(host)
+        if limit and self.inflight[host] >= limit:
+            return None
+        return self.ready_at.get(host, 0) - now
+
+    def _lease(self, item, host, now):
+        self.inflight[host] += 1
+        self.leases[id(item)] = host
+        if self.delay is not None:
+            self.ready_at[host] = now + self.delay(item)
+
+    def _take(self, host, now):
+        items = self.hosts.pop(host)
+        item = items.popleft()
+        if items:
+            # Move the host at the end for a round robin.
+            self.hosts[host] = items
+        self.size -= 1
+        if host:
+            self._lease(item, host, now)
+        return item
+
+    def get(self, block=True, timeout=None):
+        with self.not_empty:
+            end = None if timeout is None else time.time() + timeout
+            while True:
+                now = time.time()
+                host, wait = self._ready(now)
+                if host is not None:
+                    break
+                if not block:
+                    raise queue.Empty
+                if end is not None:
+                    remaining = end - now
+                    if remaining <= 0:
+                        raise queue.Empty
+                    wait = remaining if wait is None else min(wait, remaining)
+                self.not_empty.wait(wait)
+            item = self._take(host, now)
+            self.not_full.notify()
+            return item
+
+    def steal(self, url):
+        """Removes the queued resource indexed as the url and returns it, if any."""
+        host = urlparse(url).netloc
+        with self.mutex:
+            items = self.hosts.get(host)
+            for item in items or ():
+                if item is not None and (item.index_key or item.context.url) == url:
+                    items.remove(item)
+                    if not items:
+                        del self.hosts[host]
+                    self.size -= 1
+                    self.not_full.notify()
+                    return item
+        return None
+
+    def acquire(self, item):
+        """Blocks until the host of the resource is ready and takes
+        one of its slots for the resource, like :meth:`get` would."""
+        host = self.host_of(item)
+        with self.released:
+            while True:
+                now = time.time()
+                remaining = self._remaining(host, now)
+                if remaining is not None and remaining <= 0:
+                    break
+                self.released.wait(remaining)
+            self._lease(item, host, now)
+
+    def hold(self, host, seconds):
+        """Hands out no resource of the host for the given seconds."""
+        with self.mutex:
+            self.ready_at[host] = max(self.ready_at.get(host, 0), time.time() + seconds)
+
+    def release(self, item):
+        """Marks the resource as processed which frees a slot of its host."""
+        with self.mutex:
+            host = self.leases.pop(id(item), None)
+            if not host:
+                return
+            self.inflight[host] -= 1
+            if self.inflight[host] <= 0:
+                del self.inflight[host]
+            self.not_empty.notify_all()
+            self.released.notify_all()
+
+
+class WorkerPoolScheduler(Scheduler):
+    """Scheduler backed by a fixed number of worker threads which
+    consume resources from a bounded queue.
+
+    The caller blocks whenever the queue is full, which puts a hard
+    ceiling on the number of threads and the resources held in memory
+    irrespective of how many files a page links to. Resources submitted
+    from a worker thread itself (i.e. while parsing a html page) are
+    processed in place when the queue is full so that the pool can never
+    dead-lock on its own queue, they still wait for a slot of their host.
+
+    The queue is a :class:`HostQueue` hence the workers pick the resources
+    of the hosts which are ready, per the `host_concurrency` and the crawl
+    delay of the session, instead of sleeping on a host which isn't.
+
+    If `adaptive` is set then the requests in-flight to every host are
+    limited by an :class:`AdaptiveConcurrency` fed with the latency and
+    the errors of the requests, `host_concurrency` is the highest limit.
+    A `Retry-After` header of the 429 and 503 responses pauses the host.
+    """
+    defer_assets = False
+    wait_timeout = 30
+
+    def __init__(self, workers=None, queue_size=None, host_concurrency=None,
+                 adaptive=False, *args, **kwargs):
+        super(WorkerPoolScheduler, self).__init__(*args, **kwargs)
+        self.workers = workers or 8
+        if queue_size is None:
+            queue_size = self.workers * 4
+        self.adaptive = None
+        if adaptive:
+            maximum = host_concurrency or self.workers
+            self.adaptive = AdaptiveConcurrency(initial=min(2, maximum), maximum=maximum)
+        self.queue = HostQueue(
+            queue_size, host_concurrency, delay=self.host_delay, adaptive=self.adaptive)
+        self.threads = []
+        self.timeout = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def host_delay(resource):
+        session = resource.session
+        if session is None or not hasattr(session, 'get_crawl_delay'):
+            return 0
+        return session.get_crawl_delay(resource.context.url)
+
+    def wait_path(self, url, timeout=None):
+        # The worker would starve the pool if it waited on a resource
+        # queued behind it, hence such a resource is processed right here.
+        resource = self.queue.steal(url)
+        if resource is not None:
+            try:
+                self._process_in_place(resource)
+            finally:
+                self.queue.task_done()
+        return super(WorkerPoolScheduler, self).wait_path(url, timeout)
+
+    def _process_in_place(self, resource):
+        """Processes the resource in this worker within the limits of its host."""
+        # The resource of the worker has been fetched by now, its slot is
+        # given up so that the workers never wait for each other's slots.
+        current = getattr(self._local, 'resource', None)
+        if current is not None:
+            self.queue.release(current)
+        self.queue.acquire(resource)
+        self._local.resource = resource
+        try:
+            super(WorkerPoolScheduler, self)._handle_resource(resource)
+        finally:
+            self.queue.release(resource)
+            self._local.resource = current
+
+    def feedback(self, resource, latency, error=None):
+        if self.adaptive is None:
+            return
+        # Limits belong to the host the resource was queued under.
+        host = self.queue.leases.get(id(resource)) or HostQueue.host_of(resource)
+        status = getattr(resource.response, 'status_code', None)
+        if self.adaptive.feedback(host, latency, status, error):
+            self.logger.info(
+                "Host %s is congested, limited to %d requests."
+                % (host, self.adaptive.limit(host)))
+            self.count('congestions')
+        if status in self.adaptive.congestion_statuses:
+            retry_after = resource.response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                self.queue.hold(host, int(retry_after))
+
+    def _start(self):
+        with self._lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker, name='%s-%d' % (self.__class__.__name__, i))
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def _worker(self):
+        self._local.worker = True
+        while True:
+            resource = self.queue.get()
+            self._local.resource = resource
+            try:
+                if resource is None:
+                    return
+                super(WorkerPoolScheduler, self)._handle_resource(resource)
+            except Exception as e:
+                self.logger.exception(e)
+            finally:
+                self._local.resource = None
+                self.queue.release(resource)
+                self.queue.task_done()
+
+    def _handle_resource(self, resource):
+        self._start()
+        if not getattr(self._local, 'worker', False):
+            self.queue.put(resource)
+            return
+        try:
+            self.queue.put_nowait(resource)
+        except queue.Full:
+            self.logger.debug(
+                'Queue is full, processing resource in place: [%s]' % resource.url)
+            self._process_in_place(resource)
+
+    def join(self, timeout=None):
+        """Blocks until the queue is drained and all the workers are idle.
+
+        :param timeout: (optional) max seconds to wait for.
+        :return: True if all the work has been done, False on timeout.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        done = self.queue.all_tasks_done
+        end = None if timeout is None else time.time() + timeout
+        with done:
+            while self.queue.unfinished_tasks:
+                if end is None:
+                    done.wait()
+                else:
+                    remaining = end - time.time()
+                    if remaining <= 0:
+                        return False
+                    done.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        self.join(timeout)
+        with self._lock:
+            threads, self.threads = self.threads, []
+        for _ in threads:
+            self.queue.put(None)
+        for thread in threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
 
 
 class GEventScheduler(Scheduler):
+    defer_assets = False
+    pin_unknown_paths = True
+
     def __init__(self, maxsize=None, *args, **kwargs):
         super(GEventScheduler, self).__init__(*args, **kwargs)
         try:
@@ -256,12 +1663,18 @@ class GEventScheduler(Scheduler):
     def close(self, timeout=None):
         self.pool.kill(timeout=timeout)
 
+    def join(self, timeout=None):
+        return self.pool.join(timeout=timeout)
+
     def _handle_resource(self, resource):
         def run(r):
             self.logger.debug('Scheduler trying to get resource at: [%s]' % resource.url)
-            r.response = r.session.get(r.context.url)
-            self.logger.debug('Scheduler running retrieving process: [%s]' % resource.url)
-            r.retrieve()
+            try:
+                r.response = r.session.get(r.context.url)
+                self.logger.debug('Scheduler running retrieving process: [%s]' % resource.url)
+                r.retrieve()
+            finally:
+                self.finish_resource(r)
             return r.context.url, r.filepath
 
         g = self.pool.spawn(run, resource)
@@ -271,10 +1684,16 @@ class GEventScheduler(Scheduler):
 
 if PY3:
     class ThreadPoolScheduler(Scheduler):
+        defer_assets = False
+        pin_unknown_paths = True
+
         def __init__(self, maxsize=None, *args, **kwargs):
             super(ThreadPoolScheduler, self).__init__(*args, **kwargs)
             import concurrent.futures
             self.pool = concurrent.futures.ThreadPoolExecutor(maxsize)
+            self.futures = set()
+            #: Guards the futures which are discarded by the pool threads.
+            self._futures_lock = threading.Lock()
 
         def __del__(self):
             self.close()
@@ -282,12 +1701,32 @@ if PY3:
         def close(self, wait=None):
             self.pool.shutdown(wait)
 
+        def join(self, timeout=None):
+            import concurrent.futures
+            end = None if timeout is None else time.time() + timeout
+            while True:
+                with self._futures_lock:
+                    futures = list(self.futures)
+                if not futures:
+                    return True
+                remaining = None if end is None else end - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                concurrent.futures.wait(futures, remaining)
+
+        def _discard(self, future):
+            with self._futures_lock:
+                self.futures.discard(future)
+
         def _handle_resource(self, resource):
             def run(r):
                 self.logger.debug('Scheduler trying to get resource at: [%s]' % resource.url)
-                r.response = r.session.get(r.context.url)
-                self.logger.debug('Scheduler running retrieving process: [%s]' % resource.url)
-                r.retrieve()
+                try:
+                    r.response = r.session.get(r.context.url)
+                    self.logger.debug('Scheduler running retrieving process: [%s]' % resource.url)
+                    r.retrieve()
+                finally:
+                    self.finish_resource(r)
                 return r.context.url, r.filepath
 
             def callback(ret):
@@ -297,7 +1736,11 @@ if PY3:
                     self.logger.info("Written the file from <%s> to <%s>" % ret.result())
 
             g = self.pool.submit(run, resource)
+            with self._futures_lock:
+                self.futures.add(g)
             g.add_done_callback(callback)
+            # Done futures run the callback right here, hence it's added unlocked.
+            g.add_done_callback(self._discard)
 
     def thread_pool_default_scheduler(maxsize=4):
         ans = ThreadPoolScheduler(maxsize=maxsize)
@@ -315,6 +1758,121 @@ if PY3:
             ans.register_handler(k, HTMLResource)
         return ans
 
+    class AsyncioScheduler(Scheduler):
+        """Scheduler which drives all the fetches on a single asyncio event loop.
+
+        Requests are sent through a pooled `aiohttp` client running in one
+        background thread, hence thousands of requests could be in-flight
+        without an OS thread for each of them. Once a response arrives the
+        resource is processed in the default executor of the loop, so that
+        the parsing and the writing never stall the fetches in-flight, and
+        any sub-resources it finds are scheduled back on the loop.
+
+        The loop can't wait for the paths of the resources it is fetching
+        hence the paths of the resources of unknown type are pinned as well.
+        """
+        defer_assets = False
+        pin_unknown_paths = True
+
+        def __init__(self, maxsize=None, host_concurrency=None, *args, **kwargs):
+            super(AsyncioScheduler, self).__init__(*args, **kwargs)
+            from .aio import AsyncClient
+            from .aio import EventLoopThread
+            self.client = AsyncClient(limit=maxsize or 100, limit_per_host=host_concurrency or 0)
+            self.runner = EventLoopThread(name=self.__class__.__name__)
+            self.pending = 0
+            self.timeout = None
+            self._cond = threading.Condition()
+
+        def __del__(self):
+            self.close()
+
+        def close(self, timeout=None):
+            runner = self.__dict__.pop('runner', None)
+            if runner is None or not runner.is_alive():
+                return
+            if runner is threading.current_thread():
+                # Can't wait on the loop from inside of the loop.
+                runner.loop.call_soon(runner.loop.stop)
+                return
+            runner.submit(self.client.close()).result(timeout)
+            runner.stop(timeout)
+
+        def join(self, timeout=None):
+            if timeout is None:
+                timeout = self.timeout
+            end = None if timeout is None else time.time() + timeout
+            with self._cond:
+                while self.pending:
+                    if end is None:
+                        self._cond.wait()
+                    else:
+                        remaining = end - time.time()
+                        if remaining <= 0:
+                            return False
+                        self._cond.wait(remaining)
+            return True
+
+        def _handle_resource(self, resource):
+            with self._cond:
+                if not self.runner.is_alive():
+                    self.runner.start()
+                self.pending += 1
+            self.logger.debug('Scheduler trying to get resource at: [%s]' % resource.url)
+            future = self.runner.submit(self.client.request(
+                resource.session, 'GET', resource.context.url,
+                headers=resource.conditional_headers()))
+            future.add_done_callback(
+                lambda f: self._handle_response(resource, f))
+
+        def _handle_response(self, resource, future):
+            # Runs inside the event loop thread.
+            try:
+                resource.set_response(future.result())
+                # NOTE :meth:`set_response` can change the :attr:`filepath` of the resource
+                self.index.add_resource(resource)
+            except ConnectionError:
+                self.logger.error(
+                    "Scheduler ConnectionError Failed to retrieve resource from [%s]"
+                    % resource.url)
+                self._finish(resource)
+            except Exception as e:
+                self.logger.exception(e)
+                self._finish(resource)
+            else:
+                self.runner.loop.run_in_executor(None, self._retrieve, resource)
+
+        def _retrieve(self, resource):
+            self.logger.debug('Scheduler running handler for: [%s]' % resource.url)
+            try:
+                resource.retrieve()
+            except Exception as e:
+                self.logger.exception(e)
+            finally:
+                self._finish(resource)
+
+        def _finish(self, resource):
+            self.finish_resource(resource)
+            with self._cond:
+                self.pending -= 1
+                self._cond.notify_all()
+
+    def asyncio_default_scheduler(maxsize=None, host_concurrency=None):
+        ans = AsyncioScheduler(maxsize=maxsize, host_concurrency=host_concurrency)
+        fac = default_scheduler()
+        ans.default = fac.default
+        ans.data = fac.data
+        del fac
+        return ans
+
+    def asyncio_crawler_scheduler(maxsize=None, host_concurrency=None):
+        ans = asyncio_default_scheduler(maxsize=maxsize, host_concurrency=host_concurrency)
+        for k in ans.meta_tags:
+            ans.register_handler(k, HTMLResource)
+        for k in ans.external_tags:
+            ans.register_handler(k, HTMLResource)
+        return ans
+
 else:
     class ThreadPoolScheduler(object):
         def __init__(self, *args, **kwargs):
@@ -335,6 +1893,21 @@ else:
             "hence you should use any other scheduler link gevent.!", maxsize
         )
 
+    class AsyncioScheduler(object):
+        def __init__(self, *args, **kwargs):
+            raise RuntimeError(
+                "Python 2 does not have `asyncio` module, "
+                "hence you should use any other scheduler link gevent.!"
+            )
+
+    def asyncio_default_scheduler(maxsize=None, host_concurrency=None):
+        raise RuntimeError(
+            "Python 2 does not have asyncio module, "
+            "hence you should use any other scheduler link gevent.!", maxsize
+        )
+
+    asyncio_crawler_scheduler = asyncio_default_scheduler
+
 
 def default_scheduler():
     ans = Scheduler()
@@ -368,8 +1941,14 @@ def crawler_scheduler():
     return ans
 
 
-def threading_default_scheduler(timeout=None):
-    ans = ThreadingScheduler()
+def threading_default_scheduler(timeout=None, workers=None, queue_size=None,
+                                host_concurrency=None, adaptive=False):
+    if workers or host_concurrency or adaptive:
+        ans = WorkerPoolScheduler(
+            workers=workers, queue_size=queue_size,
+            host_concurrency=host_concurrency, adaptive=adaptive)
+    else:
+        ans = ThreadingScheduler()
     ans.timeout = timeout
     fac = default_scheduler()
     ans.default = fac.default
@@ -378,9 +1957,11 @@ def threading_default_scheduler(timeout=None):
     return ans
 
 
-def threading_crawler_scheduler(timeout=None):
-    ans = threading_default_scheduler()
-    ans.timeout = timeout
+def threading_crawler_scheduler(timeout=None, workers=None, queue_size=None,
+                                host_concurrency=None, adaptive=False):
+    ans = threading_default_scheduler(
+        timeout=timeout, workers=workers, queue_size=queue_size,
+        host_concurrency=host_concurrency, adaptive=adaptive)
     for k in ans.meta_tags:
         ans.register_handler(k, HTMLResource)
     for k in ans.external_tags:
@@ -397,8 +1978,8 @@ def gevent_default_scheduler(maxsize=4):
     return ans
 
 
-def gevent_crawler_scheduler():
-    ans = gevent_default_scheduler()
+def gevent_crawler_scheduler(maxsize=4):
+    ans = gevent_default_scheduler(maxsize=maxsize)
     for k in ans.meta_tags:
         ans.register_handler(k, HTMLResource)
     for k in ans.external_tags:
@@ -406,5 +1987,73 @@ def gevent_crawler_scheduler():
     return ans
 
 
+def create_process_pool(processes=None):
+    """Returns a process pool executor to parse the pages in.
+
+    :param processes: number of the processes, defaults to the number of cpus.
+    """
+    if not PY3:
+        raise RuntimeError(
+            "Python 2 does not have `concurrent.futures` module, "
+            "hence the pages can't be parsed in a process pool.!"
+        )
+    import concurrent.futures
+    return concurrent.futures.ProcessPoolExecutor(processes)
+
+
+#: Names of the schedulers which could be selected through the config.
+scheduler_names = ('sync', 'threading', 'gevent', 'asyncio')
+
+
+def scheduler_from_config(config, crawler=False):
+    """Creates a scheduler as selected by the `scheduler` key of the config.
+
+    If the `scheduler` key is not set then the `threaded` key decides
+    between the threading and the synchronous scheduler.
+
+    :param config: project configuration handler.
+    :param crawler: whether the scheduler should also process the linked pages.
+    """
+    name = config.get('scheduler')
+    if name is None:
+        name = 'threading' if config.get('threaded') else 'sync'
+    if name == 'sync':
+        ans = crawler_scheduler() if crawler else default_scheduler()
+    elif name == 'threading':
+        factory = threading_crawler_scheduler if crawler else threading_default_scheduler
+        ans = factory(
+            timeout=config.get('thread_join_timeout'),
+            workers=config.get('workers'),
+            queue_size=config.get('queue_size'),
+            host_concurrency=config.get('host_concurrency'),
+            adaptive=config.get('adaptive'))
+    elif name == 'gevent':
+        factory = gevent_crawler_scheduler if crawler else gevent_default_scheduler
+        ans = factory(maxsize=config.get('workers') or 4)
+    elif name == 'asyncio':
+        factory = asyncio_crawler_scheduler if crawler else asyncio_default_scheduler
+        ans = factory(
+            maxsize=config.get('workers'),
+            host_concurrency=config.get('host_concurrency'))
+    else:
+        raise ValueError(
+            "Unknown scheduler %r, expected one of %r" % (name, scheduler_names))
+    ans.max_depth = config.get('max_depth')
+    if config.get('canonicalize'):
+        ans.canonicalizer = Canonicalizer(
+            strip_params=config.get('strip_query_params'),
+            sort_query=config.get('sort_query'))
+    ans.parse_processes = config.get('parse_processes')
+    ans.resume = bool(config.get('resume'))
+    if config.get('shard') is not None:
+        ans.shard = config.get('shard')
+        ans.shards = config.get('processes') or 1
+        ans.shard_by = config.get('shard_by') or 'path'
+    ans.index = config.create_index()
+    if config.get('overwrite') == 'update':
+        ans.validators = ValidatorStore(config.metadata_path('validators.sqlite'))
+    return ans
+
+
 def base64_scheduler():
     raise NotImplemented
@@ -3,25 +3,45 @@
 """
 ..todo::
 
-1. Add domain-specific / global delays.
-2. Add domain blocking, * pattern blocking.
+1. Add domain blocking, * pattern blocking.
 """
 
-import time
 import contextlib
+import io
+import json
 import logging
+import os
 import socket
+import tempfile
+import threading
+import time
+from hashlib import md5
+from hashlib import sha1
+from collections import Counter
+from collections import namedtuple
 
 import requests
+from requests.adapters import DEFAULT_POOLSIZE
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from six import BytesIO
 from six.moves.urllib.parse import urlsplit
 from six.moves.urllib.parse import urlunsplit
+from six.moves import queue
 from six.moves.urllib.robotparser import RobotFileParser
-from six import integer_types
+from urllib3 import HTTPConnectionPool
+from urllib3 import HTTPSConnectionPool
+from urllib3 import PoolManager
 
 from .__version__ import __title__
 from .__version__ import __version__
+from .cache import HTTPCache
+from .cache import transfer_headers
+from .helpers import RateLimiter
+from .replay import Archive
+from .warc import WarcWriter
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +63,43 @@ def default_headers(**kwargs):
     }, **kwargs)
 
 
+def make_response(request, status, headers, body, url=None, reason=None, history=None):
+    """Builds a `requests.Response` which did not come from `urllib3`,
+    i.e. from a cache or from another http client.
+
+    The body is wrapped in an `urllib3.HTTPResponse` so that the response
+    can be streamed through the `.raw` attribute like any other response.
+
+    :param request: prepared request which generated this response.
+    :param status: http status code.
+    :param headers: response headers mapping or list of pairs.
+    :param body: bytes or a readable file-like object.
+    :param url: (optional) final url of the response, defaults to the request url.
+    :param reason: (optional) http reason phrase.
+    :param history: (optional) list of the redirect responses.
+    :rtype: requests.Response
+    """
+    from urllib3 import HTTPResponse
+
+    if not hasattr(body, 'read'):
+        body = BytesIO(body or b'')
+    raw = HTTPResponse(
+        body=body, headers=headers, status=status, reason=reason,
+        preload_content=False, decode_content=False,
+        request_url=url or request.url,
+    )
+    response = requests.Response()
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(raw.headers)
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.raw = raw
+    response.reason = reason
+    response.url = url or request.url
+    response.request = request
+    response.history = list(history or [])
+    return response
+
+
 def check_connection(host=None, port=None, timeout=None):
     """Checks whether internet connection is available.
 
@@ -66,6 +123,396 @@ def check_connection(host=None, port=None, timeout=None):
         return False
 
 
+PoolInfo = namedtuple('PoolInfo', 'requests reused connections discarded reuse_ratio')
+
+
+class PoolStats(object):
+    """Thread-safe usage counters of the connection pools of a session.
+
+    Every request either `reused` an open connection or opened a new one,
+    connections which did not fit back in a full pool are `discarded`.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.counts[key] += n
+
+    def clear(self):
+        with self.lock:
+            self.counts.clear()
+
+    def info(self):
+        """Returns the counters along with the share of the reused connections.
+
+        :rtype: PoolInfo
+        """
+        with self.lock:
+            reused = self.counts['reused']
+            connections = self.counts['connections']
+            discarded = self.counts['discarded']
+        total = reused + connections
+        return PoolInfo(total, reused, connections, discarded,
+                        float(reused) / total if total else 0.0)
+
+
+class MeteredPoolMixin(object):
+    """Counts the reused, new and discarded connections of an urllib3 pool."""
+
+    stats = None
+
+    def _get_conn(self, timeout=None):
+        conn = super(MeteredPoolMixin, self)._get_conn(timeout)
+        if self.stats is not None:
+            # Connections without a socket do the handshake on the next request.
+            self.stats.count('reused' if getattr(conn, 'sock', None) is not None else 'connections')
+        return conn
+
+    def _put_conn(self, conn):
+        if self.stats is not None and self.pool is not None and conn is not None:
+            try:
+                self.pool.put(conn, block=False)
+                return
+            except queue.Full:
+                self.stats.count('discarded')
+        super(MeteredPoolMixin, self)._put_conn(conn)
+
+
+class MeteredHTTPConnectionPool(MeteredPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class MeteredHTTPSConnectionPool(MeteredPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class MeteredPoolManager(PoolManager):
+    """Pool manager which creates the metered connection pools."""
+
+    def __init__(self, stats=None, *args, **kwargs):
+        super(MeteredPoolManager, self).__init__(*args, **kwargs)
+        self.stats = stats
+        self.pool_classes_by_scheme = {
+            'http': MeteredHTTPConnectionPool,
+            'https': MeteredHTTPSConnectionPool,
+        }
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = super(MeteredPoolManager, self)._new_pool(scheme, host, port, request_context)
+        pool.stats = self.stats
+        return pool
+
+
+class PooledAdapter(HTTPAdapter):
+    """Http adapter which reports the usage of its connection pools
+    to a :class:`PoolStats` object.
+
+    :param stats: counters shared with the other adapters of the session.
+    :param pool_connections: number of the servers to keep the pools of.
+    :param pool_maxsize: connections kept open to a same server.
+    """
+
+    def __init__(self, stats=None, **kwargs):
+        self.stats = stats if stats is not None else PoolStats()
+        super(PooledAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = MeteredPoolManager(
+            getattr(self, 'stats', None), num_pools=connections,
+            maxsize=maxsize, block=block, **pool_kwargs)
+
+
+class CachingAdapter(PooledAdapter):
+    """Http adapter which answers the requests from a :class:`HTTPCache`
+    if the stored responses are fresh, revalidates the stale ones and
+    stores the new responses.
+
+    Responses which are served from the disk have a `from_cache` attribute,
+    it is False for the ones which were just downloaded and stored.
+
+    :param cache: the response cache.
+    :param session: (optional) session whose bandwidth budget applies
+        when a body is downloaded into the cache.
+    """
+
+    #: Methods which don't change the resources on the server.
+    safe_methods = frozenset(['GET', 'HEAD', 'OPTIONS', 'TRACE'])
+
+    def __init__(self, cache, session=None, **kwargs):
+        self.cache = cache
+        self.session = session
+        super(CachingAdapter, self).__init__(**kwargs)
+
+    def cached_response(self, request, entry, from_cache=True):
+        from urllib3 import HTTPResponse
+
+        raw = HTTPResponse(
+            body=open(entry.path, 'rb'), headers=list(entry.headers.items()),
+            status=entry.status, reason=entry.reason, preload_content=False,
+            decode_content=False, request_url=request.url)
+        response = self.build_response(request, raw)
+        response.from_cache = from_cache
+        if from_cache:
+            self.cache.touch(entry)
+        return response
+
+    def send(self, request, **kwargs):
+        cache = self.cache
+        if request.method != 'GET':
+            if request.method not in self.safe_methods:
+                cache.delete(cache.cache_key(request))
+            return super(CachingAdapter, self).send(request, **kwargs)
+
+        entry = cache.lookup(request)
+        if entry is not None and entry.is_fresh(request.headers):
+            return self.cached_response(request, entry)
+
+        revalidating = False
+        if entry is not None:
+            validators = entry.validators()
+            # Conditional requests of the caller are answered by the server.
+            if validators and not any(k in request.headers for k in validators):
+                request = request.copy()
+                request.headers.update(validators)
+                revalidating = True
+
+        response = super(CachingAdapter, self).send(request, **kwargs)
+        if revalidating and response.status_code == 304:
+            response.close()
+            return self.cached_response(request, cache.refresh(entry, response.headers))
+        if not cache.is_storable(request, response):
+            return response
+        if self.session is not None:
+            response = self.session.throttle_response(response)
+        entry = cache.store(request, response)
+        if entry is None:
+            return response
+        return self.cached_response(request, entry, from_cache=False)
+
+
+class ArchivedMessage(object):
+    """Stands in for the :mod:`http.client` response whose headers the
+    cookie handling of requests reads, so the archived cookies are set."""
+
+    def __init__(self, method, headers):
+        self._method = method
+        self.msg = self
+        self.headers = list(headers)
+
+    def get_all(self, name, default=None):
+        ans = [v for k, v in self.headers if k.lower() == name.lower()]
+        return ans or default
+
+    def getheaders(self, name):
+        return self.get_all(name, [])
+
+    def close(self):
+        pass
+
+    def isclosed(self):
+        return True
+
+
+class ArchiveAdapter(HTTPAdapter):
+    """Base of the adapters which build the responses from the bytes of
+    an :class:`pywebcopy.replay.Archive`."""
+
+    def __init__(self, archive, **kwargs):
+        self.archive = archive
+        super(ArchiveAdapter, self).__init__(**kwargs)
+
+    def archived_response(self, request, status, reason, headers, body):
+        from urllib3 import HTTPResponse
+
+        if not hasattr(body, 'read'):
+            body = BytesIO(body)
+        raw = HTTPResponse(
+            body=body, headers=headers, status=status, reason=reason,
+            preload_content=False, decode_content=False, request_url=request.url,
+            original_response=ArchivedMessage(request.method, headers))
+        return self.build_response(request, raw)
+
+
+class RecordingAdapter(ArchiveAdapter):
+    """Records the exchanges of another adapter in an archive.
+
+    :param archive: archive opened for recording.
+    :param adapter: adapter which does the networking.
+    """
+
+    def __init__(self, archive, adapter, **kwargs):
+        self.adapter = adapter
+        super(RecordingAdapter, self).__init__(archive, **kwargs)
+
+    def send(self, request, **kwargs):
+        start = time.time()
+        try:
+            response = self.adapter.send(request, **kwargs)
+            body = response.content
+        except RequestException as e:
+            self.archive.add(request, elapsed=time.time() - start, error=str(e))
+            raise
+        headers = [(k, v) for k, v in getattr(response.raw, 'headers', response.headers).items()
+                   if k.lower() not in transfer_headers]
+        headers.append(('Content-Length', str(len(body))))
+        self.archive.add(
+            request, response.status_code, response.reason, headers, body,
+            time.time() - start)
+        ans = self.archived_response(
+            request, response.status_code, response.reason, headers, body)
+        if hasattr(response, 'from_cache'):
+            ans.from_cache = response.from_cache
+        return ans
+
+    def close(self):
+        self.adapter.close()
+        super(RecordingAdapter, self).close()
+
+
+class ReplayAdapter(ArchiveAdapter):
+    """Answers the requests from an archive without any networking.
+
+    :param archive: archive opened for replaying.
+    :param latency: (optional) 'recorded' to wait as long as the recorded
+        exchange took, seconds to wait for every request or a callable
+        which returns them for a recorded exchange.
+    """
+
+    def __init__(self, archive, latency=None, **kwargs):
+        self.latency = latency
+        super(ReplayAdapter, self).__init__(archive, **kwargs)
+
+    def delay(self, exchange):
+        if self.latency is None:
+            return 0
+        if self.latency == 'recorded':
+            return exchange.elapsed or 0
+        if callable(self.latency):
+            return self.latency(exchange)
+        return float(self.latency)
+
+    def send(self, request, **kwargs):
+        exchange = self.archive.next(request)
+        wait = self.delay(exchange)
+        if wait > 0:
+            time.sleep(wait)
+        if exchange.error is not None:
+            raise requests.ConnectionError(exchange.error, request=request)
+        return self.archived_response(
+            request, exchange.status, exchange.reason, exchange.headers, exchange.body)
+
+
+class WarcAdapter(ArchiveAdapter):
+    """Writes the exchanges of another adapter to the WARC files.
+
+    The bodies are spooled to a temporary file on their way to the WARC
+    file, from which the returned response reads them afterwards.
+
+    :param archive: :class:`pywebcopy.warc.WarcWriter` instance.
+    :param adapter: adapter which does the networking.
+    :param spool_size: (optional) bytes of a body which are kept in memory.
+    """
+
+    def __init__(self, archive, adapter, spool_size=1 << 20, **kwargs):
+        self.adapter = adapter
+        self.spool_size = spool_size
+        super(WarcAdapter, self).__init__(archive, **kwargs)
+
+    def send(self, request, **kwargs):
+        response = self.adapter.send(request, **kwargs)
+        spool = tempfile.SpooledTemporaryFile(self.spool_size)
+        digest = sha1()
+        size = 0
+        try:
+            for chunk in response.iter_content(64 * 1024):
+                digest.update(chunk)
+                size += len(chunk)
+                spool.write(chunk)
+        except Exception:
+            spool.close()
+            raise
+        finally:
+            response.close()
+        headers = [(k, v) for k, v in getattr(response.raw, 'headers', response.headers).items()
+                   if k.lower() not in transfer_headers]
+        headers.append(('Content-Length', str(size)))
+        spool.seek(0)
+        self.archive.write_exchange(
+            request, response.status_code, response.reason, headers, spool, size,
+            digest, getattr(response.raw, 'version', 11))
+        spool.seek(0)
+        ans = self.archived_response(
+            request, response.status_code, response.reason, headers, spool)
+        if hasattr(response, 'from_cache'):
+            ans.from_cache = response.from_cache
+        return ans
+
+    def close(self):
+        self.adapter.close()
+        super(WarcAdapter, self).close()
+
+
+class RobotsCache(object):
+    """Stores the robots.txt rules on the disk so that the later crawls
+    of a same server don't have to download them again.
+
+    The rules are kept for `ttl` seconds, a day by default as asked by
+    the robots exclusion protocol.
+
+    :param path: folder to store the rules in.
+    :param ttl: max age of the stored rules in seconds.
+    """
+
+    def __init__(self, path, ttl=86400):
+        self.path = path
+        self.ttl = ttl
+
+    def location(self, robots_url):
+        return os.path.join(self.path, md5(robots_url.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, robots_url):
+        """Returns the parsed rules of the url if they are fresh otherwise None.
+
+        :rtype: RobotFileParser
+        """
+        try:
+            with io.open(self.location(robots_url), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if data.get('url') != robots_url or time.time() - data.get('fetched', 0) > self.ttl:
+            return None
+        parser = RobotFileParser(robots_url)
+        parser.allow_all = data.get('allow_all', False)
+        parser.disallow_all = data.get('disallow_all', False)
+        parser.parse(data.get('text', '').splitlines())
+        parser.modified()
+        return parser
+
+    def set(self, robots_url, parser, text=None):
+        """Stores the rules of the url along with their source text."""
+        data = {
+            'url': robots_url,
+            'fetched': time.time(),
+            'allow_all': parser.allow_all,
+            'disallow_all': parser.disallow_all,
+            'text': text or '',
+        }
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            with io.open(self.location(robots_url), 'w', encoding='utf-8') as f:
+                f.write(json.dumps(data, ensure_ascii=False))
+        except (IOError, OSError):
+            logger.error("Failed to store the robots.txt rules of [%s]" % robots_url)
+
+
 class Session(requests.Session):
     """
     Caching Session object which consults robots.txt before accessing a resource.
@@ -77,19 +524,122 @@ class Session(requests.Session):
         self.headers = default_headers()
         self.follow_robots_txt = True
         self.robots_registry = {}
+        #: Events of the robots.txt files which are being downloaded.
+        self.robots_inflight = {}
+        self._robots_lock = threading.Lock()
+        #: Persistent store of the rules, see :class:`RobotsCache`.
+        self.robots_cache = None
+        #: On-disk response cache, see :meth:`enable_http_cache`.
+        self.cache = None
+        #: Recorded or replayed exchanges, see :meth:`enable_recording`.
+        self.archive = None
+        self.replay_latency = None
+        #: Writer of the WARC files, see :meth:`enable_warc`.
+        self.warc = None
         self.domain_blacklist = set()
+        #: Min seconds between two requests to a same server.
+        self.delay = None
+        #: Requests and bandwidth budgets consulted before every request.
+        self.limiter = RateLimiter()
+        #: Usage counters of the connection pools.
+        self.pool_stats = PoolStats()
+        self.pool_size = DEFAULT_POOLSIZE
         self.logger = logger.getChild(self.__class__.__name__)
+        self.set_pool_size(DEFAULT_POOLSIZE)
+
+    def set_pool_size(self, size):
+        """Mounts the adapters which keep the `size` connections open to
+        a same server and the pools of as many servers."""
+        self.pool_size = size
+        for prefix in ('https://', 'http://'):
+            if self.cache is not None:
+                adapter = CachingAdapter(
+                    self.cache, self, stats=self.pool_stats,
+                    pool_connections=size, pool_maxsize=size)
+            else:
+                adapter = PooledAdapter(
+                    self.pool_stats, pool_connections=size, pool_maxsize=size)
+            if self.replaying:
+                adapter = ReplayAdapter(self.archive, self.replay_latency)
+            if self.warc is not None:
+                adapter = WarcAdapter(self.warc, adapter)
+            if self.archive is not None and not self.replaying:
+                adapter = RecordingAdapter(self.archive, adapter)
+            self.mount(prefix, adapter)
+        self.logger.debug('Set connection pool size to [%r] for [%r]' % (size, self))
+
+    @property
+    def replaying(self):
+        return self.archive is not None and self.archive.replaying
+
+    @property
+    def adapters_required(self):
+        """Whether the requests must go through the mounted adapters, which
+        hold the http cache and the record, replay or WARC archives."""
+        return self.cache is not None or self.archive is not None or self.warc is not None
+
+    def enable_recording(self, path):
+        """Records every exchange of this session in a new archive file
+        which could be replayed later, see :meth:`enable_replay`."""
+        self.archive = Archive(path)
+        self.set_pool_size(self.pool_size)
+
+    def enable_replay(self, path, latency=None):
+        """Answers the requests from an archive recorded by an earlier run
+        without any networking, requests which weren't recorded raise
+        :class:`pywebcopy.replay.ArchiveMiss` errors.
+
+        :param path: location of the archive file.
+        :param latency: (optional) 'recorded' to take as long as the recorded
+            requests did, or seconds which every request takes.
+        """
+        self.archive = Archive(path, replaying=True)
+        self.replay_latency = latency
+        self.set_pool_size(self.pool_size)
 
-    def enable_http_cache(self):
-        try:
-            import cachecontrol
-        except ImportError:
-            raise ImportError(
-                "cachecontrol module is not installed."
-                " Install it like this from pip: $ pip install cachecontrol"
-            )
-        self.mount('https://', cachecontrol.CacheControlAdapter())
-        self.mount('http://', cachecontrol.CacheControlAdapter())
+    def pool_usage(self):
+        """Returns the usage of the connection pools.
+
+        :rtype: PoolInfo
+        """
+        return self.pool_stats.info()
+
+    def enable_warc(self, path, prefix=None, max_size=None):
+        """Writes every exchange of this session to the gzip compressed
+        WARC files in a folder, see :class:`pywebcopy.warc.WarcWriter`.
+
+        :param path: folder of the WARC files.
+        :param prefix: (optional) start of the names of the files.
+        :param max_size: (optional) bytes after which the next file is started.
+        """
+        kwargs = {}
+        if prefix:
+            kwargs['prefix'] = prefix
+        if max_size:
+            kwargs['max_size'] = max_size
+        self.warc = WarcWriter(path, **kwargs)
+        self.set_pool_size(self.pool_size)
+
+    def close(self):
+        super(Session, self).close()
+        if self.warc is not None:
+            self.warc.close()
+
+    def enable_http_cache(self, path=None, max_size=None):
+        """Stores the responses on the disk and serves them from there for
+        as long as they are fresh, see :class:`pywebcopy.cache.HTTPCache`.
+
+        :param path: (optional) folder of the cache, a folder in the temp
+            dir is shared by all the sessions if it is not set.
+        :param max_size: (optional) max bytes taken by the stored bodies.
+        """
+        if path is None:
+            path = os.path.join(tempfile.gettempdir(), '%s-http-cache' % __title__)
+        if max_size is None:
+            self.cache = HTTPCache(path)
+        else:
+            self.cache = HTTPCache(path, max_size)
+        self.set_pool_size(self.pool_size)
 
     def set_follow_robots_txt(self, b):
         """Set whether to follow the robots.txt rules or not.
@@ -108,7 +658,8 @@ class Session(requests.Session):
         :param timeout: requests timeout
         :return: loaded rules or None if failed.
         """
-        _parser = RobotFileParser()
+        _parser = RobotFileParser(robots_url)
+        text = None
         try:
             req = requests.Request(
                 method='GET',
@@ -139,12 +690,80 @@ class Session(requests.Session):
         except requests.exceptions.ConnectionError:
             _parser.allow_all = True
         else:
-            _parser.parse(f.text.splitlines())
+            text = f.text
+            _parser.parse(text.splitlines())
         self.robots_registry[robots_url] = _parser
         #: Initiate a start time for delays
         _parser.modified()
+        # Server or network failures are not stored as they would pass soon.
+        if self.robots_cache is not None and (text is not None or _parser.allow_all
+                                              or _parser.disallow_all):
+            self.robots_cache.set(robots_url, _parser, text)
         return _parser
 
+    def get_rules(self, robots_url, timeout=None):
+        """Returns the rules of the robots.txt file, concurrent calls for
+        a same file wait for the first one to download it.
+
+        The rules are taken from the :attr:`robots_cache` if they are
+        stored there and not yet expired.
+
+        :param robots_url: url address of the text file to load.
+        :param timeout: requests timeout
+        :rtype: RobotFileParser
+        """
+        rules = self.robots_registry.get(robots_url)
+        if rules is not None:
+            return rules
+        with self._robots_lock:
+            rules = self.robots_registry.get(robots_url)
+            if rules is not None:
+                return rules
+            event = self.robots_inflight.get(robots_url)
+            if event is not None:
+                owner = False
+            else:
+                owner = True
+                event = self.robots_inflight[robots_url] = threading.Event()
+        if not owner:
+            event.wait(timeout)
+            return self.robots_registry.get(robots_url)
+        try:
+            if self.robots_cache is not None:
+                rules = self.robots_cache.get(robots_url)
+            if rules is not None:
+                self.logger.debug("Loaded the stored robots.txt rules of [%s]" % robots_url)
+                self.robots_registry[robots_url] = rules
+            else:
+                rules = self.load_rules_from_url(robots_url, timeout)
+        finally:
+            with self._robots_lock:
+                self.robots_inflight.pop(robots_url, None)
+            event.set()
+        return rules
+
+    def prefetch_rules(self, url, timeout=None):
+        """Starts loading the robots.txt rules of the server of the url in
+        the background unless these are already available or loading.
+
+        :rtype: threading.Thread or None
+        """
+        if not self.follow_robots_txt:
+            return None
+        s, n, p, q, f = urlsplit(url)
+        if s not in ('http', 'https') or n in self.domain_blacklist:
+            return None
+        robots_url = urlunsplit((s, n, 'robots.txt', None, None))
+        with self._robots_lock:
+            if robots_url in self.robots_registry or robots_url in self.robots_inflight:
+                return None
+        thread = threading.Thread(
+            target=self.get_rules, args=(robots_url, timeout),
+            name='robots-%s' % n)
+        thread.daemon = True
+        thread.start()
+        return thread
+
     # def validate_url(self, url):
     #     if not isinstance(url, string_types):
     #         self.logger.error(
@@ -172,43 +791,89 @@ class Session(requests.Session):
             return True
 
         robots_url = urlunsplit((s, n, 'robots.txt', None, None))
-        try:
-            access_rules = self.robots_registry[robots_url]
-        except KeyError:
-            access_rules = self.load_rules_from_url(robots_url, timeout)
+        access_rules = self.get_rules(robots_url, timeout)
         if access_rules is None:  # error - everybody welcome
             return True
 
         user_agent = request.headers.get('User-Agent', '*')
-        allowed = access_rules.can_fetch(user_agent, request.url)
-        if not allowed:
-            return False
-        request_rate = access_rules.request_rate(user_agent)
-        if request_rate is None:
-            #: No worries :)
-            return True
+        #: The request rate is enforced by the :attr:`limiter`.
+        return access_rules.can_fetch(user_agent, request.url)
 
-        diff_time = time.time() - access_rules.mtime()
-        delay = request_rate.seconds / request_rate.requests
+    def get_crawl_delay(self, url):
+        """Returns the min seconds between two requests to the server of the url.
 
-        if isinstance(delay, integer_types) and not diff_time >= delay:
-            self.logger.debug(
-                "Waiting on request for [%r] seconds!" % delay)
-            time.sleep(delay)
-        #: Update the access time value
-        access_rules.modified()
-        return True
+        It is the larger of the :attr:`delay` and the `Crawl-delay` or the
+        `Request-rate` of the robots.txt rules, if these are already loaded.
+        """
+        delay = self.delay or 0
+        if not self.follow_robots_txt:
+            return delay
+        s, n, p, q, f = urlsplit(url)
+        access_rules = self.robots_registry.get(urlunsplit((s, n, 'robots.txt', None, None)))
+        if access_rules is None:
+            return delay
+        user_agent = self.headers.get('User-Agent', '*')
+        # These are not available on older pythons.
+        if hasattr(access_rules, 'crawl_delay'):
+            delay = max(delay, access_rules.crawl_delay(user_agent) or 0)
+        if hasattr(access_rules, 'request_rate'):
+            request_rate = access_rules.request_rate(user_agent)
+            if request_rate is not None:
+                delay = max(delay, request_rate.seconds / float(request_rate.requests))
+        return delay
+
+    def reserve(self, url):
+        """Reserves a request to the url in the :attr:`limiter` and returns
+        the seconds to wait before sending it, honoring the crawl delay."""
+        return self.limiter.reserve(urlsplit(url).netloc, self.get_crawl_delay(url))
+
+    def throttle_response(self, response):
+        """Makes the reads of the response body consult the bandwidth budget."""
+        raw = getattr(response, 'raw', None)
+        if self.limiter.bytes is None or not hasattr(raw, 'read'):
+            return response
+        # Bodies of the cache are read from the disk, and the downloaded ones
+        # were already throttled on their way in.
+        if hasattr(response, 'from_cache'):
+            return response
+        read = raw.read
+        limiter = self.limiter
+
+        def throttled_read(*args, **kwargs):
+            data = read(*args, **kwargs)
+            if data:
+                limiter.throttle(len(data))
+            return data
+
+        # Replaced on the instance itself so that the attributes
+        # like `decode_content` could still be set on the raw.
+        raw.read = throttled_read
+        return response
 
     def send(self, request, **kwargs):
         if not isinstance(request, requests.PreparedRequest):
             raise ValueError('You can only send PreparedRequests.')
+        if self.cache is not None and self.cache.fresh_entry(request) is not None:
+            # Served from the disk, hence there is nothing to wait for.
+            self.logger.info('[%s] [%s] (cached)' % (request.method, request.url))
+            return super(Session, self).send(request, **kwargs)
+        # The robots.txt rules of the replays are replayed as well.
         if not self.is_allowed(request, kwargs.get('timeout', None)):
             err = "Access to [%r] disallowed by the Session rules." % request.url
             self.logger.error(err)
             raise UrlDisallowed(err)
+        if self.replaying:
+            # The archive stands in for the network, including its politeness.
+            self.logger.info('[%s] [%s] (replayed)' % (request.method, request.url))
+            return super(Session, self).send(request, **kwargs)
 
+        wait = self.reserve(request.url)
+        if wait > 0:
+            self.logger.debug(
+                "Waiting on request for [%r] seconds!" % wait)
+            time.sleep(wait)
         self.logger.info('[%s] [%s]' % (request.method, request.url))
-        return super(Session, self).send(request, **kwargs)
+        return self.throttle_response(super(Session, self).send(request, **kwargs))
 
     @classmethod
     def from_config(cls, config):
@@ -217,8 +882,27 @@ class Session(requests.Session):
         ans.headers = config.get('http_headers', default_headers())
         ans.follow_robots_txt = not config.get('bypass_robots')
         ans.delay = config.get_delay()
+        ans.limiter = RateLimiter(
+            rate=config.get('rate_limit'), bandwidth=config.get('bandwidth_limit'))
+        ans.set_pool_size(config.connection_pool_size())
+        if config.get('warc'):
+            ans.enable_warc(
+                os.path.join(config.get('project_folder'), 'warc'),
+                config.get('project_name'), config.get('warc_size'))
+        if config.get('replay'):
+            # Nothing but the archive answers, not even the stored rules.
+            ans.enable_replay(config.get('replay'), config.get('replay_latency'))
+            return ans
+        if config.get('record'):
+            # The robots.txt files are recorded too, for the replays to obey them.
+            ans.enable_recording(config.get('record'))
+        elif config.get('robots_cache_ttl') and config.is_set():
+            ans.robots_cache = RobotsCache(
+                config.metadata_path('robots'), config.get('robots_cache_ttl'))
         if config.get('http_cache'):
-            ans.enable_http_cache()
+            ans.enable_http_cache(
+                config.metadata_path('http_cache') if config.is_set() else None,
+                config.get('http_cache_size'))
         # XXX I don't know if it will work?
         # ans.headers.update(
         #     {'Accept': ', '.join(config.get('allowed_file_types'))}
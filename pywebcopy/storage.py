@@ -0,0 +1,371 @@
+# Copyright 2020; Raja Tomar
+# See license for more details
+"""
+Storage backends in which the files of a project are saved.
+
+The filesystem storage writes every file at its own path, like it has
+always been done. The other ones keep all the files in a single zip, tar
+or SQLite file, which spares the inodes of millions of tiny assets, or
+in memory, which spares the disk altogether e.g. in the tests.
+
+Files are addressed by the paths which the :class:`pywebcopy.urls.Context`
+resolves, the containers store them relative to their root folder.
+"""
+import errno
+import logging
+import os
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import time
+import warnings
+import zipfile
+from io import BytesIO
+from shutil import copyfileobj
+
+from six import PY2
+
+from .urls import known_dirs
+from .urls import retrieve_resource
+
+__all__ = [
+    'Storage', 'FileStorage', 'ZipStorage', 'TarStorage', 'SQLiteStorage',
+    'MemoryStorage', 'file_storage', 'storage_types',
+]
+
+logger = logging.getLogger(__name__)
+
+
+def _missing(location):
+    return IOError(errno.ENOENT, "No such file in the storage", location)
+
+
+class Storage(object):
+    """Interface of the storage backends.
+
+    :param root: (optional) folder to which the stored names are relative.
+    """
+
+    def __init__(self, root=None):
+        self.root = os.path.normpath(root) if root else None
+        self.lock = threading.RLock()
+        self.logger = logger.getChild(self.__class__.__name__)
+
+    def __repr__(self):
+        return '<%s(root=%s)>' % (self.__class__.__name__, self.root)
+
+    def name(self, location):
+        """Returns the name under which the file at the location is stored."""
+        location = os.path.normpath(location)
+        if self.root is not None:
+            rel = os.path.relpath(location, self.root)
+            if not rel.startswith(os.pardir):
+                location = rel
+        return location.replace(os.sep, '/').lstrip('/')
+
+    def write(self, content, location, url=None, overwrite=False):
+        """Stores the content read from a file like object at the location.
+
+        :param content: file like object with read method.
+        :param location: path of the file.
+        :param url: (optional) url of the resource used for logging purposes.
+        :param overwrite: (optional) whether to overwrite an existing file.
+        :return: the location.
+        """
+        raise NotImplementedError()
+
+    def open(self, location):
+        """Returns a readable binary file object of the stored file.
+
+        :raises IOError: if the file is not stored.
+        """
+        raise NotImplementedError()
+
+    def size(self, location):
+        """Returns the bytes of the stored file.
+
+        :raises IOError: if the file is not stored.
+        """
+        raise NotImplementedError()
+
+    def exists(self, location):
+        try:
+            self.size(location)
+        except (OSError, IOError):
+            return False
+        return True
+
+    def prepare(self, locations):
+        """Prepares the storage for many files which are going to be written.
+
+        :return: number of the folders created for them.
+        """
+        return 0
+
+    def flush(self):
+        """Makes the stored files readable by the other programs."""
+
+    def close(self):
+        self.flush()
+
+
+class FileStorage(Storage):
+    """Every file is written at its own path on the disk."""
+
+    def write(self, content, location, url=None, overwrite=False):
+        return retrieve_resource(content, location, url or location, overwrite)
+
+    def open(self, location):
+        return open(location, 'rb')
+
+    def size(self, location):
+        return os.path.getsize(location)
+
+    def prepare(self, locations):
+        return known_dirs.prepare(locations)
+
+
+#: Storage of the resources whose context doesn't name any.
+file_storage = FileStorage()
+
+
+class ZipStorage(Storage):
+    """All the files are stored in a single zip file.
+
+    The zip index is written when the storage is flushed, the archive is
+    opened again by the next write. Overwritten files are appended again
+    and the readers then pick the latest one.
+
+    :param path: location of the zip file, it is appended to if it exists.
+    :param root: (optional) folder to which the stored names are relative.
+    :param compression: (optional) zipfile compression method.
+    """
+
+    def __init__(self, path, root=None, compression=zipfile.ZIP_DEFLATED):
+        super(ZipStorage, self).__init__(root)
+        self.path = path
+        self.compression = compression
+        self.archive = None
+        self.sizes = {}
+        if os.path.exists(path):
+            with zipfile.ZipFile(path) as f:
+                for info in f.infolist():
+                    self.sizes[info.filename] = info.file_size
+
+    def __repr__(self):
+        return '<%s(path=%s)>' % (self.__class__.__name__, self.path)
+
+    def _archive(self):
+        if self.archive is None:
+            self.archive = zipfile.ZipFile(
+                self.path, 'a', self.compression, allowZip64=True)
+        return self.archive
+
+    def write(self, content, location, url=None, overwrite=False):
+        name = self.name(location)
+        with self.lock:
+            if name in self.sizes and not overwrite:
+                self.logger.debug("[%s] is already stored as [%s]" % (url, name))
+                return location
+            archive = self._archive()
+            info = zipfile.ZipInfo(name, time.localtime()[:6])
+            info.compress_type = self.compression
+            info.external_attr = 0o644 << 16
+            with warnings.catch_warnings():
+                # Overwritten files are stored under the same name again.
+                warnings.simplefilter('ignore', UserWarning)
+                if PY2:
+                    archive.writestr(info, content.read())
+                else:
+                    with archive.open(info, 'w', force_zip64=True) as dst:
+                        copyfileobj(content, dst)
+            self.sizes[name] = archive.getinfo(name).file_size
+        self.logger.info("[File] Stored the file from <%s> as <%s>" % (url, name))
+        return location
+
+    def open(self, location):
+        name = self.name(location)
+        with self.lock:
+            if name not in self.sizes:
+                raise _missing(location)
+            if self.archive is not None:
+                return BytesIO(self.archive.read(name))
+            with zipfile.ZipFile(self.path) as f:
+                return BytesIO(f.read(name))
+
+    def size(self, location):
+        try:
+            return self.sizes[self.name(location)]
+        except KeyError:
+            raise _missing(location)
+
+    def flush(self):
+        with self.lock:
+            if self.archive is not None:
+                self.archive.close()
+                self.archive = None
+
+
+class TarStorage(Storage):
+    """All the files are stored in a single uncompressed tar file.
+
+    A tar member needs its size upfront hence every file is spooled to
+    a temporary file first. Overwritten files are appended again and the
+    readers then pick the latest one.
+
+    :param path: location of the tar file, it is appended to if it exists.
+    :param root: (optional) folder to which the stored names are relative.
+    :param spool_size: (optional) bytes of a file which are kept in memory.
+    """
+
+    def __init__(self, path, root=None, spool_size=1 << 20):
+        super(TarStorage, self).__init__(root)
+        self.path = path
+        self.spool_size = spool_size
+        self.archive = None
+        self.sizes = {}
+        if os.path.exists(path):
+            with tarfile.open(path) as f:
+                for info in f.getmembers():
+                    self.sizes[info.name] = info.size
+
+    def __repr__(self):
+        return '<%s(path=%s)>' % (self.__class__.__name__, self.path)
+
+    def write(self, content, location, url=None, overwrite=False):
+        name = self.name(location)
+        with self.lock:
+            if name in self.sizes and not overwrite:
+                self.logger.debug("[%s] is already stored as [%s]" % (url, name))
+                return location
+        with tempfile.SpooledTemporaryFile(self.spool_size) as spool:
+            copyfileobj(content, spool)
+            info = tarfile.TarInfo(name)
+            info.size = spool.tell()
+            info.mtime = time.time()
+            info.mode = 0o644
+            spool.seek(0)
+            with self.lock:
+                if self.archive is None:
+                    self.archive = tarfile.open(self.path, 'a')
+                self.archive.addfile(info, spool)
+                self.sizes[name] = info.size
+        self.logger.info("[File] Stored the file from <%s> as <%s>" % (url, name))
+        return location
+
+    def open(self, location):
+        name = self.name(location)
+        with self.lock:
+            if name not in self.sizes:
+                raise _missing(location)
+            # The appending archive can't be read from in the meantime.
+            self.flush()
+            with tarfile.open(self.path) as f:
+                return BytesIO(f.extractfile(f.getmember(name)).read())
+
+    def size(self, location):
+        try:
+            return self.sizes[self.name(location)]
+        except KeyError:
+            raise _missing(location)
+
+    def flush(self):
+        with self.lock:
+            if self.archive is not None:
+                self.archive.close()
+                self.archive = None
+
+
+class SQLiteStorage(Storage):
+    """All the files are stored as blobs in a SQLite database, which could
+    be shared by the processes of a sharded crawl.
+
+    :param path: location of the database file.
+    :param root: (optional) folder to which the stored names are relative.
+    :param timeout: seconds to wait for the other processes sharing it.
+    """
+
+    def __init__(self, path, root=None, timeout=60):
+        super(SQLiteStorage, self).__init__(root)
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, data BLOB, '
+            'size INTEGER, stored REAL)')
+        self.conn.commit()
+
+    def __repr__(self):
+        return '<%s(path=%s)>' % (self.__class__.__name__, self.path)
+
+    def write(self, content, location, url=None, overwrite=False):
+        name = self.name(location)
+        data = content.read()
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR %s INTO files (name, data, size, stored) VALUES (?, ?, ?, ?)'
+                % ('REPLACE' if overwrite else 'IGNORE'),
+                (name, sqlite3.Binary(data), len(data), time.time()))
+            self.conn.commit()
+        self.logger.info("[File] Stored the file from <%s> as <%s>" % (url, name))
+        return location
+
+    def _select(self, column, location):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT %s FROM files WHERE name = ?' % column,
+                (self.name(location),)).fetchone()
+        if row is None:
+            raise _missing(location)
+        return row[0]
+
+    def open(self, location):
+        return BytesIO(bytes(self._select('data', location)))
+
+    def size(self, location):
+        return self._select('size', location)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class MemoryStorage(Storage):
+    """All the files are kept in the :attr:`files` dict of this process."""
+
+    def __init__(self, root=None):
+        super(MemoryStorage, self).__init__(root)
+        self.files = {}
+
+    def write(self, content, location, url=None, overwrite=False):
+        name = self.name(location)
+        data = content.read()
+        with self.lock:
+            if overwrite or name not in self.files:
+                self.files[name] = data
+        return location
+
+    def open(self, location):
+        try:
+            return BytesIO(self.files[self.name(location)])
+        except KeyError:
+            raise _missing(location)
+
+    def size(self, location):
+        try:
+            return len(self.files[self.name(location)])
+        except KeyError:
+            raise _missing(location)
+
+
+#: Storage backends by the names of the `storage` key of the config,
+#: along with the extensions of their files.
+storage_types = {
+    'filesystem': (FileStorage, None),
+    'zip': (ZipStorage, '.zip'),
+    'tar': (TarStorage, '.tar'),
+    'sqlite': (SQLiteStorage, '.sqlite'),
+    'memory': (MemoryStorage, None),
+}
@@ -0,0 +1,68 @@
+# Copyright 2020; Raja Tomar
+# See license for more details
+"""
+Local http server which the tests crawl instead of the internet.
+"""
+import functools
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from six.moves import BaseHTTPServer
+from six.moves import SimpleHTTPServer
+from six.moves import socketserver
+
+
+class QuietHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """Serves the files of a folder without logging the requests."""
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class ServerTestCase(unittest.TestCase):
+    """Runs the `handler` on a free local port during every test.
+
+    The `files` are written in the :attr:`root` folder which is served by
+    the file handlers, and the :attr:`out` folder is there to save into.
+    """
+    #: Request handler class of the server.
+    handler = QuietHandler
+    #: Server class, i.e. a threading one to serve concurrent requests.
+    server_class = BaseHTTPServer.HTTPServer
+    #: Names and contents of the files served from the root folder.
+    files = {}
+    #: Path which the :attr:`url` of the tests points to.
+    url_path = '/'
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.out = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.out)
+        for name, data in self.files.items():
+            with open(os.path.join(self.root, name), 'wb') as fh:
+                fh.write(data)
+        handler = self.handler
+        if issubclass(handler, SimpleHTTPServer.SimpleHTTPRequestHandler):
+            handler = functools.partial(handler, directory=self.root)
+        self.server = self.server_class(('127.0.0.1', 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d%s' % (self.server.server_address[1], self.url_path)
+
+    def tearDown(self):
+        self.stop_server()
+
+    def stop_server(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
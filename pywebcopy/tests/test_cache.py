@@ -0,0 +1,176 @@
+# Copyright 2019; Raja Tomar
+import os
+import time
+import unittest
+from email.utils import formatdate
+
+import requests
+from six.moves import BaseHTTPServer
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from pywebcopy.cache import freshness_lifetime
+from pywebcopy.cache import parse_cache_control
+from pywebcopy.session import Session
+from pywebcopy.tests.server import ServerTestCase
+
+
+class CachingHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    #: Response headers and body of every path.
+    pages = {}
+    #: Paths and the statuses of the served requests.
+    served = []
+
+    def do_GET(self):
+        headers, body = self.pages[self.path]
+        etag = dict(headers).get('ETag')
+        if etag is not None and self.headers.get('If-None-Match') == etag:
+            self.served.append((self.path, 304))
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.served.append((self.path, 200))
+        self.send_response(200)
+        for k, v in headers:
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestFreshness(unittest.TestCase):
+    def test_cache_control(self):
+        self.assertEqual(parse_cache_control('max-age=60, no-cache, private="x"'),
+                         {'max-age': '60', 'no-cache': True, 'private': 'x'})
+        self.assertEqual(freshness_lifetime({'Cache-Control': 'max-age=60'}), 60)
+        self.assertEqual(freshness_lifetime({'Cache-Control': 'max-age=60, no-cache'}), 0)
+
+    def test_expires_and_heuristic(self):
+        now = time.time()
+        self.assertEqual(freshness_lifetime({
+            'Date': formatdate(now, usegmt=True),
+            'Expires': formatdate(now + 120, usegmt=True)}), 120)
+        self.assertEqual(freshness_lifetime({
+            'Date': formatdate(now, usegmt=True),
+            'Last-Modified': formatdate(now - 1000, usegmt=True)}), 100)
+        self.assertEqual(freshness_lifetime({}), 0)
+
+
+class TestHTTPCache(ServerTestCase):
+    handler = CachingHandler
+    url_path = ''
+
+    def setUp(self):
+        CachingHandler.served = []
+        CachingHandler.pages = {
+            '/fresh': ([('Cache-Control', 'max-age=60')], b'fresh body'),
+            '/stale': ([('Cache-Control', 'max-age=0'), ('ETag', '"v1"')], b'stale body'),
+            '/private': ([('Cache-Control', 'no-store')], b'private body'),
+            '/copy': ([('Cache-Control', 'max-age=60')], b'fresh body'),
+            '/plain': ([], b'plain body'),
+        }
+        super(TestHTTPCache, self).setUp()
+        self.session = self.create_session()
+
+    def tearDown(self):
+        super(TestHTTPCache, self).tearDown()
+        self.session.cache.close()
+
+    def create_session(self, max_size=None):
+        ans = Session()
+        ans.follow_robots_txt = False
+        ans.enable_http_cache(self.out, max_size)
+        return ans
+
+    def test_fresh_response_is_served_from_disk(self):
+        first = self.session.get(self.url + '/fresh')
+        self.assertEqual(first.content, b'fresh body')
+        self.assertFalse(first.from_cache)
+        second = self.session.get(self.url + '/fresh')
+        self.assertEqual(second.content, b'fresh body')
+        self.assertTrue(second.from_cache)
+        self.assertEqual(CachingHandler.served, [('/fresh', 200)])
+
+        # The cache survives the session.
+        other = self.create_session()
+        self.assertEqual(other.get(self.url + '/fresh').content, b'fresh body')
+        self.assertEqual(len(CachingHandler.served), 1)
+        other.cache.close()
+
+    @unittest.skipIf(aiohttp is None, "aiohttp is not installed.")
+    def test_asyncio_client(self):
+        from pywebcopy.aio import AsyncClient
+        from pywebcopy.aio import EventLoopThread
+        runner = EventLoopThread()
+        runner.start()
+        client = AsyncClient()
+        self.addCleanup(runner.stop, 5)
+        self.addCleanup(lambda: runner.submit(client.close()).result(5))
+        for _ in range(2):
+            response = runner.submit(
+                client.request(self.session, 'GET', self.url + '/fresh')).result(5)
+            self.assertEqual(response.content, b'fresh body')
+        self.assertTrue(response.from_cache)
+        self.assertEqual(CachingHandler.served, [('/fresh', 200)])
+
+    def test_stale_response_is_revalidated(self):
+        self.session.get(self.url + '/stale')
+        second = self.session.get(self.url + '/stale')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, b'stale body')
+        self.assertTrue(second.from_cache)
+        self.assertEqual(CachingHandler.served, [('/stale', 200), ('/stale', 304)])
+
+        # Conditional requests of the caller get the answer of the server.
+        third = self.session.get(self.url + '/stale', headers={'If-None-Match': '"v1"'})
+        self.assertEqual(third.status_code, 304)
+
+    def test_no_store(self):
+        self.session.get(self.url + '/private')
+        self.assertEqual(self.session.get(self.url + '/private').content, b'private body')
+        self.assertEqual(len(CachingHandler.served), 2)
+        self.assertIsNone(self.session.cache.lookup(
+            requests.Request('GET', self.url + '/private').prepare()))
+
+    def test_same_body_stored_again(self):
+        # Without the freshness headers every response replaces the stored one.
+        for _ in range(3):
+            response = self.session.get(self.url + '/plain')
+            self.assertEqual(response.content, b'plain body')
+        entry = self.session.cache.lookup(
+            requests.Request('GET', self.url + '/plain').prepare())
+        self.assertTrue(os.path.exists(entry.path))
+        self.assertEqual(self.session.cache.total, len(b'plain body'))
+
+    def test_bodies_are_stored_once(self):
+        self.session.get(self.url + '/fresh')
+        self.session.get(self.url + '/copy')
+        cache = self.session.cache
+        self.assertEqual(cache.total, len(b'fresh body'))
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(cache.folder)), 1)
+
+    def test_eviction(self):
+        self.session.cache.close()
+        self.session = self.create_session(max_size=len(b'fresh body') + len(b'stale body'))
+        self.session.get(self.url + '/fresh')
+        self.session.get(self.url + '/stale')
+        self.session.get(self.url + '/fresh')
+        CachingHandler.pages['/other'] = ([('Cache-Control', 'max-age=60')], b'other body')
+        self.session.get(self.url + '/other')
+        cache = self.session.cache
+
+        def stored(path):
+            return cache.lookup(requests.Request('GET', self.url + path).prepare()) is not None
+
+        # The least recently used one makes room for the new body.
+        self.assertFalse(stored('/stale'))
+        self.assertTrue(stored('/fresh'))
+        self.assertTrue(stored('/other'))
+        self.assertLessEqual(cache.total, cache.max_size)
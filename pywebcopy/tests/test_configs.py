@@ -5,6 +5,9 @@ import unittest
 
 from pywebcopy import configs
 from pywebcopy.urls import Context
+from pywebcopy.cache import HTTPCache
+from pywebcopy.session import CachingAdapter
+from pywebcopy.session import ReplayAdapter
 from pywebcopy.session import Session
 from pywebcopy.core import WebPage
 from pywebcopy.schedulers import Scheduler
@@ -21,11 +24,53 @@ class TestConfigs(unittest.TestCase):
         sess = ans.create_session()
         self.assertTrue(isinstance(sess, Session))
         self.assertEqual(sess.follow_robots_txt, False)
-        from cachecontrol import CacheControlAdapter
+        self.assertTrue(isinstance(sess.cache, HTTPCache))
+        self.assertEqual(sess.cache.path, ans.metadata_path('http_cache'))
         for i in sess.adapters.values():
-            self.assertTrue(isinstance(i, CacheControlAdapter))
+            self.assertTrue(isinstance(i, CachingAdapter))
         self.assertEqual(sess.delay, 1)
         self.assertEqual(sess.headers, {'User-Agent': 'test-bot'})
+        self.assertIsNone(sess.robots_cache)
+        ans.__setitem__('robots_cache_ttl', 86400)
+        self.assertEqual(ans.create_session().robots_cache.ttl, 86400)
+
+    def test_session_replay(self):
+        ans = configs.get_config('http://localhost:5000')
+        path = os.path.join(tempfile.mkdtemp(), 'run.sqlite')
+        ans.__setitem__('replay', path)
+        ans.__setitem__('replay_latency', 'recorded')
+        ans.__setitem__('http_cache', True)
+        sess = ans.create_session()
+        self.assertTrue(sess.replaying)
+        self.assertIsNone(sess.cache)
+        self.assertIsNone(sess.robots_cache)
+        for i in sess.adapters.values():
+            self.assertTrue(isinstance(i, ReplayAdapter))
+            self.assertEqual(i.latency, 'recorded')
+        sess.archive.close()
+
+    def test_session_rate_limits(self):
+        ans = configs.get_config('http://localhost:5000')
+        ans.__setitem__('rate_limit', 5)
+        ans.__setitem__('bandwidth_limit', 1024)
+        sess = ans.create_session()
+        self.assertEqual(sess.limiter.rate, 5)
+        self.assertEqual(sess.limiter.bandwidth, 1024)
+
+    def test_session_pool_size(self):
+        ans = configs.get_config('http://localhost:5000')
+        self.assertEqual(ans.connection_pool_size(), 10)
+        ans.__setitem__('threaded', True)
+        self.assertEqual(ans.connection_pool_size(), configs.unbounded_pool_size)
+        ans.__setitem__('workers', 16)
+        self.assertEqual(ans.connection_pool_size(), 16)
+        ans.__setitem__('pool_size', 4)
+        self.assertEqual(ans.connection_pool_size(), 4)
+        ans.__setitem__('pool_size', None)
+        sess = ans.create_session()
+        self.assertEqual(sess.pool_size, 16)
+        for i in sess.adapters.values():
+            self.assertEqual(i._pool_maxsize, 16)
 
     def test_context_creation(self):
         ans = configs.get_config('http://localhost:5000')
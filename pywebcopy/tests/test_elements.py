@@ -5,6 +5,8 @@ import shutil
 import unittest
 import tempfile
 
+from pywebcopy.urls import DirectoryCache
+from pywebcopy.urls import known_dirs
 from pywebcopy.urls import make_fd
 
 
@@ -38,6 +40,41 @@ class TestFileDescriptorMaking(unittest.TestCase):
         self.assertTrue(os.path.exists(ans))
         os.close(fd)
 
+    def test_removed_dir_is_created_again(self):
+        ans = os.path.join(self.base_dir, 'sub', 'file')
+        os.close(make_fd(ans))
+        self.assertIn(os.path.dirname(ans), known_dirs)
+        shutil.rmtree(self.base_dir)
+        fd = make_fd(ans)
+        self.assertNotEqual(fd, -1)
+        os.close(fd)
+        self.assertTrue(os.path.exists(ans))
+
+
+class TestDirectoryCache(unittest.TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def test_prepare(self):
+        ans = DirectoryCache()
+        files = [os.path.join(self.base_dir, 'a', 'b', '%d.html' % i) for i in range(3)]
+        files.append(os.path.join(self.base_dir, 'a', 'c', 'index.html'))
+        self.assertEqual(ans.prepare(files), 2)
+        self.assertTrue(os.path.isdir(os.path.join(self.base_dir, 'a', 'c')))
+        self.assertIn(os.path.join(self.base_dir, 'a'), ans)
+        self.assertIn(self.base_dir, ans)
+        self.assertEqual(ans.prepare(files), 0)
+
+    def test_forget(self):
+        ans = DirectoryCache()
+        self.assertTrue(ans.ensure(os.path.join(self.base_dir, 'a', 'b')))
+        ans.forget(os.path.join(self.base_dir, 'a'))
+        self.assertNotIn(os.path.join(self.base_dir, 'a', 'b'), ans)
+        self.assertIn(self.base_dir, ans)
+
 
 from six.moves.SimpleHTTPServer import SimpleHTTPRequestHandler
 
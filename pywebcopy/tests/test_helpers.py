@@ -1,10 +1,23 @@
 # Copyright 2019; Raja Tomar
+import threading
+import time
 import unittest
+import warnings
 from threading import Event
 
+import requests
 from six import BytesIO
 
+from pywebcopy.helpers import BloomFilter
 from pywebcopy.helpers import CallbackFileWrapper
+from pywebcopy.helpers import ConcurrentDelay
+from pywebcopy.helpers import LRUCache
+from pywebcopy.helpers import RateLimiter
+from pywebcopy.helpers import ScalableBloomFilter
+from pywebcopy.helpers import lru_cache
+from pywebcopy.helpers import TokenBucket
+from pywebcopy.session import Session
+from pywebcopy.session import make_response
 
 
 class TestCallbackFileWrapperWithBinary(unittest.TestCase):
@@ -92,3 +105,203 @@ class TestCallbackFileWrapperWithBinary(unittest.TestCase):
 
 if __name__ == '__main__':
     unittest.main()
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_reservations_are_spaced(self):
+        ans = TokenBucket(10)
+        self.assertEqual(ans.reserve(), 0)
+        self.assertAlmostEqual(ans.reserve(), 0.1, delta=0.01)
+        self.assertAlmostEqual(ans.reserve(), 0.2, delta=0.01)
+
+    def test_wait_time_does_not_take_tokens(self):
+        ans = TokenBucket(10)
+        self.assertEqual(ans.wait_time(), 0)
+        self.assertEqual(ans.wait_time(), 0)
+        ans.reserve()
+        self.assertAlmostEqual(ans.wait_time(), 0.1, delta=0.01)
+
+    def test_concurrent_rate(self):
+        ans = TokenBucket(100)
+        threads = [threading.Thread(target=ans.acquire) for _ in range(21)]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # The first token is available at once.
+        self.assertAlmostEqual(time.time() - start, 0.2, delta=0.05)
+
+    def test_invalid_rate(self):
+        self.assertRaises(ValueError, TokenBucket, 0)
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_hosts_are_independent(self):
+        ans = RateLimiter()
+        self.assertEqual(ans.reserve('a.com', 0.5), 0)
+        self.assertAlmostEqual(ans.reserve('a.com', 0.5), 0.5, delta=0.01)
+        self.assertEqual(ans.reserve('b.com', 0.5), 0)
+        self.assertEqual(ans.reserve('c.com'), 0)
+        self.assertEqual(ans.reserve('c.com'), 0)
+
+    def test_global_rate(self):
+        ans = RateLimiter(rate=10)
+        self.assertEqual(ans.reserve('a.com'), 0)
+        self.assertAlmostEqual(ans.reserve('b.com'), 0.1, delta=0.01)
+
+    def test_global_slot_is_taken_with_the_host_slot(self):
+        ans = RateLimiter(rate=10)
+        self.assertEqual(ans.reserve('a.com', 0.5), 0)
+        self.assertAlmostEqual(ans.wait_time('a.com', 0.5), 0.5, delta=0.01)
+        self.assertAlmostEqual(ans.reserve('a.com', 0.5), 0.5, delta=0.01)
+        # The request waiting on a.com doesn't take the next global slot.
+        self.assertAlmostEqual(ans.reserve('b.com'), 0.1, delta=0.01)
+        self.assertAlmostEqual(ans.reserve('c.com'), 0.2, delta=0.01)
+
+    def test_concurrent_delay_is_deprecated(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            ConcurrentDelay(0.1)
+        self.assertTrue(issubclass(caught[0].category, DeprecationWarning))
+
+    def test_bandwidth(self):
+        ans = RateLimiter(bandwidth=1000)
+        self.assertEqual(ans.reserve_bytes(1000), 0)
+        self.assertAlmostEqual(ans.reserve_bytes(500), 0.5, delta=0.01)
+        self.assertEqual(RateLimiter().reserve_bytes(10 ** 9), 0)
+
+    def test_session_throttles_body(self):
+        session = Session()
+        session.limiter = RateLimiter(bandwidth=2000)
+        request = requests.Request('GET', 'http://localhost:5000/').prepare()
+        response = session.throttle_response(
+            make_response(request, 200, {}, b'x' * 3000))
+        start = time.time()
+        self.assertEqual(len(response.content), 3000)
+        self.assertAlmostEqual(time.time() - start, 0.5, delta=0.1)
+
+    def test_session_crawl_delay(self):
+        session = Session()
+        session.delay = 0.5
+        self.assertEqual(session.reserve('http://localhost:5000/a'), 0)
+        self.assertAlmostEqual(session.reserve('http://localhost:5000/b'), 0.5, delta=0.01)
+        self.assertEqual(session.reserve('http://127.0.0.1:5000/a'), 0)
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_membership(self):
+        ans = BloomFilter(1000, 0.01)
+        self.assertTrue(ans.add('http://localhost:5000/a'))
+        self.assertFalse(ans.add('http://localhost:5000/a'))
+        self.assertIn('http://localhost:5000/a', ans)
+        self.assertIn(b'http://localhost:5000/a', ans)
+        self.assertNotIn('http://localhost:5000/b', ans)
+        self.assertEqual(len(ans), 1)
+
+    def test_error_rate(self):
+        ans = BloomFilter(10000, 0.01)
+        for i in range(10000):
+            ans.add('http://localhost:5000/%d' % i)
+        for i in range(10000):
+            self.assertIn('http://localhost:5000/%d' % i, ans)
+        found = sum('http://127.0.0.1:5000/%d' % i in ans for i in range(10000))
+        self.assertLess(found, 200)
+        self.assertLess(ans.nbytes, 10000 * 2)
+
+    def test_scalable(self):
+        ans = ScalableBloomFilter(100, 0.01)
+        added = sum(ans.add('http://localhost:5000/%d' % i) for i in range(1000))
+        self.assertGreater(added, 980)
+        self.assertGreater(len(ans.filters), 1)
+        self.assertEqual(len(ans), added)
+        for i in range(1000):
+            self.assertIn('http://localhost:5000/%d' % i, ans)
+        found = sum('http://127.0.0.1:5000/%d' % i in ans for i in range(1000))
+        self.assertLess(found, 30)
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        ans = LRUCache(maxsize=2)
+        ans.set('a', 1)
+        ans.set('b', 2)
+        self.assertEqual(ans.get('a'), 1)
+        ans.set('c', 3)
+        self.assertIsNone(ans.get('b'))
+        self.assertEqual(ans.get('a'), 1)
+        self.assertEqual(ans.info(), (2, 1, 1, 2, 2))
+
+    def test_timeout(self):
+        ans = LRUCache(timeout=0.05)
+        ans.set('a', 1)
+        self.assertEqual(ans.get('a'), 1)
+        time.sleep(0.06)
+        self.assertIsNone(ans.get('a'))
+        self.assertEqual(ans.info().evictions, 1)
+
+    def test_decorator(self):
+        calls = []
+
+        @lru_cache(maxsize=2)
+        def double(x, factor=2):
+            """Doubles."""
+            calls.append(x)
+            return x * factor
+
+        self.assertEqual(double(1), 2)
+        self.assertEqual(double(1), 2)
+        self.assertEqual(double(1.0), 2.0)
+        self.assertEqual(double(1, factor=3), 3)
+        self.assertEqual(double([1]), [1, 1])
+        self.assertEqual(calls, [1, 1.0, 1, [1]])
+        self.assertEqual(double.__doc__, "Doubles.")
+        self.assertEqual(double.cache_info(), (1, 3, 1, 2, 2))
+        double.cache_clear()
+        self.assertEqual(double.cache_info().currsize, 0)
+        double(2)
+        double.__call__.cache_clear(double)
+        self.assertEqual(double.__call__.cache_info(double).currsize, 0)
+
+    def test_method_caches(self):
+        class Doubler(object):
+            def __init__(self):
+                self.calls = 0
+
+            @lru_cache()
+            def double(self, x):
+                self.calls += 1
+                return x * 2
+
+        first, second = Doubler(), Doubler()
+        self.assertEqual(first.double(2), 4)
+        self.assertEqual(first.double(2), 4)
+        self.assertEqual(second.double(2), 4)
+        self.assertEqual((first.calls, second.calls), (1, 1))
+        self.assertEqual(first.double.cache_info().hits, 1)
+        first.double.cache_clear()
+        self.assertEqual(first.double.cache_info().currsize, 0)
+        self.assertEqual(second.double.cache_info().currsize, 1)
+
+    def test_concurrent_access(self):
+        ans = LRUCache(maxsize=50)
+        errors = []
+
+        def run(n):
+            try:
+                for i in range(2000):
+                    key = (n * i) % 80
+                    if ans.get(key) is None:
+                        ans.set(key, key)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(1, 9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(ans), 50)
+        info = ans.info()
+        self.assertEqual(info.hits + info.misses, 8 * 2000)
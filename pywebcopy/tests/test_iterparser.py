@@ -9,7 +9,9 @@ from six import StringIO
 from six import next
 from six.moves.collections_abc import Iterator
 
+from pywebcopy.parsers import extract_links
 from pywebcopy.parsers import iterparse
+from pywebcopy.parsers import rewrite_links
 from pywebcopy.parsers import links
 import pywebcopy.parsers
 
@@ -661,3 +663,26 @@ class TestFullLatin1EncodedHTMLParsing(unittest.TestCase):
 
 if __name__ == '__main__':
     unittest.main()
+
+
+class TestLinksOffload(unittest.TestCase):
+    source = (b'<html><body><img src="a.png" srcset="b.png 1x, c.png 2x">'
+              b'<a href="/page">page</a></body></html>')
+
+    def test_extract_links(self):
+        self.assertEqual(
+            sorted(extract_links(self.source, 'utf-8')),
+            [('a', '/page'), ('img', 'a.png'), ('img', 'b.png'), ('img', 'c.png')])
+
+    def test_rewrite_links(self):
+        links = extract_links(self.source, 'utf-8')
+        urls = [None if url == '/page' else 'files/' + url for _, url in links]
+        ans = rewrite_links(self.source, 'utf-8', urls, comment='mark')
+        self.assertIn(b'<!--mark-->', ans)
+        self.assertIn(b'src="files/a.png"', ans)
+        self.assertIn(b'srcset="files/b.png 1x, files/c.png 2x"', ans)
+        self.assertIn(b'href="/page"', ans)
+
+    def test_rewrite_without_links(self):
+        ans = rewrite_links(b'<html><body><p>text</p></body></html>', 'utf-8', [])
+        self.assertIn(b'<p>text</p>', ans)
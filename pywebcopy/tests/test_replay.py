@@ -0,0 +1,187 @@
+# Copyright 2019; Raja Tomar
+import os
+import time
+import unittest
+
+import requests
+from six.moves import BaseHTTPServer
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from pywebcopy.configs import get_config
+from pywebcopy.replay import Archive
+from pywebcopy.replay import ArchiveMiss
+from pywebcopy.session import Session
+from pywebcopy.session import UrlDisallowed
+from pywebcopy.tests.server import ServerTestCase
+
+
+class RecordedHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    #: Number of the served requests.
+    served = 0
+
+    def do_GET(self):
+        RecordedHandler.served += 1
+        if self.path == '/old':
+            self.send_response(301)
+            self.send_header('Location', '/new')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = ('page %s #%d' % (self.path, RecordedHandler.served)).encode()
+        self.send_response(200 if self.path != '/missing' else 404)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Set-Cookie', 'visited=yes; Path=/')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestRecordReplay(ServerTestCase):
+    handler = RecordedHandler
+    url_path = ''
+
+    def setUp(self):
+        RecordedHandler.served = 0
+        super(TestRecordReplay, self).setUp()
+        self.path = os.path.join(self.out, 'run.sqlite')
+
+    def create_session(self):
+        ans = Session()
+        ans.follow_robots_txt = False
+        return ans
+
+    def record(self):
+        session = self.create_session()
+        session.enable_recording(self.path)
+        ans = [session.get(self.url + p) for p in ('/old', '/page', '/page', '/missing')]
+        session.archive.close()
+        return ans
+
+    def test_replay_without_the_server(self):
+        recorded = self.record()
+        self.stop_server()
+
+        session = self.create_session()
+        session.enable_replay(self.path)
+        self.assertEqual(len(session.archive), 5)
+        replayed = [session.get(self.url + p) for p in ('/old', '/page', '/page', '/missing')]
+        for a, b in zip(recorded, replayed):
+            self.assertEqual(a.status_code, b.status_code)
+            self.assertEqual(a.url, b.url)
+            self.assertEqual(a.content, b.content)
+            self.assertEqual(a.headers['Content-Type'], b.headers['Content-Type'])
+            self.assertEqual([r.status_code for r in a.history],
+                             [r.status_code for r in b.history])
+        # Repeated requests are answered in the recorded order.
+        self.assertNotEqual(replayed[1].content, replayed[2].content)
+        self.assertEqual(replayed[0].history[0].status_code, 301)
+        self.assertEqual(session.cookies.get('visited'), 'yes')
+
+        with self.assertRaises(ArchiveMiss):
+            session.get(self.url + '/other')
+        # Misses look like network failures to the callers.
+        with self.assertRaises(requests.ConnectionError):
+            session.get(self.url + '/other')
+        session.archive.close()
+
+    def test_recorded_errors_and_latency(self):
+        session = self.create_session()
+        session.enable_recording(self.path)
+        self.stop_server()
+        with self.assertRaises(requests.ConnectionError):
+            session.get(self.url + '/page', timeout=1)
+        session.archive.close()
+
+        session = self.create_session()
+        session.enable_replay(self.path, latency=0.2)
+        start = time.time()
+        with self.assertRaises(requests.ConnectionError):
+            session.get(self.url + '/page')
+        self.assertGreaterEqual(time.time() - start, 0.2)
+        session.archive.close()
+
+    def test_recording_starts_empty(self):
+        self.record()
+        archive = Archive(self.path)
+        self.assertEqual(len(archive), 0)
+        archive.close()
+
+
+class SiteHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    pages = {
+        '/': b'<html><body><a href="page.html">page</a><a href="private.html">no</a>'
+             b'<img src="img.gif"></body></html>',
+        '/page.html': b'<html><body>page</body></html>',
+        '/private.html': b'<html><body>private</body></html>',
+        '/img.gif': b'GIF89a',
+        '/robots.txt': b'User-agent: *\nDisallow: /private.html\n',
+    }
+
+    def do_GET(self):
+        body = self.pages[self.path]
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/gif' if self.path.endswith('.gif') else
+                         'text/plain' if self.path.endswith('.txt') else 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestReplayCrawl(ServerTestCase):
+    handler = SiteHandler
+
+    def setUp(self):
+        super(TestReplayCrawl, self).setUp()
+        self.path = os.path.join(self.out, 'run.sqlite')
+
+    def crawl(self, name, **kwargs):
+        config = get_config(
+            self.url, project_folder=os.path.join(self.out, name), project_name='site',
+            **kwargs)
+        config['record' if name == 'recorded' else 'replay'] = self.path
+        crawler = config.create_crawler()
+        crawler.get(self.url)
+        crawler.save_complete()
+        if hasattr(crawler.scheduler, 'close'):
+            crawler.scheduler.close()
+        crawler.session.archive.close()
+        folder = os.path.join(config.get('project_folder'), '127.0.0.1')
+        return sorted(os.listdir(folder))
+
+    def replay(self, scheduler):
+        expected = self.crawl('recorded')
+        self.stop_server()
+        self.assertEqual(expected, ['img.gif', 'index.html', 'page.html'])
+        self.assertEqual(self.crawl(scheduler, scheduler=scheduler), expected)
+
+    def test_sync_replay(self):
+        self.replay('sync')
+
+    def test_recorded_robots_rules(self):
+        session = Session()
+        session.follow_robots_txt = False
+        session.enable_recording(self.path)
+        for path in ('robots.txt', 'private.html'):
+            session.get(self.url + path)
+        session.archive.close()
+
+        # The recorded robots.txt rules are obeyed by the replay.
+        session = Session()
+        session.enable_replay(self.path)
+        with self.assertRaises(UrlDisallowed):
+            session.get(self.url + 'private.html')
+        session.archive.close()
+
+    @unittest.skipIf(aiohttp is None, "aiohttp is not installed.")
+    def test_asyncio_replay(self):
+        self.replay('asyncio')
@@ -1,15 +1,75 @@
 # Copyright 2019; Raja Tomar
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
+from collections import Counter
+from collections import namedtuple
 
+import requests
+from requests import ConnectionError
 from requests import Response
+from six import PY3
+from six.moves import queue
+from six.moves.urllib.robotparser import RobotFileParser
 
+from pywebcopy.schedulers import AdaptiveConcurrency
+from pywebcopy.schedulers import BloomIndex
+from pywebcopy.schedulers import CompactIndex
+from pywebcopy.schedulers import HostQueue
 from pywebcopy.schedulers import Index
 from pywebcopy.schedulers import Scheduler
+from pywebcopy.schedulers import SharedIndex
+from pywebcopy.schedulers import SqliteIndex
+from pywebcopy.schedulers import ThreadingScheduler
+from pywebcopy.schedulers import ValidatorStore
+from pywebcopy.schedulers import WorkerPoolScheduler
+from pywebcopy.schedulers import create_process_pool
+from pywebcopy.schedulers import scheduler_from_config
+from pywebcopy.schedulers import threading_default_scheduler
 from pywebcopy.configs import get_config
+from pywebcopy.elements import AbsoluteUrlResource
+from pywebcopy.elements import GenericResource
+from pywebcopy.elements import HTMLResource
 from pywebcopy.elements import VoidResource
+from pywebcopy.helpers import RecentOrderedDict
+from pywebcopy.session import make_response
+from pywebcopy.tests.server import QuietHandler
+from pywebcopy.tests.server import ServerTestCase
+from pywebcopy.urls import Canonicalizer
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class DummyResource(GenericResource):
+    """Resource which records the threads it was fetched in
+    without doing any networking."""
+    def __init__(self, *args, **kwargs):
+        self.children = kwargs.pop('children', ())
+        self.seen = kwargs.pop('seen')
+        super(DummyResource, self).__init__(*args, **kwargs)
+
+    def get(self, url, **params):
+        time.sleep(0.002)
+        self.seen.append((url, threading.current_thread().name))
+
+    def retrieve(self):
+        for url in self.children:
+            self.scheduler.handle_resource(self.__class__(
+                self.session, self.config, self.scheduler,
+                self.context.create_new_from_url(url), seen=self.seen))
 
 
 class TestIndex(unittest.TestCase):
+    index_class = Index
+
     def setUp(self):
         self.config = get_config('http://localhost:5000', debug=False)
         self.context = self.config.create_context()
@@ -24,31 +84,31 @@ class TestIndex(unittest.TestCase):
         del self.config, self.context, self.session, self.scheduler, self.resource, self.response
 
     def test_add_entry(self):
-        ans = Index()
+        ans = self.index_class()
         ans.add_entry('http://localhost:5000', 'http_localhost_5000//index.html')
         self.assertEqual(ans.get('http://localhost:5000'), 'http_localhost_5000//index.html')
 
     def test_get_entry(self):
-        ans = Index()
+        ans = self.index_class()
         ans.add_entry('http://localhost:5000', 'http_localhost_5000//index.html')
         self.assertEqual(ans.get_entry('http://localhost:5000'), 'http_localhost_5000//index.html')
         ans.pop('http://localhost:5000')
         self.assertEqual(ans.get_entry('http://localhost:5000', None), None)
 
     def test_add_resource_without_response(self):
-        ans = Index()
+        ans = self.index_class()
         ans.add_resource(self.resource)
         self.assertEqual(ans.get(self.resource.url), self.context.resolve())
 
     def test_add_resource_with_response(self):
-        ans = Index()
+        ans = self.index_class()
         self.resource.response = self.response
         ans.add_resource(self.resource)
         self.assertEqual(ans.get(self.resource.url), self.context.resolve())
         self.assertEqual(ans.get(self.response.url), self.context.resolve())
 
     def test_add_resource_with_redirects(self):
-        ans = Index()
+        ans = self.index_class()
         rdr1 = Response()
         rdr1.url = 'http://localhost:5000/redirect1'
         rdr2 = Response()
@@ -61,3 +121,956 @@ class TestIndex(unittest.TestCase):
         self.assertEqual(ans.get(self.response.url), self.context.resolve())
         self.assertEqual(ans.get(rdr1.url), self.context.resolve())
         self.assertEqual(ans.get(rdr2.url), self.context.resolve())
+
+    def test_claim(self):
+        ans = self.index_class()
+        self.assertIsNone(ans.claim('http://localhost:5000', 'localhost/index.html'))
+        self.assertEqual(ans.claim('http://localhost:5000', 'other.html'), 'localhost/index.html')
+        self.assertIn('http://localhost:5000', ans.inflight)
+
+    def test_wait_entry(self):
+        ans = self.index_class()
+        ans.claim('http://localhost:5000', 'localhost/index.html')
+        result = []
+        waiter = threading.Thread(
+            target=lambda: result.append(ans.wait_entry('http://localhost:5000', 5)))
+        waiter.start()
+        time.sleep(0.01)
+        self.assertEqual(result, [])
+        ans.release('http://localhost:5000')
+        waiter.join(5)
+        self.assertEqual(result, ['localhost/index.html'])
+        self.assertNotIn('http://localhost:5000', ans.inflight)
+
+
+class TestCompactIndex(TestIndex):
+    index_class = CompactIndex
+
+    def test_relative_paths(self):
+        ans = CompactIndex(os.path.join(os.sep, 'project'))
+        path = os.path.join(os.sep, 'project', 'localhost', 'a', 'index.html')
+        ans.add_entry('http://localhost:5000/a/', path)
+        ans.add_entry('http://localhost:5000/a/?b=/c', os.path.join(os.sep, 'elsewhere'))
+        self.assertEqual(ans.get('http://localhost:5000/a/'), path)
+        self.assertEqual(ans.get('http://localhost:5000/a/?b=/c'), os.path.join(os.sep, 'elsewhere'))
+        self.assertIsNone(ans.get('http://127.0.0.1:5000/a/'))
+        self.assertEqual(len(ans), 2)
+        del ans['http://localhost:5000/a/']
+        self.assertEqual(ans.keys(), ['http://localhost:5000/a/?b=/c'])
+
+    @unittest.skipUnless(PY3, "tracemalloc requires python 3.")
+    def test_memory(self):
+        import tracemalloc
+        entries = 10000
+
+        def size(ans):
+            tracemalloc.start()
+            try:
+                ans = ans()
+                for i in range(entries):
+                    page = i // 3
+                    url = 'https://www.example.com/blog/%02d/post-%d' % (page % 12, page)
+                    ans[url + ('?page=%d' % (i % 3) if i % 3 else '')] = os.path.join(
+                        os.sep, 'project', 'www.example.com', 'blog', '%02d' % (page % 12),
+                        'post-%d.html' % page)
+                return tracemalloc.get_traced_memory()[0] / float(entries)
+            finally:
+                tracemalloc.stop()
+
+        compact = size(lambda: CompactIndex(os.path.join(os.sep, 'project')))
+        recent = size(RecentOrderedDict)
+        self.assertLess(compact * 3, recent)
+
+
+class TestBloomIndex(unittest.TestCase):
+    def test_claim(self):
+        ans = BloomIndex(cache_size=2)
+        for url in ('http://a/', 'http://b/', 'http://c/'):
+            self.assertIsNone(ans.claim(url, url + 'index.html'))
+        self.assertEqual(len(ans), 2)
+        self.assertEqual(ans.claim('http://c/', 'other.html'), 'http://c/index.html')
+        # Entry is gone but the url is still known to be seen.
+        self.assertEqual(ans.claim('http://a/', 'other.html'), 'other.html')
+
+    def test_config(self):
+        config = get_config('http://localhost:5000/')
+        config['index_type'] = 'bloom'
+        self.assertIsInstance(config.create_index(), BloomIndex)
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.config = get_config('http://localhost:5000/', debug=False)
+        self.context = self.config.create_context()
+        self.session = self.config.create_session()
+        self.seen = []
+
+    def test_concurrent_references_fetch_once(self):
+        scheduler = threading_default_scheduler()
+        start = threading.Event()
+
+        def reference():
+            start.wait()
+            scheduler.handle_resource(DummyResource(
+                self.session, self.config, scheduler,
+                self.context.create_new_from_url('style.css'), seen=self.seen))
+
+        threads = [threading.Thread(target=reference) for _ in range(20)]
+        for t in threads:
+            t.start()
+        start.set()
+        for t in threads:
+            t.join()
+        scheduler.join()
+        self.assertEqual(len(self.seen), 1)
+        self.assertEqual(scheduler.stats['scheduled'], 1)
+        self.assertEqual(scheduler.stats['duplicates'], 19)
+        self.assertEqual(scheduler.index.inflight, {})
+
+
+class TypedResource(GenericResource):
+    """Resource which responds with the content-type from the `types` map."""
+    types = {}
+    events = []
+
+    def get(self, url, **params):
+        self.events.append(url)
+        time.sleep(0.05)
+        request = requests.Request('GET', url).prepare()
+        self.set_response(make_response(
+            request, 200, {'Content-Type': self.types[url]}, b'data'))
+
+
+class TypedPage(TypedResource, HTMLResource):
+    """Page which responds with the content-type from the `types` map."""
+
+
+class RecordingPage(HTMLResource):
+    #: Process pools the pages were parsed in.
+    pools = []
+
+    def get(self, url, **params):
+        pass
+
+    def retrieve(self):
+        self.pools.append(self.scheduler.process_pool)
+        ans = super(RecordingPage, self).retrieve()
+        TypedResource.events.append('page')
+        return ans
+
+
+class TestCanonicalUrls(unittest.TestCase):
+    def setUp(self):
+        self.config = get_config('http://localhost:5000/', debug=False)
+        self.context = self.config.create_context()
+        self.session = self.config.create_session()
+        self.seen = []
+
+    def test_equivalent_urls_fetch_once(self):
+        ans = Scheduler()
+        ans.canonicalizer = Canonicalizer()
+        for url in ('/a/../b.png?utm_source=x', 'HTTP://LOCALHOST:5000/b.png#top',
+                    '/b.png', '/b.png?utm_source=x', '/c.png'):
+            ans.handle_resource(DummyResource(
+                self.session, self.config, ans,
+                self.context.create_new_from_url(url), seen=self.seen))
+        self.assertEqual(
+            [url for url, thread in self.seen],
+            ['http://localhost:5000/b.png?utm_source=x', 'http://localhost:5000/c.png'])
+        self.assertEqual(ans.stats['duplicates'], 3)
+        self.assertEqual(ans.stats['canonical_duplicates'], 2)
+
+    def test_config(self):
+        config = get_config('http://localhost:5000/')
+        self.assertIsNone(scheduler_from_config(config).canonicalizer)
+        config['canonicalize'] = True
+        self.assertIsNotNone(scheduler_from_config(config).canonicalizer)
+
+
+class TestTwoPhaseLinks(unittest.TestCase):
+    html = (b'<html><body><img src="a.png"><img src="data?id=1">'
+            b'<link rel="stylesheet" href="style.css"></body></html>')
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.config = get_config('http://localhost:5000/', project_folder=self.folder)
+        self.context = self.config.create_context()
+        self.session = self.config.create_session()
+        TypedResource.types = {
+            'http://localhost:5000/a.png': 'image/png',
+            'http://localhost:5000/data?id=1': 'image/png',
+            # Disagrees with the extension of the url.
+            'http://localhost:5000/style.css': 'text/plain',
+        }
+        TypedResource.events = []
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def save(self, scheduler, page_class=RecordingPage, default=TypedResource):
+        scheduler.set_default(default)
+        page = page_class(self.session, self.config, scheduler, self.context)
+        request = requests.Request('GET', self.context.url).prepare()
+        page.set_response(make_response(
+            request, 200, {'Content-Type': 'text/html'}, self.html))
+        scheduler.handle_resource(page)
+        scheduler.join()
+        with open(page.filepath, 'rb') as f:
+            return f.read()
+
+    def test_sync_page_is_written_before_pinned_files(self):
+        ans = self.save(Scheduler())
+        self.assertEqual(TypedResource.events, [
+            'http://localhost:5000/data?id=1', 'page',
+            'http://localhost:5000/a.png', 'http://localhost:5000/style.css'])
+        self.assertIn(b'data_id_1.png', ans)
+        self.assertIn(b'href="./style.css"', ans)
+
+    def test_canonical_variants_of_unknown_type(self):
+        TypedResource.types['http://localhost:5000/data?id=1&utm_source=x'] = 'image/png'
+        scheduler = Scheduler()
+        scheduler.canonicalizer = Canonicalizer()
+        scheduler.set_default(TypedResource)
+        self.html = b'<html><body><img src="data?id=1&utm_source=x"><img src="data?id=1#top">'
+        ans = self.save(scheduler)
+        self.assertEqual(TypedResource.events, [
+            'http://localhost:5000/data?id=1&utm_source=x', 'page'])
+        # Both of the variants link to the file which was written.
+        self.assertEqual(ans.count(b'src="./data_id_1_utm_source_x.png"'), 2)
+
+    def test_download_linked_as_page_is_moved(self):
+        TypedResource.types['http://localhost:5000/download'] = 'application/pdf'
+        scheduler = Scheduler()
+        scheduler.register_handler('a', TypedPage)
+        self.html = b'<html><body><a href="download">pdf</a></body></html>'
+        ans = self.save(scheduler)
+        self.assertIn(b'href="./download.html"', ans)
+        root = os.path.dirname(self.context.resolve())
+        with open(os.path.join(root, 'download.pdf'), 'rb') as f:
+            self.assertEqual(f.read(), b'data')
+        # The path used by the page redirects to the moved file.
+        with open(os.path.join(root, 'download.html'), 'rb') as f:
+            self.assertIn(b'url=./download.pdf', f.read())
+        self.assertEqual(
+            scheduler.index.get_entry('http://localhost:5000/download'),
+            os.path.join(root, 'download.pdf'))
+
+    def assert_final_paths(self, scheduler):
+        ans = self.save(scheduler)
+        self.assertIn(b'src="./a.png"', ans)
+        # Waited for the content-type of the server.
+        self.assertIn(b'src="./data_id_1.png"', ans)
+        # Pinned path is kept though the server disagrees.
+        self.assertIn(b'href="./style.css"', ans)
+        root = os.path.dirname(self.context.resolve())
+        self.assertTrue(os.path.exists(os.path.join(root, 'style.css')))
+        self.assertTrue(os.path.exists(os.path.join(root, 'data_id_1.png')))
+
+    def test_threading_waits_for_unknown_paths(self):
+        self.assert_final_paths(ThreadingScheduler())
+
+    @unittest.skipUnless(PY3, "Process pool requires python 3.")
+    def test_process_pool(self):
+        ans = ThreadingScheduler()
+        ans.process_pool = create_process_pool(2)
+        try:
+            self.assert_final_paths(ans)
+        finally:
+            ans.process_pool.shutdown()
+
+    @unittest.skipUnless(PY3, "Process pool requires python 3.")
+    def test_process_pool_is_shut_down(self):
+        ans = ThreadingScheduler()
+        ans.parse_processes = 2
+        RecordingPage.pools = []
+        self.assert_final_paths(ans)
+        self.assertIsNotNone(RecordingPage.pools[0])
+        self.assertIsNone(ans.process_pool)
+        self.assertEqual(multiprocessing.active_children(), [])
+
+    def test_wait_is_bounded_per_page(self):
+        finished = []
+
+        class TimedPage(RecordingPage):
+            def retrieve(self):
+                ans = super(TimedPage, self).retrieve()
+                finished.append(time.time())
+                return ans
+
+        class SlowResource(TypedResource):
+            def get(self, url, **params):
+                time.sleep(1)
+                super(SlowResource, self).get(url, **params)
+
+        for i in range(3):
+            TypedResource.types['http://localhost:5000/slow?%d' % i] = 'image/png'
+        self.html = ''.join('<img src="slow?%d">' % i for i in range(3)).encode()
+        ans = ThreadingScheduler()
+        ans.wait_timeout = 0.3
+        start = time.time()
+        self.save(ans, TimedPage, SlowResource)
+        # The children share the timeout instead of waiting one after another.
+        self.assertLess(finished[0] - start, 0.6)
+
+    def test_worker_pool_waits_for_unknown_paths(self):
+        # Single worker has to process the queued file itself.
+        ans = WorkerPoolScheduler(workers=1)
+        self.assert_final_paths(ans)
+        ans.close()
+
+
+class TestSqliteIndex(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'index.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_add_and_get_entry(self):
+        ans = SqliteIndex(self.path, cache_size=2, batch_size=3)
+        for i in range(10):
+            ans.add_entry('http://localhost:5000/%d' % i, 'localhost/%d.html' % i)
+        self.assertLessEqual(len(ans._data), 2)
+        for i in range(10):
+            self.assertEqual(ans.get_entry('http://localhost:5000/%d' % i), 'localhost/%d.html' % i)
+        self.assertEqual(ans.get_entry('http://localhost:5000/missing'), None)
+        self.assertEqual(len(ans), 10)
+        ans.close()
+
+    def test_survives_restart(self):
+        ans = SqliteIndex(self.path)
+        ans.add_entry('http://localhost:5000', 'localhost/index.html')
+        ans.close()
+        ans = SqliteIndex(self.path)
+        self.assertEqual(ans.get_entry('http://localhost:5000'), 'localhost/index.html')
+        self.assertIn('http://localhost:5000', ans)
+        ans.pop('http://localhost:5000')
+        self.assertNotIn('http://localhost:5000', ans)
+        ans.close()
+
+    def test_periodic_checkpoint(self):
+        ans = SqliteIndex(self.path, checkpoint_interval=0.1)
+        ans.add_entry('http://localhost:5000', 'localhost/index.html')
+        time.sleep(0.5)
+        # Another connection sees the entry as if this process got killed.
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(conn.execute('SELECT path FROM entries').fetchall(),
+                         [('localhost/index.html',)])
+        conn.close()
+        ans.close()
+
+    def test_config(self):
+        config = get_config('http://localhost:5000', project_folder=self.folder)
+        config['index_type'] = 'sqlite'
+        ans = config.create_index()
+        self.assertIsInstance(ans, SqliteIndex)
+        self.assertTrue(ans.path.startswith(config.get('project_folder')))
+        ans.add_entry('http://localhost:5000', 'localhost/index.html')
+        ans.close()
+
+        # The next run of the project starts over unless it is resumed.
+        config['resume'] = True
+        ans = config.create_index()
+        self.assertEqual(ans.get_entry('http://localhost:5000'), 'localhost/index.html')
+        ans.close()
+        config['resume'] = False
+        ans = config.create_index()
+        self.assertEqual(len(ans), 0)
+        ans.close()
+
+
+class DummyPage(HTMLResource):
+    """Page which links to the pages in the `links` map
+    without doing any networking."""
+    def __init__(self, *args, **kwargs):
+        self.links = kwargs.pop('links')
+        self.seen = kwargs.pop('seen')
+        super(DummyPage, self).__init__(*args, **kwargs)
+
+    def get(self, url, **params):
+        self.seen.append(self.context.url)
+
+    def retrieve(self):
+        for url in self.links(self.context.url):
+            self.scheduler.handle_resource(self.__class__(
+                self.session, self.config, self.scheduler,
+                self.context.create_new_from_url(url),
+                links=self.links, seen=self.seen))
+
+
+class TestCrawlFrontier(unittest.TestCase):
+    def setUp(self):
+        self.config = get_config('http://localhost:5000/', debug=False)
+        self.context = self.config.create_context()
+        self.session = self.config.create_session()
+        self.seen = []
+
+    def crawl(self, scheduler, links):
+        scheduler.handle_resource(DummyPage(
+            self.session, self.config, scheduler, self.context,
+            links=links, seen=self.seen))
+
+    def test_deep_site_does_not_recurse(self):
+        depth = 3000
+
+        def links(url):
+            n = int(url.rsplit('/', 1)[-1] or 0)
+            return ['/%d' % (n + 1)] if n < depth else []
+
+        self.crawl(Scheduler(), links)
+        self.assertEqual(len(self.seen), depth + 1)
+
+    def test_breadth_first_order(self):
+        site = {'/': ['/a', '/b'], '/a': ['/c'], '/b': ['/d'], '/c': [], '/d': []}
+        ans = Scheduler()
+        self.crawl(ans, lambda url: site[url[len('http://localhost:5000'):]])
+        self.assertEqual(
+            self.seen, ['http://localhost:5000' + p for p in ('/', '/a', '/b', '/c', '/d')])
+        self.assertFalse(ans.frontier)
+        self.assertFalse(ans.crawling)
+
+    def test_max_depth(self):
+        ans = Scheduler()
+        ans.register_handler('a', HTMLResource)
+        ans.max_depth = 1
+        context = self.context.create_new_from_url('/a')
+        self.assertIsInstance(
+            ans.get_handler('a', self.session, self.config, ans, context), HTMLResource)
+        self.assertIsInstance(
+            ans.get_handler('a', self.session, self.config, ans, context.create_new_from_url('/b')),
+            AbsoluteUrlResource)
+
+    def test_threaded_crawl(self):
+        site = {'/': ['/a', '/b'], '/a': ['/c'], '/b': ['/c'], '/c': []}
+        ans = WorkerPoolScheduler(workers=2)
+        self.crawl(ans, lambda url: site[url[len('http://localhost:5000'):]])
+        self.assertEqual(len(self.seen), 4)
+        self.assertEqual(self.seen[-1], 'http://localhost:5000/c')
+        ans.close()
+
+
+class Interrupted(Exception):
+    pass
+
+
+class ResumablePage(DummyPage):
+    """Page which can be rebuilt from its handler name and
+    fails on the url stored in `fail_at` to simulate a crash."""
+    site = {}
+    seen = []
+    fail_at = None
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('links', lambda u: ResumablePage.site.get(u, []))
+        kwargs.setdefault('seen', ResumablePage.seen)
+        super(ResumablePage, self).__init__(*args, **kwargs)
+
+    def retrieve(self):
+        if self.context.url == ResumablePage.fail_at:
+            raise Interrupted(self.context.url)
+        super(ResumablePage, self).retrieve()
+
+
+class TestResumeCrawl(unittest.TestCase):
+    def setUp(self):
+        self.config = get_config('http://localhost:5000/', debug=False)
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'index.sqlite')
+        root = 'http://localhost:5000/'
+        ResumablePage.site = {
+            root: [root + 'a', root + 'b'],
+            root + 'a': [root + 'c'],
+            root + 'b': [root + 'd'],
+        }
+        ResumablePage.seen = []
+        ResumablePage.fail_at = root + 'a'
+
+    def tearDown(self):
+        ResumablePage.fail_at = None
+        shutil.rmtree(self.folder)
+
+    def run_crawl(self, resume=False):
+        scheduler = Scheduler(default=ResumablePage)
+        scheduler.index = SqliteIndex(self.path)
+        scheduler.resume = resume
+        scheduler.handle_resource(ResumablePage(
+            self.config.create_session(), self.config, scheduler,
+            self.config.create_context()))
+        scheduler.index.close()
+
+    def test_resume_skips_finished_resources(self):
+        root = 'http://localhost:5000/'
+        self.assertRaises(Interrupted, self.run_crawl)
+        self.assertEqual(ResumablePage.seen, [root, root + 'a'])
+
+        ans = SqliteIndex(self.path)
+        self.assertTrue(ans.is_done(root))
+        self.assertFalse(ans.is_done(root + 'a'))
+        ans.close()
+
+        ResumablePage.seen = []
+        ResumablePage.fail_at = None
+        self.run_crawl(resume=True)
+        self.assertEqual(ResumablePage.seen, [root + 'a', root + 'b', root + 'c', root + 'd'])
+
+        ans = SqliteIndex(self.path)
+        self.assertEqual(ans.restore(), [])
+        ans.close()
+
+    def test_restored_depth(self):
+        self.assertRaises(Interrupted, self.run_crawl)
+        ans = SqliteIndex(self.path)
+        self.assertEqual(
+            sorted(ans.restore()),
+            [('http://localhost:5000/a', 'ResumablePage', 1),
+             ('http://localhost:5000/b', 'ResumablePage', 1)])
+        self.assertNotIn('http://localhost:5000/a', ans)
+        ans.close()
+
+    def test_config(self):
+        config = get_config('http://localhost:5000/', project_folder=self.folder, resume=True)
+        ans = config.create_index()
+        self.assertIsInstance(ans, SqliteIndex)
+        ans.close()
+
+
+class TestShardedCrawl(unittest.TestCase):
+    def setUp(self):
+        self.config = get_config('http://localhost:5000/', debug=False)
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'index.sqlite')
+        root = 'http://localhost:5000/'
+        ResumablePage.site = {
+            root: [root + 'a', root + 'b', root + 'c'],
+            root + 'a': [root + 'b', root + 'd'],
+            root + 'b': [root + 'e', root],
+            root + 'c': [root + 'f'],
+            root + 'd': [root + 'f'],
+        }
+        ResumablePage.seen = []
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_claim_is_shared(self):
+        first, second = SharedIndex(self.path), SharedIndex(self.path)
+        self.assertIsNone(first.claim('http://a/', 'a.html'))
+        self.assertEqual(second.claim('http://a/', 'b.html'), 'a.html')
+        first.close()
+        second.close()
+
+    def test_shards_crawl_every_page_once(self):
+        shards = 3
+        index = SharedIndex(self.path)
+        index.prepare(shards)
+        index.close()
+
+        def crawl(shard):
+            scheduler = Scheduler(default=ResumablePage)
+            scheduler.index = SharedIndex(self.path)
+            scheduler.shard, scheduler.shards = shard, shards
+            scheduler.poll_interval = 0.01
+            scheduler.handle_resource(ResumablePage(
+                self.config.create_session(), self.config, scheduler,
+                self.config.create_context()))
+            scheduler.index.close()
+
+        threads = [threading.Thread(target=crawl, args=(i,)) for i in range(shards)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(
+            sorted(ResumablePage.seen),
+            ['http://localhost:5000/' + p for p in ('', 'a', 'b', 'c', 'd', 'e', 'f')])
+
+    def test_config(self):
+        config = get_config('http://localhost:5000/', project_folder=self.folder, processes=2)
+        ans = config.create_index()
+        self.assertIsInstance(ans, SharedIndex)
+        ans.close()
+
+
+class TestWorkerPoolScheduler(unittest.TestCase):
+    def setUp(self):
+        self.config = get_config('http://localhost:5000', debug=False)
+        self.context = self.config.create_context()
+        self.session = self.config.create_session()
+        self.seen = []
+
+    def make(self, scheduler, url, **kwargs):
+        return DummyResource(
+            self.session, self.config, scheduler,
+            self.context.create_new_from_url(url), seen=self.seen, **kwargs)
+
+    def test_factory(self):
+        self.assertIsInstance(threading_default_scheduler(workers=2), WorkerPoolScheduler)
+        self.assertNotIsInstance(threading_default_scheduler(), WorkerPoolScheduler)
+
+    def test_thread_ceiling(self):
+        ans = WorkerPoolScheduler(workers=3, queue_size=2)
+        for i in range(60):
+            ans.handle_resource(self.make(ans, '/file%d' % i))
+        self.assertTrue(ans.join(timeout=10))
+        self.assertEqual(len(self.seen), 60)
+        self.assertLessEqual(len(set(name for _, name in self.seen)), 3)
+        ans.close()
+
+    def test_nested_resources_do_not_deadlock(self):
+        ans = WorkerPoolScheduler(workers=1, queue_size=1)
+        children = ['/child%d' % i for i in range(10)]
+        ans.handle_resource(self.make(ans, '/parent', children=children))
+        self.assertTrue(ans.join(timeout=10))
+        self.assertEqual(len(self.seen), 11)
+        ans.close()
+
+
+class QueueItem(object):
+    def __init__(self, url):
+        self.context = namedtuple('Context', 'url')(url)
+
+
+class TestHostQueue(unittest.TestCase):
+    def test_ready_hosts_are_served_meanwhile(self):
+        delays = {'a.com': 0.2, 'b.com': 0}
+        ans = HostQueue(delay=lambda r: delays[HostQueue.host_of(r)])
+        a1, a2 = QueueItem('http://a.com/1'), QueueItem('http://a.com/2')
+        b1, b2 = QueueItem('http://b.com/1'), QueueItem('http://b.com/2')
+        for item in (a1, a2, b1, b2):
+            ans.put(item)
+        start = time.time()
+        self.assertEqual([ans.get() for _ in range(3)], [a1, b1, b2])
+        self.assertLess(time.time() - start, 0.1)
+        self.assertRaises(queue.Empty, ans.get_nowait)
+        self.assertIs(ans.get(timeout=5), a2)
+        self.assertGreaterEqual(time.time() - start, 0.19)
+
+    def test_host_concurrency(self):
+        ans = HostQueue(concurrency=1)
+        a1, a2 = QueueItem('http://a.com/1'), QueueItem('http://a.com/2')
+        b1 = QueueItem('http://b.com/1')
+        for item in (a1, a2, b1):
+            ans.put(item)
+        self.assertIs(ans.get(), a1)
+        self.assertIs(ans.get(), b1)
+        self.assertRaises(queue.Empty, ans.get_nowait)
+        ans.release(a1)
+        self.assertIs(ans.get_nowait(), a2)
+        self.assertEqual(ans.qsize(), 0)
+
+    def test_acquire_waits_for_the_host(self):
+        ans = HostQueue(concurrency=1, delay=lambda r: 0.2)
+        a1, a2 = QueueItem('http://a.com/1'), QueueItem('http://a.com/2')
+        ans.put(a1)
+        self.assertIs(ans.get(), a1)
+        threading.Timer(0.1, ans.release, (a1,)).start()
+        start = time.time()
+        ans.acquire(a2)
+        # Waited for the slot and then for the delay of the host.
+        self.assertGreaterEqual(time.time() - start, 0.19)
+        self.assertEqual(ans.inflight['a.com'], 1)
+        ans.release(a2)
+        self.assertEqual(ans.inflight, {})
+
+    def test_sentinel_is_always_ready(self):
+        ans = HostQueue(concurrency=1)
+        ans.put(QueueItem('http://a.com/1'))
+        ans.put(QueueItem('http://a.com/2'))
+        ans.put(None)
+        ans.get()
+        self.assertIsNone(ans.get_nowait())
+
+
+class HostResource(DummyResource):
+    """Resource which records the max number of
+    concurrent fetches from its host."""
+    lock = threading.Lock()
+    active = Counter()
+    peak = Counter()
+
+    def get(self, url, **params):
+        host = HostQueue.host_of(self)
+        with self.lock:
+            self.active[host] += 1
+            self.peak[host] = max(self.peak[host], self.active[host])
+        super(HostResource, self).get(url, **params)
+        time.sleep(0.01)
+        with self.lock:
+            self.active[host] -= 1
+
+
+class TestPoliteness(unittest.TestCase):
+    def setUp(self):
+        self.config = get_config('http://localhost:5000', debug=False)
+        self.context = self.config.create_context()
+        self.session = self.config.create_session()
+        self.seen = []
+        HostResource.peak.clear()
+
+    def test_host_concurrency(self):
+        ans = threading_default_scheduler(workers=6, host_concurrency=1)
+        self.assertIsInstance(ans, WorkerPoolScheduler)
+        hosts = ['site.com'] + ['cdn%d.com' % i for i in range(5)]
+        for i in range(5):
+            for host in hosts:
+                ans.handle_resource(HostResource(
+                    self.session, self.config, ans,
+                    self.context.create_new_from_url('http://%s/file%d' % (host, i)),
+                    seen=self.seen))
+        self.assertTrue(ans.join(timeout=10))
+        self.assertEqual(len(self.seen), 30)
+        self.assertEqual(set(HostResource.peak.values()), {1})
+        # Other hosts kept the rest of the workers busy.
+        self.assertGreater(len(set(name for _, name in self.seen)), 1)
+        ans.close()
+
+    def test_in_place_resources_keep_host_concurrency(self):
+        ans = threading_default_scheduler(workers=4, queue_size=1, host_concurrency=1)
+        children = ['http://site.com/file%d' % i for i in range(10)]
+        for i in range(4):
+            ans.handle_resource(HostResource(
+                self.session, self.config, ans,
+                self.context.create_new_from_url('http://page%d.com/' % i),
+                seen=self.seen, children=children))
+        self.assertTrue(ans.join(timeout=10))
+        self.assertEqual(HostResource.peak['site.com'], 1)
+        self.assertEqual(ans.queue.inflight, {})
+        ans.close()
+
+    def test_session_crawl_delay(self):
+        self.session.delay = 2
+        self.assertEqual(self.session.get_crawl_delay('http://localhost:5000/'), 2)
+        rules = RobotFileParser()
+        rules.parse(['User-agent: *', 'Crawl-delay: 5'])
+        self.session.robots_registry['http://localhost:5000/robots.txt'] = rules
+        self.assertEqual(self.session.get_crawl_delay('http://localhost:5000/a'), 5)
+        self.session.follow_robots_txt = False
+        self.assertEqual(self.session.get_crawl_delay('http://localhost:5000/a'), 2)
+
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+    def test_additive_increase(self):
+        ans = AdaptiveConcurrency(initial=2, maximum=4)
+        self.assertEqual(ans.limit('a.com'), 2)
+        for _ in range(3):
+            self.assertFalse(ans.feedback('a.com', 0.1))
+        self.assertEqual(ans.limit('a.com'), 3)
+        for _ in range(20):
+            ans.feedback('a.com', 0.1)
+        self.assertEqual(ans.limit('a.com'), 4)
+        self.assertEqual(ans.limit('b.com'), 2)
+
+    def test_multiplicative_decrease(self):
+        ans = AdaptiveConcurrency(initial=8)
+        self.assertTrue(ans.feedback('a.com', 0.1, status=503))
+        self.assertEqual(ans.limit('a.com'), 4)
+        self.assertTrue(ans.feedback('a.com', 0.1, status=429))
+        self.assertEqual(ans.limit('a.com'), 2)
+        self.assertTrue(ans.feedback('a.com', 5, error=ConnectionError()))
+        self.assertEqual(ans.limit('a.com'), 1)
+        self.assertTrue(ans.feedback('a.com', 5, error=ConnectionError()))
+        self.assertEqual(ans.limit('a.com'), 1)
+
+    def test_latency_spike(self):
+        ans = AdaptiveConcurrency(initial=4, latency_factor=3)
+        ans.feedback('a.com', 0.1)
+        self.assertFalse(ans.feedback('a.com', 0.2))
+        self.assertTrue(ans.feedback('a.com', 1.0))
+
+    def test_host_queue_follows_limits(self):
+        adaptive = AdaptiveConcurrency(initial=1)
+        ans = HostQueue(adaptive=adaptive)
+        items = [QueueItem('http://a.com/%d' % i) for i in range(3)]
+        for item in items:
+            ans.put(item)
+        ans.get()
+        self.assertRaises(queue.Empty, ans.get_nowait)
+        adaptive.feedback('a.com', 0.1)
+        self.assertIs(ans.get_nowait(), items[1])
+
+
+class FailingResource(HostResource):
+    def get(self, url, **params):
+        super(FailingResource, self).get(url, **params)
+        raise ConnectionError(url)
+
+
+class TestAdaptiveScheduler(unittest.TestCase):
+    def setUp(self):
+        self.config = get_config('http://localhost:5000', debug=False)
+        self.context = self.config.create_context()
+        self.session = self.config.create_session()
+        self.seen = []
+        HostResource.peak.clear()
+
+    def make(self, scheduler, cls, url):
+        return cls(self.session, self.config, scheduler,
+                   self.context.create_new_from_url(url), seen=self.seen)
+
+    def test_failing_host_backs_off(self):
+        ans = threading_default_scheduler(workers=8, adaptive=True)
+        self.assertIsInstance(ans, WorkerPoolScheduler)
+        for i in range(10):
+            ans.handle_resource(self.make(ans, FailingResource, 'http://down.com/%d' % i))
+            ans.handle_resource(self.make(ans, HostResource, 'http://up.com/%d' % i))
+        self.assertTrue(ans.join(timeout=10))
+        self.assertEqual(len(self.seen), 20)
+        self.assertEqual(ans.adaptive.limit('down.com'), 1)
+        self.assertGreater(ans.adaptive.limit('up.com'), 2)
+        self.assertGreater(ans.stats['congestions'], 0)
+        ans.close()
+
+    def test_in_place_resources_are_admitted(self):
+        ans = WorkerPoolScheduler(workers=4, queue_size=1, host_concurrency=1, adaptive=True)
+        children = ['http://site.com/file%d' % i for i in range(10)]
+        for i in range(4):
+            ans.handle_resource(HostResource(
+                self.session, self.config, ans,
+                self.context.create_new_from_url('http://page%d.com/' % i),
+                seen=self.seen, children=children))
+        self.assertTrue(ans.join(timeout=10))
+        # Every fetch reporting to the limit held a slot under it.
+        self.assertEqual(HostResource.peak['site.com'], 1)
+        self.assertEqual(ans.adaptive.limit('site.com'), 1)
+        ans.close()
+
+    def test_retry_after(self):
+        ans = WorkerPoolScheduler(workers=1, adaptive=True)
+        resource = self.make(ans, HostResource, 'http://busy.com/')
+        resource.response = Response()
+        resource.response.status_code = 503
+        resource.response.headers['Retry-After'] = '30'
+        ans.feedback(resource, 0.1)
+        self.assertGreater(ans.queue.ready_at['busy.com'], time.time() + 25)
+
+
+class TestAsyncioScheduler(ServerTestCase):
+    files = {
+        'index.html': b'<html><head><link rel="stylesheet" href="style.css"></head>'
+                      b'<body><img src="img.gif"></body></html>',
+        'style.css': b'body {background: url("bg.gif");}',
+        'img.gif': b'GIF89a',
+        'bg.gif': b'GIF89a',
+    }
+    url_path = '/index.html'
+
+    @unittest.skipIf(aiohttp is None, "aiohttp is not installed.")
+    def test_save_page(self):
+        config = get_config(
+            self.url, project_folder=self.out, project_name='site',
+            bypass_robots=True, scheduler='asyncio')
+        page = config.create_page()
+        page.get(self.url)
+        threads = []
+        retrieve = page.retrieve
+
+        def record():
+            threads.append(threading.current_thread())
+            return retrieve()
+
+        page.retrieve = record
+        runner = page.scheduler.runner
+        page.save_complete()
+        page.scheduler.close()
+        folder = os.path.join(config.get('project_folder'), '127.0.0.1')
+        for name in self.files:
+            self.assertTrue(os.path.exists(os.path.join(folder, name)), name)
+        # The page was parsed off the event loop.
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], runner)
+
+    @unittest.skipIf(aiohttp is None, "aiohttp is not installed.")
+    def test_large_body_is_spooled(self):
+        from pywebcopy.aio import AsyncClient
+        from pywebcopy.aio import EventLoopThread
+        runner = EventLoopThread()
+        runner.start()
+        client = AsyncClient(spool_size=4)
+        self.addCleanup(runner.stop, 5)
+        self.addCleanup(lambda: runner.submit(client.close()).result(5))
+        session = get_config(self.url, bypass_robots=True).create_session()
+        response = runner.submit(
+            client.request(session, 'GET', self.url.replace('index.html', 'img.gif'))).result(5)
+        self.assertTrue(response.raw._fp._rolled)
+        self.assertEqual(response.content, b'GIF89a')
+
+
+class RecordingHandler(QuietHandler):
+    codes = []
+
+    def log_request(self, code='-', size='-'):
+        self.codes.append((self.path, int(code)))
+
+
+class TestConditionalRefetch(ServerTestCase):
+    handler = RecordingHandler
+    files = {
+        'index.html': b'<html><head><link rel="stylesheet" href="style.css"></head>'
+                      b'<body><img src="img.gif"><a href="page.html">page</a></body></html>',
+        'page.html': b'<html><body><img src="other.gif"></body></html>',
+        'style.css': b'body {background: url("bg.gif");}',
+        'img.gif': b'GIF89a',
+        'other.gif': b'GIF89a',
+        'bg.gif': b'GIF89a',
+    }
+
+    def setUp(self):
+        RecordingHandler.codes = []
+        super(TestConditionalRefetch, self).setUp()
+
+    def crawl(self):
+        RecordingHandler.codes = []
+        config = get_config(
+            self.url, project_folder=self.out, project_name='site',
+            bypass_robots=True, overwrite='update')
+        crawler = config.create_crawler()
+        crawler.get(self.url)
+        crawler.save_complete()
+        crawler.scheduler.validators.close()
+        return dict(RecordingHandler.codes), crawler.scheduler.stats
+
+    def test_unchanged_files_are_not_downloaded(self):
+        codes, stats = self.crawl()
+        self.assertEqual(set(codes.values()), {200})
+        self.assertEqual(len(codes), len(self.files))
+        folder = os.path.join(self.out, 'site', '127.0.0.1')
+        with open(os.path.join(folder, 'page.html'), 'rb') as fh:
+            page = fh.read()
+
+        codes, stats = self.crawl()
+        # The links of the unchanged pages are followed too.
+        self.assertEqual(codes, dict(('/' + k if k != 'index.html' else '/', 304)
+                                     for k in self.files))
+        self.assertEqual(stats['not_modified'], len(self.files))
+        with open(os.path.join(folder, 'page.html'), 'rb') as fh:
+            self.assertEqual(fh.read(), page)
+
+        os.utime(os.path.join(self.root, 'style.css'), (2e9, 2e9))
+        codes, stats = self.crawl()
+        self.assertEqual(codes.pop('/style.css'), 200)
+        self.assertEqual(set(codes.values()), {304})
+
+    def test_modified_file_is_downloaded(self):
+        self.crawl()
+        folder = os.path.join(self.out, 'site', '127.0.0.1')
+        with open(os.path.join(folder, 'img.gif'), 'ab') as fh:
+            fh.write(b'local change')
+        codes, stats = self.crawl()
+        self.assertEqual(codes.pop('/img.gif'), 200)
+        self.assertEqual(set(codes.values()), {304})
+        with open(os.path.join(folder, 'img.gif'), 'rb') as fh:
+            self.assertEqual(fh.read(), self.files['img.gif'])
+
+    def test_store(self):
+        path = os.path.join(self.out, 'validators.sqlite')
+        ans = ValidatorStore(path)
+        self.assertIsNone(ans.get(self.url))
+        self.assertEqual(ans.conditional_headers(None), {})
+        record = {'path': path, 'etag': '"abc"', 'modified': None,
+                  'size': os.path.getsize(path), 'hash': None, 'links': []}
+        self.assertEqual(ans.conditional_headers(record), {'If-None-Match': '"abc"'})
+        record['size'] += 1
+        self.assertEqual(ans.conditional_headers(record), {})
+        ans.close()
@@ -0,0 +1,143 @@
+# Copyright 2020; Raja Tomar
+import threading
+import time
+
+import requests
+from six.moves import BaseHTTPServer
+
+from pywebcopy.session import PooledAdapter
+from pywebcopy.session import RobotsCache
+from pywebcopy.session import Session
+from pywebcopy.tests.server import ServerTestCase
+from pywebcopy.tests.server import ThreadingServer
+
+
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'<html></html>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestConnectionPool(ServerTestCase):
+    handler = KeepAliveHandler
+    server_class = ThreadingServer
+
+    def setUp(self):
+        super(TestConnectionPool, self).setUp()
+        self.session = Session()
+        self.session.follow_robots_txt = False
+
+    def tearDown(self):
+        self.session.close()
+        super(TestConnectionPool, self).tearDown()
+
+    def test_adapters(self):
+        self.session.set_pool_size(24)
+        for adapter in self.session.adapters.values():
+            self.assertTrue(isinstance(adapter, PooledAdapter))
+            self.assertEqual(adapter._pool_maxsize, 24)
+            self.assertEqual(adapter._pool_connections, 24)
+            self.assertIs(adapter.stats, self.session.pool_stats)
+
+    def test_reuse(self):
+        for i in range(5):
+            self.session.get(self.url).content
+        info = self.session.pool_usage()
+        self.assertEqual((info.requests, info.connections, info.discarded), (5, 1, 0))
+        self.assertAlmostEqual(info.reuse_ratio, 0.8)
+
+    def test_discarded(self):
+        self.session.set_pool_size(2)
+        start = threading.Barrier(6) if hasattr(threading, 'Barrier') else None
+
+        def run():
+            if start is not None:
+                start.wait()
+            self.session.get(self.url).content
+
+        threads = [threading.Thread(target=run) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        info = self.session.pool_usage()
+        self.assertEqual(info.requests, 6)
+        # Every connection ends up either back in the pool or discarded.
+        self.assertTrue(0 < info.connections - info.discarded <= 2)
+
+
+class RobotsHandler(KeepAliveHandler):
+    hits = []
+
+    def do_GET(self):
+        if self.path != '/robots.txt':
+            return KeepAliveHandler.do_GET(self)
+        self.hits.append(self.path)
+        time.sleep(0.2)
+        body = b'User-agent: *\nDisallow: /private\n'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestRobotsRules(ServerTestCase):
+    handler = RobotsHandler
+    server_class = ThreadingServer
+
+    def setUp(self):
+        RobotsHandler.hits = []
+        super(TestRobotsRules, self).setUp()
+
+    def allowed(self, session, path):
+        return session.is_allowed(requests.Request('GET', self.url + path).prepare())
+
+    def test_single_flight(self):
+        session = Session()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.allowed(session, 'private')))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [False] * 8)
+        self.assertEqual(len(RobotsHandler.hits), 1)
+        self.assertEqual(session.robots_inflight, {})
+
+    def test_persistent_rules(self):
+        session = Session()
+        session.robots_cache = RobotsCache(self.out)
+        self.assertTrue(self.allowed(session, 'index.html'))
+        other = Session()
+        other.robots_cache = RobotsCache(self.out)
+        self.assertFalse(self.allowed(other, 'private'))
+        self.assertTrue(self.allowed(other, 'index.html'))
+        self.assertEqual(len(RobotsHandler.hits), 1)
+
+        expired = Session()
+        expired.robots_cache = RobotsCache(self.out, ttl=0)
+        time.sleep(0.01)
+        self.assertFalse(self.allowed(expired, 'private'))
+        self.assertEqual(len(RobotsHandler.hits), 2)
+
+    def test_prefetch(self):
+        session = Session()
+        thread = session.prefetch_rules(self.url + 'index.html')
+        self.assertIsNotNone(thread)
+        self.assertIsNone(session.prefetch_rules(self.url + 'other.html'))
+        thread.join()
+        self.assertIn(self.url + 'robots.txt', session.robots_registry)
+        self.assertIsNone(session.prefetch_rules(self.url + 'other.html'))
+        self.assertFalse(self.allowed(session, 'private'))
+        self.assertEqual(len(RobotsHandler.hits), 1)
@@ -0,0 +1,171 @@
+# Copyright 2019; Raja Tomar
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from io import BytesIO
+
+from pywebcopy.configs import ConfigError
+from pywebcopy.configs import get_config
+from pywebcopy.storage import FileStorage
+from pywebcopy.storage import MemoryStorage
+from pywebcopy.storage import SQLiteStorage
+from pywebcopy.storage import TarStorage
+from pywebcopy.storage import ZipStorage
+from pywebcopy.storage import file_storage
+from pywebcopy.tests.server import ServerTestCase
+
+
+class StorageMixin(object):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.storage = self.create_storage()
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.folder)
+
+    def create_storage(self):
+        raise NotImplementedError()
+
+    def location(self, *parts):
+        return os.path.join(self.folder, *parts)
+
+    def read(self, storage, location):
+        with storage.open(location) as f:
+            return f.read()
+
+    def test_write_and_read(self):
+        location = self.location('example.com', 'img.gif')
+        self.assertEqual(self.storage.write(BytesIO(b'GIF89a'), location), location)
+        self.assertEqual(self.read(self.storage, location), b'GIF89a')
+        self.assertEqual(self.storage.size(location), 6)
+        self.assertTrue(self.storage.exists(location))
+        self.assertFalse(self.storage.exists(self.location('example.com', 'other.gif')))
+        with self.assertRaises((IOError, OSError)):
+            self.storage.open(self.location('example.com', 'other.gif'))
+
+    def test_overwrite(self):
+        location = self.location('example.com', 'index.html')
+        self.storage.write(BytesIO(b'first'), location)
+        self.storage.write(BytesIO(b'second'), location)
+        self.assertEqual(self.read(self.storage, location), b'first')
+        self.storage.write(BytesIO(b'third!'), location, overwrite=True)
+        self.assertEqual(self.read(self.storage, location), b'third!')
+        self.assertEqual(self.storage.size(location), 6)
+
+
+class TestFileStorage(StorageMixin, unittest.TestCase):
+    def create_storage(self):
+        return FileStorage()
+
+    def test_prepare(self):
+        self.assertEqual(self.storage.prepare([self.location('a', 'b', 'c.gif')]), 1)
+        self.assertTrue(os.path.isdir(self.location('a', 'b')))
+
+
+class TestMemoryStorage(StorageMixin, unittest.TestCase):
+    def create_storage(self):
+        return MemoryStorage(self.folder)
+
+    def test_nothing_is_written(self):
+        self.storage.write(BytesIO(b'GIF89a'), self.location('example.com', 'img.gif'))
+        self.assertEqual(self.storage.files, {'example.com/img.gif': b'GIF89a'})
+        self.assertEqual(os.listdir(self.folder), [])
+
+
+class ContainerMixin(StorageMixin):
+    def test_reopen(self):
+        location = self.location('example.com', 'style.css')
+        self.storage.write(BytesIO(b'body {}'), location)
+        self.storage.close()
+        self.storage = self.create_storage()
+        self.assertEqual(self.read(self.storage, location), b'body {}')
+        self.storage.write(BytesIO(b'other'), location)
+        self.assertEqual(self.read(self.storage, location), b'body {}')
+
+
+class TestZipStorage(ContainerMixin, unittest.TestCase):
+    def create_storage(self):
+        return ZipStorage(self.location('site.zip'), self.folder)
+
+    def test_container(self):
+        self.storage.write(BytesIO(b'GIF89a'), self.location('example.com', 'img.gif'))
+        self.storage.flush()
+        with zipfile.ZipFile(self.location('site.zip')) as f:
+            self.assertEqual(f.namelist(), ['example.com/img.gif'])
+
+
+class TestTarStorage(ContainerMixin, unittest.TestCase):
+    def create_storage(self):
+        return TarStorage(self.location('site.tar'), self.folder)
+
+    def test_container(self):
+        self.storage.write(BytesIO(b'GIF89a'), self.location('example.com', 'img.gif'))
+        self.storage.flush()
+        with tarfile.open(self.location('site.tar')) as f:
+            self.assertEqual(f.getnames(), ['example.com/img.gif'])
+
+
+class TestSQLiteStorage(ContainerMixin, unittest.TestCase):
+    def create_storage(self):
+        return SQLiteStorage(self.location('site.sqlite'), self.folder)
+
+
+class TestStorageConfig(ServerTestCase):
+    files = {
+        'index.html': b'<html><head><link rel="stylesheet" href="style.css"></head>'
+                      b'<body><img src="img.gif"><a href="page.html">page</a></body></html>',
+        'page.html': b'<html><body>page</body></html>',
+        'style.css': b'body {background: url("bg.gif");}',
+        'img.gif': b'GIF89a',
+        'bg.gif': b'GIF89a',
+    }
+
+    def crawl(self, storage, **kwargs):
+        config = get_config(
+            self.url, project_folder=self.out, project_name='site', bypass_robots=True, **kwargs)
+        config['storage'] = storage
+        crawler = config.create_crawler()
+        crawler.get(self.url)
+        crawler.save_complete()
+        return config, crawler
+
+    def test_create_storage(self):
+        config = get_config(self.url, project_folder=self.out, project_name='site')
+        self.assertIs(config.create_storage(), file_storage)
+        self.assertIs(config.create_context().storage, file_storage)
+        config['storage'] = 'zip'
+        storage = config.create_storage()
+        self.assertIsInstance(storage, ZipStorage)
+        self.assertEqual(storage.path, os.path.join(config.get('project_folder'), 'site.zip'))
+        config['storage'] = 'floppy'
+        self.assertRaises(ConfigError, config.create_storage)
+        config['storage'] = 'tar'
+        config['processes'] = 2
+        self.assertRaises(ConfigError, config.create_storage)
+
+    def test_crawl_in_memory(self):
+        config, crawler = self.crawl('memory')
+        storage = crawler.context.storage
+        self.assertEqual(
+            sorted(storage.files), sorted('127.0.0.1/' + name for name in self.files))
+        self.assertEqual(storage.files['127.0.0.1/img.gif'], b'GIF89a')
+        self.assertIn(b'href="./style.css"', storage.files['127.0.0.1/index.html'])
+        self.assertFalse(os.path.exists(os.path.join(config.get('project_folder'), '127.0.0.1')))
+
+    def test_crawl_into_zip(self):
+        config, crawler = self.crawl('zip')
+        with zipfile.ZipFile(crawler.context.storage.path) as f:
+            self.assertEqual(
+                sorted(f.namelist()), sorted('127.0.0.1/' + name for name in self.files))
+
+    def test_update_mode(self):
+        for _ in range(2):
+            config, crawler = self.crawl('sqlite', overwrite='update')
+            crawler.scheduler.validators.close()
+            crawler.context.storage.close()
+        # The sizes of the stored files are checked instead of the disk.
+        self.assertEqual(crawler.scheduler.stats['not_modified'], len(self.files))
@@ -18,6 +18,11 @@ from pywebcopy.urls import parse_url
 from pywebcopy.urls import get_host
 from pywebcopy.urls import relate
 from pywebcopy.urls import secure_filename
+from pywebcopy.urls import Canonicalizer
+from pywebcopy.urls import remove_dot_segments
+from pywebcopy.urls import url2path
+from pywebcopy.urls import Context
+from pywebcopy.urls import SHARDED
 
 
 class TestBasicTools(unittest.TestCase):
@@ -145,3 +150,62 @@ class TestUrl2Path(unittest.TestCase):
                 self.assertEqual(secure_filename(i), '_' + i)
             else:
                 self.assertEqual(secure_filename(i), i)
+
+
+class TestShardedTree(unittest.TestCase):
+    def test_two_level_hash_prefix(self):
+        path = url2path('http://www.nx-domain.com/blog/index.html', base_path='/mirror', tree_type=SHARDED)
+        digest = hashlib.md5(b'www.nx-domain.com/blog/index.html').hexdigest()
+        self.assertEqual(path, os.path.join('/mirror', digest[:2], digest[2:4], 'index_%s.html' % digest[4:12]))
+
+    def test_same_names_are_told_apart(self):
+        a = url2path('http://www.nx-domain.com/a/index.html', base_path='/mirror', tree_type=SHARDED)
+        b = url2path('http://www.nx-domain.com/b/index.html', base_path='/mirror', tree_type=SHARDED)
+        self.assertNotEqual(a, b)
+        self.assertEqual(a, url2path('http://www.nx-domain.com/a/index.html', base_path='/mirror', tree_type=SHARDED))
+
+    def test_relate(self):
+        page = url2path('http://www.nx-domain.com/blog/index.html', base_path='/mirror', tree_type=SHARDED)
+        css = url2path('http://www.nx-domain.com/style.css', base_path='/mirror', tree_type=SHARDED)
+        rel = relate(css, page)
+        self.assertTrue(rel.startswith('../../'))
+        self.assertEqual(os.path.normpath(os.path.join(os.path.dirname(page), rel)), css)
+
+    def test_context_resolve(self):
+        ctx = Context('http://www.nx-domain.com/style.css', base_path='/mirror', tree_type=SHARDED)
+        self.assertEqual(ctx.resolve(), url2path(
+            'http://www.nx-domain.com/style.css', base_path='/mirror', tree_type=SHARDED))
+        with self.assertRaises(ValueError):
+            Context('http://www.nx-domain.com/', tree_type='FLAT')
+
+
+class TestCanonicalizer(unittest.TestCase):
+    def test_remove_dot_segments(self):
+        self.assertEqual(remove_dot_segments('/a/b/c/./../../g'), '/a/g')
+        self.assertEqual(remove_dot_segments('/a/../../b'), '/b')
+        self.assertEqual(remove_dot_segments('/a/b/..'), '/a/')
+        self.assertEqual(remove_dot_segments('/a/b'), '/a/b')
+
+    def test_equivalent_urls(self):
+        ans = Canonicalizer()
+        for url in ('HTTP://Example.com:80/a/../b?utm_source=x#top',
+                    'http://example.com/b',
+                    'http://example.com/./b#frag',
+                    'http://EXAMPLE.com/b?fbclid=1&utm_medium=y'):
+            with self.subTest(url=url):
+                self.assertEqual(ans(url), 'http://example.com/b')
+
+    def test_distinct_urls(self):
+        ans = Canonicalizer()
+        self.assertEqual(ans('http://example.com'), 'http://example.com/')
+        self.assertEqual(ans('https://example.com:8443/b?b=2&a=1'), 'https://example.com:8443/b?b=2&a=1')
+        self.assertEqual(ans('http://example.com/B'), 'http://example.com/B')
+        self.assertEqual(ans('data:text/plain,abc'), 'data:text/plain,abc')
+        self.assertEqual(ans('/relative'), '/relative')
+
+    def test_options(self):
+        ans = Canonicalizer(strip_params=['ref', 'session*'], sort_query=True)
+        self.assertEqual(
+            ans('http://example.com/?q=1&ref=a&sessionid=2&page=3&utm_source=x'),
+            'http://example.com/?page=3&q=1&utm_source=x')
+        self.assertEqual(Canonicalizer(strip_params=None)('http://e.com/?utm_x=1'), 'http://e.com/?utm_x=1')
@@ -0,0 +1,139 @@
+# Copyright 2019; Raja Tomar
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from six.moves import BaseHTTPServer
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from pywebcopy.configs import get_config
+from pywebcopy.session import Session
+from pywebcopy.tests.server import ServerTestCase
+from pywebcopy.warc import cdx_lookup
+from pywebcopy.warc import read_record
+from pywebcopy.warc import surt
+
+
+class WarcHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    #: Response headers and body of every path.
+    pages = {
+        '/': ([('Content-Type', 'text/html')],
+              b'<html><body><a href="/page.html">page</a><img src="/old.gif"></body></html>'),
+        '/page.html': ([('Content-Type', 'text/html')], b'<html><body>page</body></html>'),
+        '/new.gif': ([('Content-Type', 'image/gif')], b'GIF89a' * 1000),
+        '/big.bin': ([('Content-Type', 'application/octet-stream')], os.urandom(1 << 16)),
+    }
+
+    def do_GET(self):
+        if self.path == '/old.gif':
+            self.send_response(301)
+            self.send_header('Location', '/new.gif')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        headers, body = self.pages[self.path]
+        self.send_response(200)
+        for k, v in headers:
+            self.send_header(k, v)
+        if 'gzip' in self.headers.get('Accept-Encoding', '') and self.path == '/page.html':
+            self.send_header('Content-Encoding', 'gzip')
+            body = gzip.compress(body)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestWarc(ServerTestCase):
+    handler = WarcHandler
+    url_path = ''
+
+    def lookup(self, url):
+        """Returns the stored response of the url from the CDX indexes."""
+        for name in os.listdir(self.out):
+            if name.endswith('.cdx'):
+                for fields in cdx_lookup(os.path.join(self.out, name), url):
+                    return fields, read_record(
+                        os.path.join(self.out, fields[10]), int(fields[9]))
+        return None, (None, None)
+
+    def test_surt(self):
+        self.assertEqual(surt('http://www.Example.com/a?b=2&a=1'), 'com,example)/a?a=1&b=2')
+        self.assertEqual(surt('https://example.com:443'), 'com,example)/')
+        self.assertEqual(surt('http://example.com:8080/x'), 'com,example:8080)/x')
+
+    def test_exchanges_are_written(self):
+        session = Session()
+        session.follow_robots_txt = False
+        session.enable_warc(self.out, 'test', max_size=1 << 12)
+        self.assertEqual(len(session.get(self.url + '/big.bin').content), 1 << 16)
+        response = session.get(self.url + '/old.gif')
+        # The caller still reads the body after it was written.
+        self.assertEqual(response.content, WarcHandler.pages['/new.gif'][1])
+        self.assertEqual(response.history[0].status_code, 301)
+        self.assertEqual(session.get(self.url + '/page.html').text,
+                         '<html><body>page</body></html>')
+        session.close()
+
+        names = sorted(os.listdir(self.out))
+        warcs = [n for n in names if n.endswith('.warc.gz')]
+        # The file which grew beyond the size is followed by the next one.
+        self.assertEqual(len(warcs), 2)
+        self.assertEqual(sorted(n for n in names if n.endswith('.cdx')),
+                         [n[:-len('.warc.gz')] + '.cdx' for n in warcs])
+        self.assertTrue(all(n.startswith('test-') for n in names))
+
+        fields, (headers, block) = self.lookup(self.url + '/old.gif')
+        self.assertEqual(fields[4], '301')
+        self.assertEqual(fields[6], '/new.gif')
+        self.assertEqual(headers['WARC-Type'], 'response')
+
+        fields, (headers, block) = self.lookup(self.url + '/page.html')
+        self.assertEqual(fields[3], 'text/html')
+        self.assertTrue(block.startswith(b'HTTP/1.0 200 OK\r\n'))
+        # Bodies are stored decoded along with the matching headers.
+        self.assertTrue(block.endswith(b'\r\n\r\n<html><body>page</body></html>'))
+        self.assertNotIn(b'Content-Encoding', block)
+
+        fields, (headers, block) = self.lookup(self.url + '/big.bin')
+        self.assertEqual(int(headers['Content-Length']), len(block))
+        self.assertTrue(block.endswith(WarcHandler.pages['/big.bin'][1]))
+        self.assertEqual(self.lookup(self.url + '/missing')[0], None)
+
+    def test_crawl_without_mirror(self):
+        self.crawl_without_mirror('sync')
+
+    @unittest.skipIf(aiohttp is None, "aiohttp is not installed.")
+    def test_asyncio_crawl_without_mirror(self):
+        self.crawl_without_mirror('asyncio')
+
+    def crawl_without_mirror(self, scheduler):
+        out = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, out)
+        config = get_config(
+            self.url + '/', project_folder=out, project_name='site', bypass_robots=True,
+            scheduler=scheduler)
+        config['warc'] = True
+        config['mirror'] = False
+        crawler = config.create_crawler()
+        crawler.get(self.url + '/')
+        crawler.save_complete()
+        crawler.session.close()
+        if hasattr(crawler.scheduler, 'close'):
+            crawler.scheduler.close()
+
+        project = config.get('project_folder')
+        self.assertEqual(
+            [n for n in os.listdir(project) if not n.startswith('.')], ['warc'])
+        self.out = os.path.join(project, 'warc')
+        for path in ('/', '/page.html', '/old.gif', '/new.gif'):
+            fields, (headers, block) = self.lookup(self.url + path)
+            self.assertIsNotNone(fields, path)
@@ -11,6 +11,8 @@ import os
 import re
 import logging
 import errno
+import mimetypes
+import threading
 from cgi import parse_header
 from collections import namedtuple
 from hashlib import md5
@@ -28,11 +30,12 @@ from six.moves.urllib.parse import urljoin
 from .helpers import lru_cache
 
 __all__ = [
-    'url2path', 'filename_present', 'relate', 'get_etag', 'HIERARCHY', 'LINEAR',
+    'url2path', 'filename_present', 'relate', 'get_etag', 'HIERARCHY', 'LINEAR', 'SHARDED',
     'parse_url', 'parse_header', 'get_host', 'get_prefix', 'get_suffix',
     'Url', 'LocationParseError', 'secure_filename', 'split_first',
     'common_prefix_map', 'common_suffix_map', 'get_content_type_from_headers',
-    'Context', 'ContextError', 'retrieve_resource', 'urlretrieve'
+    'Context', 'ContextError', 'retrieve_resource', 'urlretrieve', 'guess_content_type',
+    'Canonicalizer', 'remove_dot_segments', 'tracking_params'
 ]
 
 logger = logging.getLogger(__name__)
@@ -268,6 +271,88 @@ def get_host(url):
     return p.scheme or 'http', p.hostname, p.port
 
 
+#: Query parameters which only track the visitors, names ending in a `*`
+#: are the prefixes of the names.
+tracking_params = frozenset([
+    'utm_*', 'gclid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'mc_cid', 'mc_eid', '_ga', '_hsenc',
+])
+
+#: Ports which are implied by the schemes.
+default_ports = {'http': 80, 'https': 443}
+
+
+def remove_dot_segments(path):
+    """Resolves the `.` and `..` segments of the path as per rfc3986#section-5.2.4
+
+    Example::
+
+        >>> remove_dot_segments('/a/b/../c/./d')
+        '/a/c/d'
+    """
+    if '.' not in path:
+        return path
+    output = []
+    for segment in path.split('/'):
+        if segment == '..':
+            if len(output) > 1:
+                output.pop()
+        elif segment != '.':
+            output.append(segment)
+    if path.endswith(('/.', '/..')):
+        output.append('')
+    return '/'.join(output) or '/'
+
+
+class Canonicalizer(object):
+    """Rewrites the equivalent http urls to a single canonical url, so
+    that the index could tell that they refer to the same resource.
+
+    Scheme and host are lowercased, the default port, the fragment and the
+    dot-segments are removed, and the given query parameters are stripped.
+
+    Example::
+
+        >>> Canonicalizer()('HTTP://Example.com:80/a/../b?utm_source=x#top')
+        'http://example.com/b'
+
+    :param strip_params: names of the query parameters to remove, names
+        ending in a `*` are prefixes.
+    :param sort_query: whether to sort the query parameters by their names.
+    """
+
+    def __init__(self, strip_params=tracking_params, sort_query=False):
+        strip_params = strip_params or ()
+        self.strip_names = frozenset(p for p in strip_params if not p.endswith('*'))
+        self.strip_prefixes = tuple(p[:-1] for p in strip_params if p.endswith('*'))
+        self.sort_query = sort_query
+
+    def __repr__(self):
+        return '<%s(sort_query=%r)>' % (self.__class__.__name__, self.sort_query)
+
+    def _keep(self, param):
+        name = param.split('=', 1)[0]
+        return name not in self.strip_names and not name.startswith(self.strip_prefixes)
+
+    def __call__(self, url):
+        try:
+            u = parse_url(url)
+        except LocationParseError:
+            return url
+        if u.scheme not in default_ports or not u.host:
+            return url
+        port = None if u.port == default_ports[u.scheme] else u.port
+        path = remove_dot_segments(u.path or '/')
+        query = u.query
+        if query:
+            params = [p for p in query.split('&') if p and self._keep(p)]
+            if self.sort_query:
+                params.sort(key=lambda p: p.split('=', 1)[0])
+            query = '&'.join(params) or None
+        return Url(u.scheme, u.auth, u.host, port, path, query or None, None).url
+
+    canonicalize = __call__
+
+
 def get_etag(string):
     if not isinstance(string, binary_type):
         string = string.encode()
@@ -370,6 +455,23 @@ def get_suffix(content_type):
     return common_suffix_map.get(content_type)
 
 
+def guess_content_type(url, default=None):
+    """Guesses the content-type of the url from its file extension.
+
+    Only the web types known to the :data:`common_suffix_map` are
+    reported, so that the guess always leads to the same file path as
+    the content-type returned by the server would.
+
+    :param url: url of the resource.
+    :param default: value returned for the unknown file extensions.
+    """
+    path = parse_url(url).path or ''
+    content_type, _ = mimetypes.guess_type(path, strict=False)
+    if content_type in common_suffix_map:
+        return content_type
+    return default
+
+
 # common file names for some web file types.
 common_prefix_map = {
     'application/javascript': 'app',
@@ -390,6 +492,9 @@ def get_prefix(content_type):
 
 HIERARCHY = 'HIERARCHY'
 LINEAR = 'LINEAR'
+SHARDED = 'SHARDED'
+#: All the supported tree types.
+TREE_TYPES = (LINEAR, HIERARCHY, SHARDED)
 
 # Helpers for bytes handling
 _implicit_encoding = 'ascii'
@@ -571,6 +676,18 @@ def url2path(url,
                 subdir1/
                     file1
                 file2
+        sharded:-
+            basedir/
+                3f/
+                    a2/
+                        file1_9c04e1b7
+                c7/
+                    0d/
+                        file2_51aa3e80
+
+    The sharded tree places the files under two levels of folders named
+    after the md5 hash of their hierarchy path, which also tells apart the
+    files of a same name, hence no folder gets too many entries.
 
     ..features::
         1. base url joining and normalisations
@@ -578,7 +695,7 @@ def url2path(url,
         3. pure disk compatible path
         4. additional base path joining
         5. prefix and suffix implicit support
-        6. Tree types: linear or hierarchy
+        6. Tree types: linear, hierarchy or sharded
 
     ..usage::
         >>> url2path('http://nx-domain.com/path/to/file?q=value')
@@ -595,12 +712,20 @@ def url2path(url,
     if isinstance(base_path, string_types) and '~' in base_path:
         base_path = os.path.expanduser(base_path)
 
-    # hierarchy or a linear tree
+    # hierarchy, sharded or a linear tree
     if tree_type == LINEAR:
         if isinstance(base_path, string_types):
             path = os.path.join(base_path, basename)
         else:
             path = basename
+    elif tree_type == SHARDED:
+        digest = md5('/'.join(dirname + (basename,)).encode('utf-8')).hexdigest()
+        stem, ext = os.path.splitext(basename)
+        parts = (digest[:2], digest[2:4], '%s_%s%s' % (stem, digest[4:12], ext))
+        if isinstance(base_path, string_types):
+            path = os.path.join(base_path, *parts)
+        else:
+            path = os.path.join(*parts)
     else:
         if isinstance(base_path, string_types):
             path = os.path.join(base_path, *(dirname + (basename,)))
@@ -615,7 +740,7 @@ def from_content_type(response, base_url=None, base_path=None, tree_type=HIERARC
     :type response: requests.Response or urllib.Response
     :type base_url: string_types
     :type base_path: string_types
-    :type tree_type: LINEAR or HIERARCHY
+    :type tree_type: LINEAR, HIERARCHY or SHARDED
     :rtype: string_types
     :return: calculated path
     """
@@ -665,6 +790,81 @@ if hasattr(os, 'O_NOFOLLOW'):
     fd_flags |= os.O_NOFOLLOW
 
 
+class DirectoryCache(object):
+    """Thread-safe set of the directories which are known to exist, so
+    that the directories of every file are created only once instead of
+    failing with `EEXIST` on every subsequent file.
+
+    Directories removed by someone else are found out by :func:`make_fd`
+    which then forgets them and creates them again.
+    """
+
+    def __init__(self):
+        self.known = set()
+        self._lock = threading.Lock()
+
+    def __contains__(self, path):
+        return path in self.known
+
+    def _add(self, path):
+        with self._lock:
+            while path and path not in self.known:
+                self.known.add(path)
+                parent = os.path.dirname(path)
+                if parent == path:
+                    break
+                path = parent
+
+    def ensure(self, path):
+        """Creates the directory with its parents unless it is known to exist.
+
+        :return: whether the directory exists.
+        """
+        if path in self.known:
+            return True
+        try:
+            os.makedirs(path)
+        except (OSError, IOError) as e:
+            if e.errno == errno.EEXIST or ((os.name == 'nt' and os.path.isdir(
+                    path) and os.access(path, os.W_OK))):
+                logger.debug(
+                    "[FILE] Sub-directories exists for: <%r>" % path)
+            # dead on arrival
+            else:
+                return False
+        else:
+            logger.debug(
+                "[File] Sub-directories created for: <%r>" % path)
+        self._add(path)
+        return True
+
+    def prepare(self, locations):
+        """Creates the directories of many files in one go, parents first.
+
+        :param locations: paths of the files which are going to be written.
+        :return: number of the directories which weren't known before.
+        """
+        dirs = set(os.path.dirname(os.path.normpath(p)) for p in locations if p)
+        dirs = sorted(d for d in dirs if d not in self.known)
+        for d in dirs:
+            self.ensure(d)
+        return len(dirs)
+
+    def forget(self, path=None):
+        """Forgets the directory and the ones inside of it, or everything."""
+        with self._lock:
+            if path is None:
+                self.known.clear()
+            else:
+                prefix = os.path.join(path, '')
+                self.known = set(
+                    d for d in self.known if d != path and not d.startswith(prefix))
+
+
+#: Directories which this process has created or found.
+known_dirs = DirectoryCache()
+
+
 def make_fd(location, url=None, overwrite=False):
     """Creates a kernel based file descriptor which should be used
     to write binary data onto the files.
@@ -674,31 +874,30 @@ def make_fd(location, url=None, overwrite=False):
     location = os.path.normpath(location)
     # Subdirectories creation which suppresses exceptions
     base_dir = os.path.dirname(location)
-    try:
-        os.makedirs(base_dir)
-    except (OSError, IOError) as e:
-        if e.errno == errno.EEXIST or ((os.name == 'nt' and os.path.isdir(
-                base_dir) and os.access(base_dir, os.W_OK))):
-            logger.debug(
-                "[FILE] Sub-directories exists for: <%r>" % location)
-        # dead on arrival
-        else:
-            logger.error(
-                "[File] Failed to create target location <%r> "
-                "for the file <%r> on the disk." % (location, url))
-            return -1
-    else:
-        logger.debug(
-            "[File] Sub-directories created for: <%r>" % location)
+    if not known_dirs.ensure(base_dir):
+        logger.error(
+            "[File] Failed to create target location <%r> "
+            "for the file <%r> on the disk." % (location, url))
+        return -1
     try:
 
         # sys.audit("%s.resource" % __title__, location)
         # sys.audit("os.open", location)
         if overwrite:
-            fd = os.open(location, fd_flags | os.O_TRUNC, fd_mode)
+            flags = fd_flags | os.O_TRUNC
         else:
             # raises FileExistsError if file exists
-            fd = os.open(location, fd_flags | os.O_EXCL, fd_mode)
+            flags = fd_flags | os.O_EXCL
+        try:
+            fd = os.open(location, flags, fd_mode)
+        except (OSError, IOError) as e:
+            if e.errno != errno.ENOENT or base_dir not in known_dirs:
+                raise
+            # The directory was removed after it was cached.
+            known_dirs.forget(base_dir)
+            if not known_dirs.ensure(base_dir):
+                raise
+            fd = os.open(location, flags, fd_mode)
 
     except (OSError, IOError) as e:
         if e.errno == errno.EEXIST:
@@ -718,8 +917,8 @@ def make_fd(location, url=None, overwrite=False):
 def retrieve_resource(content, location, url=None, overwrite=False):
     """Retrieves the readable resource to a local file.
 
-    ..todo::
-        Add overwrite modes: Overwrite or True, Update, Ignore or False
+    The `'update'` overwrite mode of the config overwrites the files too,
+    as the unchanged ones are not downloaded again in the first place.
 
     :param BytesIO content: file like object with read method
     :param location: file name where this content has to be saved.
@@ -774,7 +973,7 @@ def urlretrieve(url, location, **params):
 
 
 context_attrs = [
-    'url', 'base_url', 'base_path', 'tree_type', 'content_type',
+    'url', 'base_url', 'base_path', 'tree_type', 'content_type', 'depth', 'storage',
 ]
 
 
@@ -792,11 +991,12 @@ class Context(namedtuple('Context', context_attrs)):
         tree_type = config.get('tree_type')
         if None in (url, path, tree_type):
             raise AttributeError("Values can't be NoneType.", url, path, tree_type)
-        return cls(url, url, path, tree_type, None)
+        return cls(url, url, path, tree_type, None, storage=config.create_storage())
 
-    def __new__(cls, url=None, base_url=None, base_path=None, tree_type=None, content_type=None, **kwargs):
-        if tree_type not in (LINEAR, HIERARCHY):
-            raise ValueError("TreeType should be either LINEAR or HIERARCHY.")
+    def __new__(cls, url=None, base_url=None, base_path=None, tree_type=None, content_type=None,
+                depth=0, storage=None, **kwargs):
+        if tree_type not in TREE_TYPES:
+            raise ValueError("TreeType should be either LINEAR, HIERARCHY or SHARDED.")
 
         if not isinstance(url, string_types):
             raise TypeError(url)
@@ -811,16 +1011,19 @@ class Context(namedtuple('Context', context_attrs)):
         base_path = os.path.normpath(base_path)
 
         # noinspection PyArgumentList
-        return super(Context, cls).__new__(cls, url, base_url, base_path, tree_type, content_type)
+        return super(Context, cls).__new__(
+            cls, url, base_url, base_path, tree_type, content_type, depth, storage)
 
     def with_values(self, **kwargs):
         return self._replace(**kwargs)
 
     def create_new_from_url(self, url):
-        """Creates a new identical context with only difference of the url."""
+        """Creates a new identical context with only difference of the url,
+        which is one link deeper than this context."""
         #: The base url for the new url should be the url of the parent context
         #: and not the absolute parent url. Learned a lesson today!
-        return self.with_values(url=urljoin(self.url, url), content_type=None)
+        return self.with_values(
+            url=urljoin(self.url, url), content_type=None, depth=self.depth + 1)
 
     def resolve(self):
         prefix = suffix = None
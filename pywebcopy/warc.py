@@ -0,0 +1,297 @@
+# Copyright 2020; Raja Tomar
+# See license for more details
+"""
+WARC files written while the crawl runs, used by the :class:`pywebcopy.session.Session`.
+
+Every exchange is stored as a request and a response record, each of them
+compressed in its own gzip member so that a record could be read from its
+offset alone. The files are rotated once they grow beyond the allowed size
+and every file gets a sorted CDX index of its responses next to it.
+"""
+import base64
+import gzip
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from shutil import copyfileobj
+
+from six import binary_type
+from six import text_type
+from six.moves.urllib.parse import parse_qsl
+from six.moves.urllib.parse import urlencode
+from six.moves.urllib.parse import urlsplit
+
+from .__version__ import __title__
+from .__version__ import __version__
+
+logger = logging.getLogger(__name__)
+
+#: Fields of the CDX index lines, see the CDX file format.
+cdx_header = ' CDX N b a m s k r M S V g'
+
+default_ports = {'http': 80, 'https': 443}
+
+
+def surt(url):
+    """Returns the sort-friendly form of the url which keys the CDX index,
+    i.e. `http://www.Example.com/a?b=1` becomes `com,example)/a?b=1`.
+    """
+    s, n, p, q, f = urlsplit(url.strip())
+    host, _, port = n.rpartition('@')[2].lower().partition(':')
+    if host.startswith('www.'):
+        host = host[4:]
+    ans = ','.join(reversed(host.split('.')))
+    if port and port != str(default_ports.get(s.lower())):
+        ans += ':' + port
+    ans += ')' + (p or '/')
+    if q:
+        ans += '?' + urlencode(sorted(parse_qsl(q, keep_blank_values=True)))
+    return ans.lower()
+
+
+def payload_digest(digest):
+    """Returns the WARC notation of a sha1 hash object."""
+    return 'sha1:' + base64.b32encode(digest.digest()).decode('ascii')
+
+
+def warc_date(seconds=None):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+
+def _encode(value):
+    if isinstance(value, text_type):
+        return value.encode('utf-8')
+    return value
+
+
+def http_head(start_line, headers):
+    """Returns the bytes of an http message up to its body."""
+    lines = [start_line] + ['%s: %s' % (k, v) for k, v in headers]
+    return _encode('\r\n'.join(lines) + '\r\n\r\n')
+
+
+def request_head(request):
+    """Returns the head of the request as it was sent over the wire."""
+    s, n, p, q, f = urlsplit(request.url)
+    target = (p or '/') + ('?' + q if q else '')
+    headers = list(request.headers.items())
+    if 'Host' not in request.headers:
+        headers.insert(0, ('Host', n.rpartition('@')[2]))
+    return http_head('%s %s HTTP/1.1' % (request.method, target), headers)
+
+
+def response_head(status, reason, headers, version=11):
+    return http_head(
+        'HTTP/%s %s %s' % ('1.0' if version == 10 else '1.1', status, reason or ''), headers)
+
+
+def cdx_lookup(path, url):
+    """Returns the CDX lines of the url found by a binary search of the
+    sorted CDX file, with the fields split in a list.
+
+    :param path: location of the CDX file.
+    :param url: url whose captures are looked for.
+    :rtype: list
+    """
+    key = _encode(surt(url) + ' ')
+    with open(path, 'rb') as f:
+        lo, hi = 0, os.fstat(f.fileno()).st_size
+        # Finds the first line which isn't sorted before the key.
+        while lo < hi:
+            mid = (lo + hi) // 2
+            f.seek(mid)
+            if mid:
+                f.readline()
+            line = f.readline()
+            if line and line < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        f.seek(lo)
+        if lo:
+            f.readline()
+        ans = []
+        for line in f:
+            if line.startswith(key):
+                ans.append(line.decode('utf-8').split())
+            elif line >= key:
+                break
+        return ans
+
+
+def read_record(path, offset):
+    """Returns the headers and the block of the record stored at the
+    offset of a WARC file as a (dict, bytes) tuple."""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        gz = gzip.GzipFile(fileobj=f)
+        if not gz.readline().startswith(b'WARC/'):
+            raise ValueError("No WARC record at offset %d of %s" % (offset, path))
+        headers = {}
+        line = gz.readline().strip()
+        while line:
+            k, _, v = line.decode('utf-8').partition(':')
+            headers[k.strip()] = v.strip()
+            line = gz.readline().strip()
+        return headers, gz.read(int(headers['Content-Length']))
+
+
+class WarcWriter(object):
+    """Writes the exchanges of a crawl into gzip compressed WARC files.
+
+    :param path: folder which stores the files.
+    :param prefix: (optional) start of the names of the files.
+    :param max_size: (optional) bytes after which the next file is started.
+    :param compresslevel: (optional) gzip compression level of the records.
+    """
+
+    def __init__(self, path, prefix=__title__, max_size=1 << 30, compresslevel=6):
+        self.path = path
+        self.prefix = prefix
+        self.max_size = max_size
+        self.compresslevel = compresslevel
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.lock = threading.Lock()
+        #: Number of the files started by this writer.
+        self.serial = 0
+        self.file = None
+        self.filename = None
+        #: Index lines of the responses in the current file.
+        self.cdx = []
+        self.warcinfo_id = None
+        self.logger = logger.getChild(self.__class__.__name__)
+
+    def __repr__(self):
+        return '<%s(path=%s)>' % (self.__class__.__name__, self.path)
+
+    def _open(self):
+        self.serial += 1
+        self.filename = '%s-%s-%d-%05d.warc.gz' % (
+            self.prefix, time.strftime('%Y%m%d%H%M%S', time.gmtime()),
+            os.getpid(), self.serial)
+        self.file = open(os.path.join(self.path, self.filename), 'wb')
+        self.cdx = []
+        self.warcinfo_id = self.record_id()
+        info = _encode('\r\n'.join([
+            'software: %s/%s' % (__title__, __version__),
+            'hostname: %s' % socket.gethostname(),
+            'format: WARC File Format 1.0',
+        ]) + '\r\n')
+        self._write_record([
+            ('WARC-Type', 'warcinfo'),
+            ('WARC-Record-ID', self.warcinfo_id),
+            ('WARC-Date', warc_date()),
+            ('WARC-Filename', self.filename),
+            ('Content-Type', 'application/warc-fields'),
+        ], info, None, len(info))
+        self.logger.info("Started the WARC file [%s]" % self.filename)
+
+    @staticmethod
+    def record_id():
+        return '<urn:uuid:%s>' % uuid.uuid4()
+
+    def _write_record(self, headers, head, payload, length):
+        """Writes a record in a gzip member of its own and returns its
+        offset and compressed length."""
+        offset = self.file.tell()
+        headers = list(headers) + [('Content-Length', str(length))]
+        gz = gzip.GzipFile(
+            fileobj=self.file, mode='wb', compresslevel=self.compresslevel, filename='')
+        try:
+            gz.write(http_head('WARC/1.0', headers))
+            gz.write(head)
+            if payload is not None:
+                copyfileobj(payload, gz, 64 * 1024)
+            gz.write(b'\r\n\r\n')
+        finally:
+            gz.close()
+        return offset, self.file.tell() - offset
+
+    def write_exchange(self, request, status, reason, headers, payload, size,
+                       digest, version=11):
+        """Writes the request record and the response record of an exchange.
+
+        :param request: prepared request which was sent.
+        :param status: http status code of the response.
+        :param reason: http reason phrase of the response.
+        :param headers: response headers as a list of pairs.
+        :param payload: readable file-like object of the response body,
+            it is read from its current position.
+        :param size: bytes of the response body.
+        :param digest: sha1 hash object of the response body.
+        :param version: (optional) http version of the response i.e. 10 or 11.
+        """
+        now = time.time()
+        date = warc_date(now)
+        head = response_head(status, reason, headers, version)
+        body = request.body
+        if isinstance(body, text_type):
+            body = body.encode('utf-8')
+        if not isinstance(body, binary_type):
+            body = b''
+        req_head = request_head(request) + body
+        response_id = self.record_id()
+        location = dict((k.lower(), v) for k, v in headers).get('location')
+        content_type = dict((k.lower(), v) for k, v in headers).get('content-type')
+
+        with self.lock:
+            if self.file is None or self.file.tell() >= self.max_size:
+                self._rotate()
+            offset, length = self._write_record([
+                ('WARC-Type', 'response'),
+                ('WARC-Record-ID', response_id),
+                ('WARC-Date', date),
+                ('WARC-Target-URI', request.url),
+                ('WARC-Warcinfo-ID', self.warcinfo_id),
+                ('Content-Type', 'application/http; msgtype=response'),
+                ('WARC-Payload-Digest', payload_digest(digest)),
+            ], head, payload, len(head) + size)
+            self._write_record([
+                ('WARC-Type', 'request'),
+                ('WARC-Record-ID', self.record_id()),
+                ('WARC-Date', date),
+                ('WARC-Target-URI', request.url),
+                ('WARC-Warcinfo-ID', self.warcinfo_id),
+                ('WARC-Concurrent-To', response_id),
+                ('Content-Type', 'application/http; msgtype=request'),
+            ], req_head, None, len(req_head))
+            self.cdx.append(' '.join([
+                surt(request.url), time.strftime('%Y%m%d%H%M%S', time.gmtime(now)), request.url,
+                (content_type or 'unk').split(';')[0].strip().replace(' ', '') or 'unk',
+                str(status), payload_digest(digest)[5:], location or '-', '-',
+                str(length), str(offset), self.filename,
+            ]).replace('\n', ''))
+
+    def _rotate(self):
+        if self.file is not None:
+            self._write_cdx()
+            self.file.close()
+        self._open()
+
+    def _write_cdx(self):
+        """Writes the sorted index of the current file next to it."""
+        if self.filename is None:
+            return
+        path = os.path.join(self.path, self.filename[:-len('.warc.gz')] + '.cdx')
+        with open(path, 'wb') as f:
+            f.write(_encode(cdx_header + '\n'))
+            for line in sorted(self.cdx):
+                f.write(_encode(line + '\n'))
+
+    def flush(self):
+        """Flushes the current file and writes its index."""
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+                self._write_cdx()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self._write_cdx()
+                self.file.close()
+                self.file = None